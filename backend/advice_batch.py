@@ -0,0 +1,217 @@
+import asyncio
+import logging
+import os
+import time
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional, Tuple
+
+from fastapi import HTTPException
+
+from . import advice_pipeline
+from . import cache
+from . import metrics
+from . import prompts
+from .models import BatchAdviceItem, BatchAdviceResponse, BatchAdviceResult, LLMDesignOutput
+
+logger = logging.getLogger(__name__)
+
+# POST /get_advice/batch: flera trädgårdar (eller stilvarianter av samma trädgård) i en request.
+# Varje unik bild förbehandlas, laddas upp och analyseras en gång; designanropen körs samtidigt
+# men högst BATCH_DESIGN_CONCURRENCY åt gången, och varje post får ett eget resultat eller fel.
+BATCH_MAX_ITEMS = int(os.getenv("BATCH_MAX_ITEMS", "20"))
+BATCH_MAX_VARIANTS = int(os.getenv("BATCH_MAX_VARIANTS", "4"))
+BATCH_DESIGN_CONCURRENCY = int(os.getenv("BATCH_DESIGN_CONCURRENCY", "4"))
+# Stilvarianter av en post begärs i ett enda Gemini-anrop; saknade varianter designas var för sig.
+BATCH_VARIANTS_SINGLE_CALL = os.getenv("BATCH_VARIANTS_SINGLE_CALL", "true").lower() == "true"
+
+_batch_results_total = metrics.counter("batch_results_total", "Resultat i batch-requests per utfall (succeeded/failed)")
+_batch_variants_total = metrics.counter("batch_variants_total", "Stilvarianter per källa (single_call/separate_call)")
+_batch_seconds = metrics.histogram("batch_seconds", "Total tid per batch-request")
+
+ImageFile = Tuple[Optional[bytes], Optional[str], str] # Som advice_pipeline.read_image_file
+
+
+@dataclass
+class _Unit:
+    # En design i batchen: en post, eller en stilvariant av en post.
+    index: int
+    variant: Optional[str]
+    run: advice_pipeline.AdviceRun
+    output: Optional[LLMDesignOutput] = None
+    timings: Dict[str, float] = field(default_factory=dict)
+    result: Optional[BatchAdviceResult] = None
+
+
+def validate_items(items: List[BatchAdviceItem], image_count: int):
+    if not items:
+        raise HTTPException(status_code=400, detail="Batchen innehåller inga poster.")
+    if len(items) > BATCH_MAX_ITEMS:
+        raise HTTPException(status_code=400, detail=f"Högst {BATCH_MAX_ITEMS} poster per batch.")
+    # Varje bild läses och valideras innan batchen körs, så fler bilder än poster (och därmed än
+    # BATCH_MAX_ITEMS) nekas direkt.
+    if image_count > len(items):
+        raise HTTPException(status_code=400, detail=f"{image_count} bilder men bara {len(items)} poster; skicka högst en bild per post.")
+    for i, item in enumerate(items):
+        if item.image_index is not None and not 0 <= item.image_index < image_count:
+            raise HTTPException(status_code=400, detail=f"Post {i}: image_index {item.image_index} finns inte bland de {image_count} bilderna.")
+        if item.variants is not None and not 1 <= len(item.variants) <= BATCH_MAX_VARIANTS:
+            raise HTTPException(status_code=400, detail=f"Post {i}: mellan 1 och {BATCH_MAX_VARIANTS} varianter per post.")
+
+
+def referenced_images(items: List[BatchAdviceItem]) -> List[int]:
+    """Bildindex som någon post pekar på; bara de bilderna behöver läsas."""
+    return sorted({item.image_index for item in items if item.image_index is not None})
+
+
+def _error(e: Exception, request_id: str) -> dict:
+    if isinstance(e, HTTPException):
+        return {"status": e.status_code, "detail": e.detail}
+    logger.error(f"Request [{request_id}]: Oväntat serverfel i batchpost: {e}", exc_info=True)
+    return {"status": 500, "detail": f"Ett oväntat internt fel uppstod (ID: {request_id}). Kontakta support om problemet kvarstår."}
+
+
+async def _analyze_images(
+    request_id: str,
+    items: List[BatchAdviceItem],
+    images: Dict[int, ImageFile]
+) -> Tuple[Dict[int, advice_pipeline.AdviceRun], Dict[int, dict], List[advice_pipeline.AdviceRun]]:
+    """Förbehandlar, laddar upp och analyserar varje unik bild en gång.
+
+    Returnerar (körning per bildindex, fel per bildindex, de unika körningarna).
+    """
+    used = referenced_images(items)
+    by_hash: Dict[str, advice_pipeline.AdviceRun] = {}
+    runs: Dict[int, advice_pipeline.AdviceRun] = {}
+    for image_index in used:
+        contents, _, analysis_text = images[image_index]
+        key = await asyncio.to_thread(cache.content_hash, contents) if contents is not None else f"tom:{image_index}"
+        run = by_hash.get(key)
+        if run is None:
+            run = advice_pipeline.AdviceRun(f"{request_id}:bild{len(by_hash)}", "", "")
+            run.image_analysis_result = analysis_text
+            by_hash[key] = run
+        runs[image_index] = run
+
+    async def analyze(run: advice_pipeline.AdviceRun, image_index: int):
+        contents, mime_type, _ = images[image_index]
+        if contents is not None:
+            await run.start_image(contents, mime_type)
+        await run.image_analysis()
+
+    first_index = {id(run): image_index for image_index, run in reversed(list(runs.items()))}
+    unique = list(by_hash.values())
+    outcomes = await asyncio.gather(
+        *(analyze(run, first_index[id(run)]) for run in unique), return_exceptions=True
+    )
+    failed_runs = {id(run): _error(outcome, run.request_id) for run, outcome in zip(unique, outcomes) if isinstance(outcome, Exception)}
+    errors = {image_index: failed_runs[id(run)] for image_index, run in runs.items() if id(run) in failed_runs}
+    return runs, errors, unique
+
+
+async def run_batch(request_id: str, items: List[BatchAdviceItem], images: Dict[int, ImageFile]) -> BatchAdviceResponse:
+    """images är de lästa bilderna per image_index (se referenced_images)."""
+    started = time.perf_counter()
+    semaphore = asyncio.Semaphore(max(1, BATCH_DESIGN_CONCURRENCY))
+
+    def elapsed_ms() -> float:
+        return round((time.perf_counter() - started) * 1000, 1)
+
+    def record(unit: _Unit, response=None, error: Optional[dict] = None):
+        status = "succeeded" if error is None else "failed"
+        _batch_results_total.inc(result=status)
+        unit.result = BatchAdviceResult(
+            index=unit.index,
+            variant=unit.variant,
+            status=status,
+            result=response,
+            error=error,
+            latency_ms=elapsed_ms(),
+            stage_timings_ms={**unit.timings, **unit.run.stage_timings_ms}
+        )
+
+    image_runs, image_errors, unique_runs = await _analyze_images(request_id, items, images)
+    analysis_ms = elapsed_ms()
+    units_by_item: List[List[_Unit]] = []
+    for index, item in enumerate(items):
+        units = []
+        for variant in item.variants or [None]:
+            preferences = prompts.variant_preferences(item.preferences, variant) if variant else item.preferences
+            run = advice_pipeline.AdviceRun(f"{request_id}:{index}" + (f":{len(units)}" if variant else ""), item.location, preferences)
+            if item.image_index is not None:
+                run.share_image(image_runs[item.image_index])
+            units.append(_Unit(index, variant, run, timings={"batch_image_analysis": analysis_ms}))
+        units_by_item.append(units)
+
+    async def slot(unit: _Unit):
+        # Tiden i kö för ett designanrop redovisas per post.
+        waited = time.perf_counter()
+        await semaphore.acquire()
+        unit.timings["batch_wait"] = unit.timings.get("batch_wait", 0) + round((time.perf_counter() - waited) * 1000, 1)
+
+    async def finish(unit: _Unit):
+        try:
+            if unit.output is None:
+                await slot(unit)
+                try:
+                    unit.output = await unit.run.design()
+                finally:
+                    semaphore.release()
+                if unit.variant:
+                    _batch_variants_total.inc(source="separate_call")
+            record(unit, response=await unit.run.finish(unit.output))
+        except Exception as e:
+            record(unit, error=_error(e, unit.run.request_id))
+        finally:
+            unit.run.cancel_pending()
+
+    async def process(item: BatchAdviceItem, units: List[_Unit]):
+        if item.image_index in image_errors:
+            for unit in units:
+                record(unit, error=image_errors[item.image_index])
+                unit.run.cancel_pending()
+            return
+        if BATCH_VARIANTS_SINGLE_CALL and len(units) > 1:
+            # Den första variantens körning bär det gemensamma anropet (med postens egna önskemål).
+            caller = advice_pipeline.AdviceRun(units[0].run.request_id, item.location, item.preferences)
+            caller.image_analysis_result = units[0].run.image_analysis_result
+            await slot(units[0])
+            try:
+                variants = await caller.design_variants([unit.variant for unit in units])
+            except Exception as e:
+                logger.warning(f"Request [{caller.request_id}]: Variantanropet misslyckades ({str(e)[:200]}), designar varianterna var för sig.")
+                variants = []
+            finally:
+                semaphore.release()
+            for unit, output in zip(units, variants):
+                unit.output = output
+                unit.timings.update(caller.stage_timings_ms)
+                _batch_variants_total.inc(source="single_call")
+        await asyncio.gather(*(finish(unit) for unit in units))
+
+    try:
+        await asyncio.gather(*(process(item, units) for item, units in zip(items, units_by_item)))
+    finally:
+        # En bild som någon lyckad post använder laddas klart av postens bakgrundssparande (share_image);
+        # övriga uppladdningar och analyser avbryts.
+        in_use = {
+            id(image_runs[item.image_index])
+            for item, units in zip(items, units_by_item)
+            if item.image_index is not None and any(u.result is not None and u.result.status == "succeeded" for u in units)
+        }
+        for run in unique_runs:
+            if id(run) in in_use:
+                run.upload_task = None
+            run.cancel_pending()
+
+    results = [unit.result for units in units_by_item for unit in units]
+    total_s = time.perf_counter() - started
+    _batch_seconds.observe(total_s)
+    ok = sum(1 for r in results if r.status == "succeeded")
+    logger.info(f"Request [{request_id}]: Batch klar, {ok} av {len(results)} lyckades på {total_s:.1f}s ({len(unique_runs)} unika bilder).")
+    return BatchAdviceResponse(
+        results=results,
+        succeeded=ok,
+        failed=len(results) - ok,
+        unique_images=len(unique_runs),
+        total_latency_ms=round(total_s * 1000, 1)
+    )
@@ -0,0 +1,312 @@
+import asyncio
+import logging
+import os
+import time
+from contextlib import contextmanager
+from typing import Any, AsyncIterator, Dict, List, Optional, Set, Tuple
+
+from fastapi import HTTPException, UploadFile
+
+from . import cache
+from . import db_writer
+from . import image_processing
+from . import llm_services
+from . import plan_storage
+from . import supabase_services
+from . import tracing
+from .models import AdviceResponse, GardenPlanData, LayoutReport, LLMDesignOutput, UserInput
+
+logger = logging.getLogger(__name__)
+
+# Gemensam rådgivningskedja för /get_advice och /get_advice/stream.
+# Uppladdning och bildanalys startar som egna tasks när bytes finns i minnet; bara designanropet
+# väntar på analystexten, och uppladdning + DB-sparande blir klara i bakgrunden.
+
+# Tidsgränser per steg (sekunder).
+UPLOAD_TIMEOUT_S = float(os.getenv("UPLOAD_TIMEOUT_S", "30"))
+IMAGE_ANALYSIS_TIMEOUT_S = float(os.getenv("IMAGE_ANALYSIS_TIMEOUT_S", "60"))
+DESIGN_TIMEOUT_S = float(os.getenv("DESIGN_TIMEOUT_S", "120"))
+
+NO_IMAGE_ANALYSIS = "Ingen bildanalys utförd (ingen bild skickad)."
+
+# Starka referenser till bakgrundstasks så att de inte skräpsamlas innan de är klara.
+_background_tasks: Set[asyncio.Task] = set()
+
+
+def spawn_background(coro) -> asyncio.Task:
+    task = asyncio.create_task(coro)
+    _background_tasks.add(task)
+    task.add_done_callback(_background_tasks.discard)
+    return task
+
+
+def preload_rendering():
+    """Importerar layoutlagningen (numpy) och SVG-färgkontrollen (svgwrite) i förväg. Blockerande;
+    körs i bakgrunden vid start så att första requesten inte betalar för importerna."""
+    from . import layout # noqa: F401
+    from . import svg_generator
+    svg_generator.preload()
+
+
+async def read_image_file(request_id: str, imageFile: Optional[UploadFile]) -> Tuple[Optional[bytes], Optional[str], str]:
+    """Läser den uppladdade filen. Returnerar (bytes, mime_type, analystext om ingen bild kan användas)."""
+    if not (imageFile and imageFile.filename): # Kontrollera också att filename inte är tomt
+        logger.info(f"Request [{request_id}]: Ingen bildfil skickades med eller filnamn saknas.")
+        return None, None, NO_IMAGE_ANALYSIS
+    if imageFile.size == 0:
+        logger.info(f"Request [{request_id}]: Mottagen bildfil har storlek 0, ingen bild behandlas.")
+        return None, None, "Bildanalys kunde inte utföras (tom fil)."
+
+    logger.info(f"Request [{request_id}]: Bearbetar uppladdad bild: {imageFile.filename}, Storlek: {imageFile.size}, Typ: {imageFile.content_type}")
+    # Spara den faktiska MIME-typen från UploadFile-objektet
+    actual_image_mime_type = imageFile.content_type
+    with tracing.span("read_upload"):
+        contents = await imageFile.read()
+    tracing.record_bytes("read_upload", len(contents))
+
+    if not contents:
+        logger.warning(f"Request [{request_id}]: Innehållet i den uppladdade filen är tomt efter läsning.")
+        return None, None, "Bildanalys kunde inte utföras (tomt filinnehåll)."
+    if not actual_image_mime_type:
+        logger.warning(f"Request [{request_id}]: MIME-typ saknas för uppladdad fil, kan inte ladda upp eller analysera.")
+        return None, None, "Bildanalys kunde inte utföras (MIME-typ saknas)."
+    return contents, actual_image_mime_type, NO_IMAGE_ANALYSIS
+
+
+async def _archive_original(request_id: str, contents: bytes, mime_type: str, original_hash: str):
+    # Originalbilden sparas orörd i en egen mapp när IMAGE_KEEP_ORIGINAL är satt.
+    try:
+        url, _ = await asyncio.wait_for(
+            supabase_services.upload_image_bytes(contents, mime_type, f"garden_image_{original_hash}", folder="originals"),
+            timeout=UPLOAD_TIMEOUT_S
+        )
+        logger.info(f"Request [{request_id}]: Originalbild arkiverad: {url}")
+    except Exception as e:
+        logger.error(f"Request [{request_id}]: Kunde inte arkivera originalbilden (icke-kritiskt): {e}")
+
+
+async def _persist_advice(
+    request_id: str,
+    upload_task: Optional[asyncio.Task],
+    location: str,
+    preferences: str,
+    image_analysis_result: str,
+    text_advice: str,
+    plan: GardenPlanData,
+    svg_plan_str: str
+):
+    # Väntar in bilduppladdningen (för URL:en) och köar sedan raden. Körs efter att svaret skickats.
+    image_supabase_url: Optional[str] = None
+    if upload_task is not None:
+        try:
+            image_supabase_url, _ = await upload_task
+            logger.info(f"Request [{request_id}]: Bild uppladdad till: {image_supabase_url}")
+        except asyncio.TimeoutError:
+            logger.error(f"Request [{request_id}]: Bilduppladdningen tog längre än {UPLOAD_TIMEOUT_S}s och avbröts (icke-kritiskt).")
+        except asyncio.CancelledError:
+            logger.warning(f"Request [{request_id}]: Bilduppladdningen avbröts.")
+            raise
+        except Exception as upload_e:
+            logger.error(f"Request [{request_id}]: Fel vid bilduppladdning (icke-kritiskt): {upload_e}", exc_info=True)
+
+    user_data = UserInput(location=location, preferences=preferences, image_supabase_url=image_supabase_url)
+    # Ingen DB-rundtur här: raden läggs i write-behind-kön och sparas i batch av db_writer.
+    db_writer.garden_designs_writer.enqueue(supabase_services.build_garden_design_row(
+        user_input=user_data.dict(), # Skicka som dict
+        image_analysis=image_analysis_result,
+        text_advice=text_advice,
+        plan=plan,
+        image_supabase_url=image_supabase_url,
+        svg_plan_str=svg_plan_str
+    ))
+    logger.info(f"Request [{request_id}]: Resultat lagt i kön för DB-sparande.")
+
+
+async def _shared_result(task: asyncio.Task):
+    # shield: den här väntaren kan avbrytas utan att den delade tasken avbryts.
+    return await asyncio.shield(task)
+
+
+class AdviceRun:
+    """Tillståndet för en körning av kedjan: pågående tasks och bildanalysens resultat."""
+
+    def __init__(self, request_id: str, location: str, preferences: str):
+        self.request_id = request_id
+        self.location = location
+        self.preferences = preferences
+        self.image_analysis_result: str = NO_IMAGE_ANALYSIS
+        self.upload_task: Optional[asyncio.Task] = None
+        self.analysis_task: Optional[asyncio.Task] = None
+        self.stage_timings_ms: Dict[str, float] = {} # Tid per steg i kedjan, t.ex. för jobbposter
+
+    @contextmanager
+    def timed(self, stage: str):
+        # Steget mäts även som span (stage_duration_seconds och Server-Timing, se tracing.py).
+        started = time.perf_counter()
+        try:
+            with tracing.span(stage):
+                yield
+        finally:
+            self.stage_timings_ms[stage] = round((time.perf_counter() - started) * 1000, 1)
+
+    async def start_image(self, contents: bytes, mime_type: str):
+        request_id = self.request_id
+        if image_processing.IMAGE_KEEP_ORIGINAL:
+            original_hash = await asyncio.to_thread(cache.content_hash, contents)
+            spawn_background(_archive_original(request_id, contents, mime_type, original_hash))
+
+        # Rotera, skala ner och koda om i trådpoolen innan bilden går vidare.
+        with self.timed("image_preprocess"):
+            processed = await image_processing.preprocess_image_async(contents, mime_type)
+        image_bytes = processed.data
+        image_mime_type = processed.mime_type
+        logger.info(f"Request [{request_id}]: Bild förbehandlad: {processed.original_size} -> {len(image_bytes)} bytes.")
+
+        # Bilden adresseras med sin innehållshash: samma foto laddas inte upp
+        # eller analyseras igen (se cache.py).
+        image_hash = await asyncio.to_thread(cache.content_hash, image_bytes)
+        unique_filename_stem = f"garden_image_{image_hash}"
+
+        # Råa bytes skickas direkt till både Storage och Vertex AI,
+        # ingen base64-data-URL och ingen ny nedladdning från Supabase.
+        self.upload_task = asyncio.create_task(asyncio.wait_for(
+            supabase_services.upload_image_bytes(image_bytes, image_mime_type, unique_filename_stem),
+            timeout=UPLOAD_TIMEOUT_S
+        ))
+        self.analysis_task = asyncio.create_task(asyncio.wait_for(
+            llm_services.analyze_image_with_google_llm(
+                image_url=None,
+                actual_mime_type=image_mime_type, # Skicka med den korrekta MIME-typen
+                image_bytes=image_bytes,
+                image_hash=image_hash
+            ),
+            timeout=IMAGE_ANALYSIS_TIMEOUT_S
+        ))
+
+    def share_image(self, source: "AdviceRun"):
+        """Använder en annan körnings bild (batch): samma analystext och samma uppladdning."""
+        self.image_analysis_result = source.image_analysis_result
+        if source.upload_task is not None:
+            self.upload_task = asyncio.create_task(_shared_result(source.upload_task))
+
+    async def image_analysis(self) -> str:
+        if self.analysis_task is not None:
+            try:
+                with self.timed("image_analysis"):
+                    self.image_analysis_result = await self.analysis_task
+                logger.info(f"Request [{self.request_id}]: Bildanalys klar: {self.image_analysis_result[:100]}...") # Logga början av resultatet
+            except asyncio.TimeoutError:
+                logger.error(f"Request [{self.request_id}]: Bildanalysen tog längre än {IMAGE_ANALYSIS_TIMEOUT_S}s och avbröts.")
+                self.image_analysis_result = "Bildanalys kunde inte utföras (tidsgränsen överskreds)."
+            self.analysis_task = None
+        return self.image_analysis_result
+
+    async def design(self) -> LLMDesignOutput:
+        logger.info(f"Request [{self.request_id}]: Hämtar trädgårdsråd från LLM.")
+        try:
+            with self.timed("design"):
+                llm_output: LLMDesignOutput = await asyncio.wait_for(
+                    llm_services.get_garden_advice_from_google_llm(
+                        image_analysis_text=self.image_analysis_result, # Använd resultatet från bildanalysen
+                        user_location=self.location,
+                        user_preferences=self.preferences
+                    ),
+                    timeout=DESIGN_TIMEOUT_S
+                )
+        except asyncio.TimeoutError:
+            logger.error(f"Request [{self.request_id}]: Designanropet tog längre än {DESIGN_TIMEOUT_S}s och avbröts.")
+            raise HTTPException(status_code=504, detail="AI:n tog för lång tid att svara. Försök igen om en stund.")
+        logger.info(f"Request [{self.request_id}]: LLM-råd mottaget.")
+        return llm_output
+
+    async def design_variants(self, styles: List[str]) -> List[LLMDesignOutput]:
+        """En design per stil i ett enda anrop; kan ge färre än len(styles) (se llm_services)."""
+        logger.info(f"Request [{self.request_id}]: Hämtar {len(styles)} stilvarianter från LLM.")
+        try:
+            with self.timed("design_variants"):
+                variants = await asyncio.wait_for(
+                    llm_services.get_garden_variants_from_google_llm(
+                        image_analysis_text=self.image_analysis_result,
+                        user_location=self.location,
+                        user_preferences=self.preferences,
+                        styles=styles
+                    ),
+                    timeout=DESIGN_TIMEOUT_S
+                )
+        except asyncio.TimeoutError:
+            logger.error(f"Request [{self.request_id}]: Variantanropet tog längre än {DESIGN_TIMEOUT_S}s och avbröts.")
+            raise HTTPException(status_code=504, detail="AI:n tog för lång tid att svara. Försök igen om en stund.")
+        logger.info(f"Request [{self.request_id}]: {len(variants)} varianter mottagna.")
+        return variants
+
+    async def design_stream(self) -> AsyncIterator[Tuple[str, Any]]:
+        """Strömmande designanrop: ger ("text_delta", text) medan text_advice genereras och sist ("result", LLMDesignOutput)."""
+        logger.info(f"Request [{self.request_id}]: Hämtar trädgårdsråd från LLM (strömmande).")
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + DESIGN_TIMEOUT_S
+        stream = llm_services.stream_garden_advice_from_google_llm(
+            image_analysis_text=self.image_analysis_result,
+            user_location=self.location,
+            user_preferences=self.preferences
+        )
+        try:
+            while True:
+                try:
+                    event = await asyncio.wait_for(stream.__anext__(), timeout=max(0.0, deadline - loop.time()))
+                except StopAsyncIteration:
+                    return
+                except asyncio.TimeoutError:
+                    logger.error(f"Request [{self.request_id}]: Designanropet tog längre än {DESIGN_TIMEOUT_S}s och avbröts.")
+                    raise HTTPException(status_code=504, detail="AI:n tog för lång tid att svara. Försök igen om en stund.")
+                yield event
+        finally:
+            await stream.aclose()
+
+    def _render_plan(self, llm_output: LLMDesignOutput) -> Tuple[LayoutReport, str]:
+        from . import layout # numpy; importeras i förväg av preload_rendering()
+
+        # Växterna flyttas på plats; llm_output är väntarens egen kopia (se llm_services).
+        with self.timed("layout_repair"):
+            layout_report = layout.repair_plan(llm_output.garden_plan_data)
+        logger.info(f"Request [{self.request_id}]: Genererar SVG-plan.")
+        with self.timed("svg_render"):
+            svg_plan_str = plan_storage.render_svg(llm_output.garden_plan_data)
+        tracing.record_bytes("svg_render", len(svg_plan_str))
+        logger.info(f"Request [{self.request_id}]: SVG-plan genererad.")
+        return layout_report, svg_plan_str
+
+    async def finish(self, llm_output: LLMDesignOutput) -> AdviceResponse:
+        """Lagar layouten, ritar SVG-planen, lämnar över uppladdning + DB-sparande till bakgrunden och bygger svaret."""
+        # Layoutlagning och ritning växer med antalet växter och körs därför i en tråd.
+        layout_report, svg_plan_str = await asyncio.to_thread(self._render_plan, llm_output)
+
+        spawn_background(_persist_advice(
+            self.request_id,
+            self.upload_task,
+            self.location,
+            self.preferences,
+            self.image_analysis_result,
+            llm_output.text_advice,
+            llm_output.garden_plan_data,
+            svg_plan_str
+        ))
+        self.upload_task = None # Ägs nu av bakgrundstasken
+
+        return AdviceResponse(
+            text_advice=llm_output.text_advice,
+            svg_plan=svg_plan_str,
+            image_analysis_text=self.image_analysis_result,
+            layout=layout_report
+        )
+
+    def cancel_pending(self):
+        # Vid fel eller när klienten kopplar ner avbryts de steg som fortfarande körs.
+        for task in (self.analysis_task, self.upload_task):
+            if task is None:
+                continue
+            if not task.done():
+                task.cancel()
+            elif not task.cancelled():
+                task.exception() # Markera ev. fel som hämtat så att asyncio inte varnar
+        self.analysis_task = None
+        self.upload_task = None
@@ -0,0 +1,183 @@
+import abc
+import asyncio
+import hashlib
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Optional, Union
+
+from . import metrics
+
+logger = logging.getLogger(__name__)
+
+# Innehållsadresserad cache. Standard är en LRU med TTL i processen; sätt CACHE_BACKEND=sqlite
+# (och CACHE_SQLITE_PATH) för att flera uvicorn-workers ska dela träffar via en gemensam fil.
+CACHE_BACKEND = os.getenv("CACHE_BACKEND", "memory")
+# Varje namnrymd har ett eget tak, så att t.ex. designsidor inte kan trycka ut bildanalyser.
+# CACHE_MAX_ENTRIES_<NAMNRYMD> (t.ex. CACHE_MAX_ENTRIES_IMAGE_ANALYSIS) sätter taket för en enskild.
+CACHE_MAX_ENTRIES = int(os.getenv("CACHE_MAX_ENTRIES", "1024"))
+CACHE_DEFAULT_TTL_S = float(os.getenv("CACHE_DEFAULT_TTL_S", str(24 * 3600)))
+CACHE_SQLITE_PATH = os.getenv("CACHE_SQLITE_PATH", "garden_cache.sqlite3")
+
+_requests_total = metrics.counter("cache_requests_total", "Cache-uppslag per namnrymd och utfall (hit/miss)")
+
+
+def content_hash(data: Union[bytes, memoryview]) -> str:
+    """SHA-256 av bildbytes, används som innehållsadress för uppladdningar och analyscache."""
+    return hashlib.sha256(data).hexdigest()
+
+
+class CacheBackend(abc.ABC):
+    # Gränssnitt för lagringen bakom Cache. Nycklar är strängar, värden JSON-serialiserbara.
+
+    @abc.abstractmethod
+    async def get(self, key: str) -> Optional[Any]:
+        ...
+
+    @abc.abstractmethod
+    async def set(self, key: str, value: Any, ttl_s: float):
+        ...
+
+    def close(self):
+        pass
+
+
+class MemoryCacheBackend(CacheBackend):
+    def __init__(self, max_entries: int = CACHE_MAX_ENTRIES):
+        self.max_entries = max_entries
+        self._entries: "OrderedDict[str, tuple]" = OrderedDict()
+
+    async def get(self, key: str) -> Optional[Any]:
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        value, expires_at = entry
+        if expires_at < time.monotonic():
+            del self._entries[key]
+            return None
+        self._entries.move_to_end(key)
+        return value
+
+    async def set(self, key: str, value: Any, ttl_s: float):
+        self._entries[key] = (value, time.monotonic() + ttl_s)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+
+class SQLiteCacheBackend(CacheBackend):
+    # Delad cache för flera processer på samma maskin. Anropen körs i en tråd för att inte blockera loopen.
+    # Med key_prefix (namnrymdens "namn:") räknas och gallras bara den namnrymdens rader mot max_entries.
+
+    def __init__(self, path: str = CACHE_SQLITE_PATH, max_entries: int = CACHE_MAX_ENTRIES, key_prefix: str = ""):
+        self.path = path
+        self.max_entries = max_entries
+        self.key_prefix = key_prefix
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, timeout=5)
+        with self._lock:
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS cache ("
+                "key TEXT PRIMARY KEY, value TEXT NOT NULL, expires_at REAL NOT NULL, accessed_at REAL NOT NULL)"
+            )
+            self._conn.execute("CREATE INDEX IF NOT EXISTS cache_accessed_at ON cache (accessed_at)")
+            self._conn.commit()
+
+    def _get(self, key: str) -> Optional[Any]:
+        now = time.time()
+        with self._lock:
+            row = self._conn.execute("SELECT value, expires_at FROM cache WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                return None
+            if row[1] < now:
+                self._conn.execute("DELETE FROM cache WHERE key = ?", (key,))
+                self._conn.commit()
+                return None
+            self._conn.execute("UPDATE cache SET accessed_at = ? WHERE key = ?", (now, key))
+            self._conn.commit()
+        return json.loads(row[0])
+
+    def _set(self, key: str, value: Any, ttl_s: float):
+        now = time.time()
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO cache (key, value, expires_at, accessed_at) VALUES (?, ?, ?, ?)",
+                (key, json.dumps(value, ensure_ascii=False), now + ttl_s, now)
+            )
+            # LRU-gallring: ta bort utgångna och de minst nyligen använda raderna över maxgränsen.
+            self._conn.execute("DELETE FROM cache WHERE expires_at < ?", (now,))
+            # Prefixet som nyckelintervall [prefix, prefix + U+FFFF) så att primärnyckelns index används.
+            self._conn.execute(
+                "DELETE FROM cache WHERE key IN (SELECT key FROM cache WHERE key >= ? AND key < ? "
+                "ORDER BY accessed_at DESC LIMIT -1 OFFSET ?)",
+                (self.key_prefix, self.key_prefix + "\uffff", self.max_entries)
+            )
+            self._conn.commit()
+
+    async def get(self, key: str) -> Optional[Any]:
+        return await asyncio.to_thread(self._get, key)
+
+    async def set(self, key: str, value: Any, ttl_s: float):
+        await asyncio.to_thread(self._set, key, value, ttl_s)
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+class Cache:
+    """En namnrymd i en CacheBackend, med egen TTL och hit/miss-räknare."""
+
+    def __init__(self, namespace: str, backend: CacheBackend, ttl_s: float = CACHE_DEFAULT_TTL_S):
+        self.namespace = namespace
+        self.backend = backend
+        self.ttl_s = ttl_s
+
+    async def get(self, key: str) -> Optional[Any]:
+        try:
+            value = await self.backend.get(f"{self.namespace}:{key}")
+        except Exception as e:
+            logger.warning(f"Cache '{self.namespace}': uppslag misslyckades, räknas som miss: {e}")
+            value = None
+        _requests_total.inc(cache=self.namespace, result="hit" if value is not None else "miss")
+        return value
+
+    async def set(self, key: str, value: Any, ttl_s: Optional[float] = None):
+        try:
+            await self.backend.set(f"{self.namespace}:{key}", value, ttl_s if ttl_s is not None else self.ttl_s)
+        except Exception as e:
+            logger.warning(f"Cache '{self.namespace}': kunde inte spara värde: {e}")
+
+
+def _namespace_max_entries(namespace: str) -> int:
+    return int(os.getenv(f"CACHE_MAX_ENTRIES_{namespace.upper()}", str(CACHE_MAX_ENTRIES)))
+
+
+def _build_backend(namespace: str, max_entries: int) -> CacheBackend:
+    if CACHE_BACKEND == "sqlite":
+        try:
+            logger.info(f"Cache '{namespace}': delad SQLite-cache i {CACHE_SQLITE_PATH}, max {max_entries} poster.")
+            return SQLiteCacheBackend(CACHE_SQLITE_PATH, max_entries, key_prefix=f"{namespace}:")
+        except Exception as e:
+            logger.error(f"Kunde inte öppna SQLite-cachen {CACHE_SQLITE_PATH}, använder minnescache: {e}")
+    elif CACHE_BACKEND != "memory":
+        logger.warning(f"Okänd CACHE_BACKEND '{CACHE_BACKEND}', använder minnescache.")
+    return MemoryCacheBackend(max_entries)
+
+
+# En backend per namnrymd, skapad vid första get_cache().
+_backends: Dict[str, CacheBackend] = {}
+_backends_lock = threading.Lock()
+
+
+def get_cache(namespace: str, ttl_s: float = CACHE_DEFAULT_TTL_S) -> Cache:
+    with _backends_lock:
+        backend = _backends.get(namespace)
+        if backend is None:
+            backend = _backends[namespace] = _build_backend(namespace, _namespace_max_entries(namespace))
+    return Cache(namespace, backend, ttl_s)
@@ -0,0 +1,276 @@
+import asyncio
+import json
+import logging
+import os
+import random
+import threading
+import time
+from typing import Awaitable, Callable, Dict, List, Optional, Set, Tuple
+
+from . import metrics
+from . import supabase_services
+from . import tracing
+
+logger = logging.getLogger(__name__)
+
+# Write-behind-kö för DB-sparande: requesten lägger bara raden i kön, en bakgrundstask
+# samlar rader till multi-row inserts och sparar dem i en lokal journal om Supabase inte svarar.
+DB_WRITE_BATCH_SIZE = int(os.getenv("DB_WRITE_BATCH_SIZE", "50"))
+DB_WRITE_FLUSH_INTERVAL_S = float(os.getenv("DB_WRITE_FLUSH_INTERVAL_S", "2"))
+DB_WRITE_MAX_QUEUE = int(os.getenv("DB_WRITE_MAX_QUEUE", "1000"))
+DB_WRITE_MAX_RETRIES = int(os.getenv("DB_WRITE_MAX_RETRIES", "4"))
+DB_WRITE_RETRY_BASE_S = float(os.getenv("DB_WRITE_RETRY_BASE_S", "0.5"))
+DB_WRITE_RETRY_MAX_S = float(os.getenv("DB_WRITE_RETRY_MAX_S", "10"))
+DB_WRITE_DRAIN_TIMEOUT_S = float(os.getenv("DB_WRITE_DRAIN_TIMEOUT_S", "20"))
+DB_WRITE_JOURNAL_PATH = os.getenv("DB_WRITE_JOURNAL_PATH", "garden_designs_journal.jsonl")
+
+_queue_depth = metrics.gauge("db_write_queue_depth", "Antal rader som väntar i write-behind-kön")
+_batch_size = metrics.histogram("db_write_batch_size", "Antal rader per multi-row insert")
+_flush_seconds = metrics.histogram("db_write_flush_seconds", "Tid för en flush inklusive omförsök")
+_write_latency_seconds = metrics.histogram("db_write_latency_seconds", "Tid från enqueue till att raden är sparad")
+_rows_total = metrics.counter("db_write_rows_total", "Rader per utfall (written/journaled/replayed)")
+_retries_total = metrics.counter("db_write_retries_total", "Antal omförsök mot databasen")
+
+_STOP = object()
+
+
+class WriteBehindQueue:
+    def __init__(
+        self,
+        name: str,
+        insert_batch: Callable[[List[dict]], Awaitable[object]],
+        journal_path: str,
+        batch_size: int = DB_WRITE_BATCH_SIZE,
+        flush_interval_s: float = DB_WRITE_FLUSH_INTERVAL_S,
+        max_queue: int = DB_WRITE_MAX_QUEUE,
+        max_retries: int = DB_WRITE_MAX_RETRIES
+    ):
+        self.name = name
+        self.insert_batch = insert_batch
+        self.journal_path = journal_path
+        self.batch_size = max(1, batch_size)
+        self.flush_interval_s = flush_interval_s
+        self.max_queue = max_queue
+        self.max_retries = max_retries
+        self._queue: Optional[asyncio.Queue] = None
+        self._worker: Optional[asyncio.Task] = None
+        self._replay_task: Optional[asyncio.Task] = None
+        self._journal_tasks: Set[asyncio.Task] = set()
+        self._journal_lock = threading.Lock()
+
+    @property
+    def replaying_path(self) -> str:
+        # Journalen under uppspelning; tas bort först när raderna är sparade.
+        return self.journal_path + ".replaying"
+
+    @property
+    def running(self) -> bool:
+        return self._worker is not None and not self._worker.done()
+
+    async def start(self):
+        # Kön skapas här så att den binds till appens event-loop.
+        self._queue = asyncio.Queue()
+        # Journalen från förra körningen spelas upp i bakgrunden så att starten inte väntar på databasen.
+        self._replay_task = asyncio.create_task(self._replay_journal(), name=f"write-behind-replay-{self.name}")
+        self._worker = asyncio.create_task(self._run(), name=f"write-behind-{self.name}")
+        logger.info(f"Write-behind-kö '{self.name}' startad (batch={self.batch_size}, intervall={self.flush_interval_s}s).")
+
+    def enqueue(self, row: dict):
+        """Lägger en rad i kön utan att vänta på databasen. Full eller stoppad kö skriver till journalen."""
+        if not self.running or self._queue.qsize() >= self.max_queue:
+            logger.warning(f"Write-behind-kö '{self.name}' är full eller inte startad, raden skrivs till journalen.")
+            self._append_journal_in_background([row])
+            return
+        self._queue.put_nowait((row, time.monotonic()))
+        _queue_depth.set(self._queue.qsize(), queue=self.name)
+
+    async def stop(self):
+        # Töm kön innan nedstängning; det som inte hinner sparas hamnar i journalen.
+        if self._replay_task is not None and not self._replay_task.done():
+            # Avbruten uppspelning ligger kvar i .replaying-filen och spelas upp vid nästa start.
+            self._replay_task.cancel()
+            try:
+                await self._replay_task
+            except asyncio.CancelledError:
+                pass
+        if self._journal_tasks:
+            await asyncio.gather(*self._journal_tasks)
+        if not self.running:
+            return
+        self._queue.put_nowait(_STOP)
+        try:
+            await asyncio.wait_for(asyncio.shield(self._worker), timeout=DB_WRITE_DRAIN_TIMEOUT_S)
+        except asyncio.TimeoutError:
+            logger.error(f"Write-behind-kö '{self.name}' hann inte tömmas på {DB_WRITE_DRAIN_TIMEOUT_S}s, resten skrivs till journalen.")
+            self._worker.cancel()
+            try:
+                await self._worker
+            except asyncio.CancelledError:
+                pass
+            remaining = []
+            while not self._queue.empty():
+                item = self._queue.get_nowait()
+                if item is not _STOP:
+                    remaining.append(item[0])
+            if remaining:
+                await asyncio.to_thread(self._append_journal, remaining)
+        _queue_depth.set(0, queue=self.name)
+        logger.info(f"Write-behind-kö '{self.name}' stoppad.")
+
+    async def _run(self):
+        while True:
+            batch, stopping = await self._next_batch()
+            _queue_depth.set(self._queue.qsize(), queue=self.name)
+            if batch:
+                await self._flush(batch)
+            if stopping:
+                return
+
+    async def _next_batch(self):
+        item = await self._queue.get()
+        if item is _STOP:
+            return [], True
+        batch = [item]
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + self.flush_interval_s
+        while len(batch) < self.batch_size:
+            timeout = deadline - loop.time()
+            if timeout <= 0:
+                break
+            try:
+                item = await asyncio.wait_for(self._queue.get(), timeout=timeout)
+            except asyncio.TimeoutError:
+                break
+            except asyncio.CancelledError:
+                self._append_journal([row for row, _ in batch])
+                raise
+            if item is _STOP:
+                # Resten av kön har redan lagts in före stoppsignalen, så den här batchen är den sista.
+                return batch, True
+            batch.append(item)
+        return batch, False
+
+    async def _insert_with_retries(self, rows: List[dict]) -> bool:
+        """En multi-row insert med exponentiell backoff. False om alla försök misslyckades."""
+        for attempt in range(self.max_retries + 1):
+            try:
+                with tracing.span("db_save"):
+                    await self.insert_batch(rows)
+                return True
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                if attempt == self.max_retries:
+                    logger.error(f"Write-behind-kö '{self.name}': kunde inte spara {len(rows)} rader efter {attempt + 1} försök: {e}")
+                    return False
+                delay = min(DB_WRITE_RETRY_MAX_S, DB_WRITE_RETRY_BASE_S * (2 ** attempt)) * random.uniform(0.5, 1.0)
+                logger.warning(f"Write-behind-kö '{self.name}': insert misslyckades ({e}), nytt försök om {delay:.1f}s.")
+                _retries_total.inc(queue=self.name)
+                await asyncio.sleep(delay)
+        return False
+
+    async def _flush(self, batch: list):
+        rows = [row for row, _ in batch]
+        started = time.monotonic()
+        try:
+            saved = await self._insert_with_retries(rows)
+        except asyncio.CancelledError:
+            self._append_journal(rows)
+            raise
+        if not saved:
+            await asyncio.to_thread(self._append_journal, rows)
+            return
+        done = time.monotonic()
+        _batch_size.observe(len(rows), queue=self.name)
+        _flush_seconds.observe(done - started, queue=self.name)
+        for _, enqueued_at in batch:
+            _write_latency_seconds.observe(done - enqueued_at, queue=self.name)
+        _rows_total.inc(len(rows), queue=self.name, result="written")
+        logger.info(f"Write-behind-kö '{self.name}': {len(rows)} rader sparade till DB.")
+
+    def _append_journal_in_background(self, rows: List[dict]):
+        # Filskrivningen görs i en tråd så att en full kö inte blockerar event-loopen.
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            self._append_journal(rows) # Ingen loop (t.ex. skript); skriv direkt
+            return
+        task = loop.create_task(asyncio.to_thread(self._append_journal, rows))
+        self._journal_tasks.add(task)
+        task.add_done_callback(self._journal_tasks.discard)
+
+    def _append_journal(self, rows: List[dict]):
+        try:
+            with self._journal_lock, open(self.journal_path, "a", encoding="utf-8") as journal:
+                for row in rows:
+                    journal.write(json.dumps(row, ensure_ascii=False) + "\n")
+            _rows_total.inc(len(rows), queue=self.name, result="journaled")
+            logger.warning(f"Write-behind-kö '{self.name}': {len(rows)} rader sparade i journalen {self.journal_path}.")
+        except Exception as e:
+            logger.error(f"Write-behind-kö '{self.name}': kunde inte skriva journalen {self.journal_path}, {len(rows)} rader förlorade: {e}", exc_info=True)
+
+    def _take_journal(self) -> List[dict]:
+        # Journalen döps om till .replaying-filen innan den läses. Finns en sådan kvar från en
+        # avbruten uppspelning läggs den nya journalen till i den, så att inga rader tappas.
+        with self._journal_lock:
+            if os.path.exists(self.journal_path):
+                if os.path.exists(self.replaying_path):
+                    with open(self.journal_path, "r", encoding="utf-8") as journal, \
+                            open(self.replaying_path, "a", encoding="utf-8") as replaying:
+                        replaying.write(journal.read())
+                    os.remove(self.journal_path)
+                else:
+                    os.replace(self.journal_path, self.replaying_path)
+            if not os.path.exists(self.replaying_path):
+                return []
+            with open(self.replaying_path, "r", encoding="utf-8") as replaying:
+                lines = replaying.readlines()
+        rows = []
+        for line in lines:
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                rows.append(json.loads(line))
+            except json.JSONDecodeError:
+                logger.warning(f"Write-behind-kö '{self.name}': hoppar över trasig journalrad: {line[:100]}")
+        return rows
+
+    def _finish_replay(self, failed: List[dict]):
+        # Rader som inte gick att spara läggs tillbaka i journalen innan .replaying-filen tas bort.
+        if failed:
+            self._append_journal(failed)
+        with self._journal_lock:
+            if os.path.exists(self.replaying_path):
+                os.remove(self.replaying_path)
+
+    async def _replay_journal(self):
+        rows = await asyncio.to_thread(self._take_journal)
+        if not rows:
+            return
+        logger.info(f"Write-behind-kö '{self.name}': spelar upp {len(rows)} rader från journalen.")
+        failed = []
+        for group in _group_by_keys(rows):
+            for start in range(0, len(group), self.batch_size):
+                chunk = group[start:start + self.batch_size]
+                if await self._insert_with_retries(chunk):
+                    _rows_total.inc(len(chunk), queue=self.name, result="replayed")
+                else:
+                    failed.extend(chunk)
+        await asyncio.to_thread(self._finish_replay, failed)
+        logger.info(f"Write-behind-kö '{self.name}': journalen uppspelad, {len(rows) - len(failed)} rader sparade, {len(failed)} tillbaka i journalen.")
+
+
+def _group_by_keys(rows: List[dict]) -> List[List[dict]]:
+    # En multi-row insert kräver samma kolumner i varje rad; journalen kan ha rader från olika versioner.
+    groups: Dict[Tuple[str, ...], List[dict]] = {}
+    for row in rows:
+        groups.setdefault(tuple(sorted(row)), []).append(row)
+    return list(groups.values())
+
+
+garden_designs_writer = WriteBehindQueue(
+    "garden_designs",
+    supabase_services.insert_garden_designs,
+    DB_WRITE_JOURNAL_PATH
+)
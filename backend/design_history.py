@@ -0,0 +1,156 @@
+import asyncio
+import base64
+import hashlib
+import json
+import logging
+import os
+from datetime import datetime
+from typing import List, Optional, Tuple
+
+from . import cache
+from . import plan_storage
+from . import single_flight
+from . import supabase_services
+from .models import DesignDetail, DesignListResponse, DesignSummary
+
+logger = logging.getLogger(__name__)
+
+# Läsning av sparade designer för GET /designs och GET /designs/{id}. Listan pagineras med keyset
+# på (created_at, id) och hämtar bara kolumnerna den visar; detaljvyn ritar SVG:n från plan_data.
+# Svaren serialiseras en gång och läggs i en read-through-cache tillsammans med sin ETag.
+DESIGNS_PAGE_SIZE = int(os.getenv("DESIGNS_PAGE_SIZE", "20"))
+DESIGNS_MAX_PAGE_SIZE = int(os.getenv("DESIGNS_MAX_PAGE_SIZE", "100"))
+# Nya rader hamnar överst i listan, så list-sidor cachas kort. Sparade rader ändras inte.
+DESIGNS_LIST_CACHE_TTL_S = float(os.getenv("DESIGNS_LIST_CACHE_TTL_S", "15"))
+DESIGNS_DETAIL_CACHE_TTL_S = float(os.getenv("DESIGNS_DETAIL_CACHE_TTL_S", "3600"))
+# Historiken visar alla användares plats, önskemål, bild och råd. Med DESIGNS_API_TOKEN krävs
+# "Authorization: Bearer <token>"; utan token är endpointsen avstängda (404) om de inte uttryckligen
+# öppnats med DESIGNS_PUBLIC=true.
+DESIGNS_API_TOKEN = os.getenv("DESIGNS_API_TOKEN")
+DESIGNS_PUBLIC = os.getenv("DESIGNS_PUBLIC", "false").lower() == "true"
+
+LIST_COLUMNS = "id,created_at,user_location,user_preferences,image_url"
+DETAIL_COLUMNS = (
+    "id,created_at,user_location,user_preferences,image_url,image_analysis_result,llm_text_advice,"
+    "plan_data,plan_encoding,plan_schema_version,plan_hash,svg_plan"
+)
+
+_cache = cache.get_cache("designs", DESIGNS_DETAIL_CACHE_TTL_S)
+_flights = single_flight.SingleFlight("designs")
+
+
+class InvalidCursorError(ValueError):
+    pass
+
+
+def encode_cursor(created_at: str, row_id: int) -> str:
+    raw = json.dumps([created_at, row_id], separators=(",", ":")).encode("utf-8")
+    return base64.urlsafe_b64encode(raw).decode("ascii").rstrip("=")
+
+
+def decode_cursor(cursor: str) -> Tuple[str, int]:
+    """(created_at, id) ur en cursor. created_at tolkas som ISO-tid och skrivs om i normaliserad form,
+    eftersom värdet hamnar i PostgREST-filtret (se supabase_services.select_garden_designs)."""
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+        created_at, row_id = json.loads(raw)
+        if not isinstance(created_at, str) or isinstance(row_id, bool) or not isinstance(row_id, int):
+            raise ValueError("cursor-fälten har fel typ")
+        return datetime.fromisoformat(created_at).isoformat(), row_id
+    except Exception as e:
+        raise InvalidCursorError(f"Ogiltig cursor: {cursor[:40]}") from e
+
+
+def _etag(body: str) -> str:
+    # Stark ETag: hash av exakt de bytes som skickas.
+    return '"' + hashlib.sha256(body.encode("utf-8")).hexdigest()[:32] + '"'
+
+
+def _cached_body(body: str) -> dict:
+    return {"body": body, "etag": _etag(body)}
+
+
+def etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    """If-None-Match jämförs svagt (RFC 9110): W/-prefix ignoreras, "*" matchar allt."""
+    if not if_none_match:
+        return False
+    for candidate in if_none_match.split(","):
+        candidate = candidate.strip()
+        if candidate == "*" or candidate.removeprefix("W/") == etag:
+            return True
+    return False
+
+
+def _summary(row: dict) -> dict:
+    return {
+        "id": row["id"],
+        "created_at": row["created_at"],
+        "location": row.get("user_location"),
+        "preferences": row.get("user_preferences"),
+        "image_url": row.get("image_url"),
+    }
+
+
+def _detail_body(row: dict) -> str:
+    # Körs i en tråd: avkodning och ritning växer med planens storlek.
+    plan = None
+    svg = None
+    if row.get("plan_data"):
+        try:
+            plan = plan_storage.decode_plan(row)
+            svg = plan_storage.render_svg(plan, row.get("plan_hash"))
+        except plan_storage.PlanDecodeError as e:
+            logger.error(f"Design {row['id']}: {e}")
+    if plan is None and row.get("svg_plan"):
+        # Rad som inte fyllts i av tools/backfill_plan_data.py än.
+        svg = row["svg_plan"]
+        plan = plan_storage.parse_svg_plan(svg)
+    detail = DesignDetail(
+        **_summary(row),
+        image_analysis_text=row.get("image_analysis_result"),
+        text_advice=row.get("llm_text_advice"),
+        garden_plan_data=plan,
+        svg_plan=svg
+    )
+    return detail.model_dump_json()
+
+
+async def list_designs(limit: Optional[int] = None, cursor: Optional[str] = None) -> dict:
+    """Sidan som {"body": JSON-text, "etag": ...}. Kastar InvalidCursorError för trasig cursor."""
+    limit = max(1, min(limit or DESIGNS_PAGE_SIZE, DESIGNS_MAX_PAGE_SIZE))
+    before = decode_cursor(cursor) if cursor else None
+    key = f"list:{limit}:{cursor or ''}"
+
+    async def load() -> dict:
+        cached = await _cache.get(key)
+        if cached is not None:
+            return cached
+        # En rad extra avgör om det finns en nästa sida utan separat count-fråga.
+        rows: List[dict] = await supabase_services.select_garden_designs(LIST_COLUMNS, limit + 1, before)
+        page = rows[:limit]
+        next_cursor = encode_cursor(page[-1]["created_at"], page[-1]["id"]) if len(rows) > limit else None
+        response = DesignListResponse(designs=[DesignSummary(**_summary(r)) for r in page], next_cursor=next_cursor)
+        result = _cached_body(response.model_dump_json())
+        await _cache.set(key, result, DESIGNS_LIST_CACHE_TTL_S)
+        return result
+
+    return await _flights.do(key, load)
+
+
+async def get_design(design_id: int) -> Optional[dict]:
+    """Designen som {"body": JSON-text, "etag": ...}, eller None om raden inte finns."""
+    key = f"id:{design_id}"
+
+    async def load() -> Optional[dict]:
+        cached = await _cache.get(key)
+        if cached is not None:
+            return cached
+        row = await supabase_services.get_garden_design(design_id, DETAIL_COLUMNS)
+        if row is None:
+            # Cachas inte: raden kan ligga kvar i write-behind-kön en stund.
+            return None
+        result = _cached_body(await asyncio.to_thread(_detail_body, row))
+        await _cache.set(key, result, DESIGNS_DETAIL_CACHE_TTL_S)
+        return result
+
+    return await _flights.do(key, load)
@@ -0,0 +1,86 @@
+import asyncio
+import io
+import logging
+import os
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from typing import Union
+
+from PIL import Image, ImageOps
+
+logger = logging.getLogger(__name__)
+
+# Förbehandling av uppladdade bilder innan de går till Storage och Vertex AI:
+# rotera enligt EXIF, skala ner till IMAGE_MAX_EDGE_PX, koda om och ta bort metadata.
+IMAGE_PREPROCESS_ENABLED = os.getenv("IMAGE_PREPROCESS_ENABLED", "true").lower() == "true"
+IMAGE_MAX_EDGE_PX = int(os.getenv("IMAGE_MAX_EDGE_PX", "1600"))
+IMAGE_OUTPUT_FORMAT = os.getenv("IMAGE_OUTPUT_FORMAT", "WEBP").upper() # WEBP eller JPEG
+IMAGE_OUTPUT_QUALITY = int(os.getenv("IMAGE_OUTPUT_QUALITY", "80"))
+IMAGE_KEEP_ORIGINAL = os.getenv("IMAGE_KEEP_ORIGINAL", "false").lower() == "true" # Arkivera originalet separat
+IMAGE_PREPROCESS_WORKERS = int(os.getenv("IMAGE_PREPROCESS_WORKERS", "2"))
+
+_OUTPUT_MIME_TYPES = {"WEBP": "image/webp", "JPEG": "image/jpeg", "PNG": "image/png"}
+
+# Pillow släpper GIL under avkodning, skalning och kodning, så en trådpool räcker.
+_executor = ThreadPoolExecutor(max_workers=IMAGE_PREPROCESS_WORKERS, thread_name_prefix="image-preprocess")
+
+
+@dataclass
+class ProcessedImage:
+    data: bytes
+    mime_type: str
+    original_size: int
+    width: int = 0
+    height: int = 0
+    processed: bool = True # False om originalet skickas vidare oförändrat
+
+
+def preprocess_image(
+    image_data: Union[bytes, memoryview],
+    mime_type: str,
+    max_edge_px: int = IMAGE_MAX_EDGE_PX,
+    output_format: str = IMAGE_OUTPUT_FORMAT,
+    quality: int = IMAGE_OUTPUT_QUALITY
+) -> ProcessedImage:
+    """Synkron förbehandling. Kan Pillow inte läsa bilden returneras originalet oförändrat."""
+    original_size = len(image_data)
+    try:
+        with Image.open(io.BytesIO(image_data)) as img:
+            img = ImageOps.exif_transpose(img) # Rotera enligt EXIF innan metadata tas bort
+            if output_format == "JPEG" and img.mode not in ("RGB", "L"):
+                img = img.convert("RGB")
+            elif img.mode not in ("RGB", "RGBA", "L"):
+                img = img.convert("RGBA" if "A" in img.getbands() else "RGB")
+
+            if max(img.size) > max_edge_px:
+                img.thumbnail((max_edge_px, max_edge_px), Image.LANCZOS)
+
+            buffer = io.BytesIO()
+            # Ingen exif/icc skickas med till save(), så metadata försvinner.
+            img.save(buffer, format=output_format, quality=quality, optimize=True)
+            width, height = img.size
+    except Exception as e:
+        logger.warning(f"Kunde inte förbehandla bilden ({mime_type}, {original_size} bytes), skickar originalet: {e}")
+        return ProcessedImage(data=bytes(image_data), mime_type=mime_type, original_size=original_size, processed=False)
+
+    data = buffer.getvalue()
+    logger.info(f"Bild förbehandlad: {original_size} -> {len(data)} bytes, {width}x{height} {output_format}.")
+    return ProcessedImage(
+        data=data,
+        mime_type=_OUTPUT_MIME_TYPES.get(output_format, mime_type),
+        original_size=original_size,
+        width=width,
+        height=height
+    )
+
+
+async def preprocess_image_async(image_data: Union[bytes, memoryview], mime_type: str) -> ProcessedImage:
+    # Körs i trådpoolen så att event-loopen inte blockeras av avkodning/kodning.
+    if not IMAGE_PREPROCESS_ENABLED:
+        return ProcessedImage(data=bytes(image_data), mime_type=mime_type, original_size=len(image_data), processed=False)
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(_executor, preprocess_image, image_data, mime_type)
+
+
+def shutdown():
+    _executor.shutdown(wait=False, cancel_futures=True)
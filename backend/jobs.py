@@ -0,0 +1,207 @@
+import asyncio
+import itertools
+import logging
+import math
+import os
+import time
+import uuid
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional
+
+from fastapi import HTTPException
+
+from . import advice_pipeline
+from . import metrics
+
+logger = logging.getLogger(__name__)
+
+# Asynkront jobb-API: POST /jobs lägger en körning av rådgivningskedjan i en prioritetskö och
+# svarar direkt; en begränsad pool av workers kör jobben och resultaten hålls en tid i minnet.
+JOB_WORKERS = int(os.getenv("JOB_WORKERS", "4"))
+JOB_QUEUE_MAX = int(os.getenv("JOB_QUEUE_MAX", "50"))
+JOB_RESULT_TTL_S = float(os.getenv("JOB_RESULT_TTL_S", "3600"))
+JOB_DEFAULT_DURATION_S = float(os.getenv("JOB_DEFAULT_DURATION_S", "30")) # Startvärde för Retry-After-uppskattningen
+# Tillåtna prioriteter för POST /jobs: 0 (standard) till 9. Ett tak gör att en klient inte kan
+# skicka ett godtyckligt stort tal och alltid hamna först i kön.
+JOB_MIN_PRIORITY = 0
+JOB_MAX_PRIORITY = 9
+
+_queue_depth = metrics.gauge("job_queue_depth", "Antal jobb som väntar i kön")
+_jobs_running = metrics.gauge("jobs_running", "Antal jobb som körs just nu")
+_jobs_total = metrics.counter("jobs_total", "Avslutade jobb per utfall (succeeded/failed)")
+_jobs_rejected_total = metrics.counter("jobs_rejected_total", "Jobb som nekats för att kön var full")
+_job_wait_seconds = metrics.histogram("job_wait_seconds", "Tid i kön innan ett jobb startar")
+_job_run_seconds = metrics.histogram("job_run_seconds", "Körtid per jobb")
+
+
+class QueueFullError(Exception):
+    def __init__(self, retry_after_s: int):
+        super().__init__(f"Jobbkön är full, försök igen om {retry_after_s}s.")
+        self.retry_after_s = retry_after_s
+
+
+@dataclass
+class Job:
+    id: str
+    location: str
+    preferences: str
+    priority: int
+    created_at: float
+    status: str = "queued" # queued -> running -> succeeded/failed
+    started_at: Optional[float] = None
+    finished_at: Optional[float] = None
+    stage_timings_ms: Dict[str, float] = field(default_factory=dict)
+    result: Optional[dict] = None
+    error: Optional[dict] = None
+    expires_at: Optional[float] = None
+    # Bilden hålls bara i minnet tills jobbet startat
+    image_contents: Optional[bytes] = field(default=None, repr=False)
+    image_mime_type: Optional[str] = None
+    image_analysis_result: str = advice_pipeline.NO_IMAGE_ANALYSIS
+
+    def to_dict(self) -> dict:
+        return {
+            "job_id": self.id,
+            "status": self.status,
+            "priority": self.priority,
+            "created_at": self.created_at,
+            "started_at": self.started_at,
+            "finished_at": self.finished_at,
+            "stage_timings_ms": self.stage_timings_ms,
+            "result": self.result,
+            "error": self.error,
+        }
+
+
+class JobManager:
+    def __init__(self, workers: int = JOB_WORKERS, queue_max: int = JOB_QUEUE_MAX, result_ttl_s: float = JOB_RESULT_TTL_S):
+        self.workers = max(1, workers)
+        self.queue_max = queue_max
+        self.result_ttl_s = result_ttl_s
+        self._queue: Optional[asyncio.PriorityQueue] = None
+        self._worker_tasks: List[asyncio.Task] = []
+        self._jobs: Dict[str, Job] = {}
+        self._sequence = itertools.count() # Ordning inom samma prioritet (FIFO)
+        self._avg_duration_s = JOB_DEFAULT_DURATION_S
+
+    @property
+    def running(self) -> bool:
+        return bool(self._worker_tasks) and not any(task.done() for task in self._worker_tasks)
+
+    async def start(self):
+        self._queue = asyncio.PriorityQueue()
+        self._worker_tasks = [
+            asyncio.create_task(self._worker(i), name=f"job-worker-{i}") for i in range(self.workers)
+        ]
+        logger.info(f"Jobbpool startad med {self.workers} workers (kö max {self.queue_max}).")
+
+    async def stop(self):
+        for task in self._worker_tasks:
+            task.cancel()
+        await asyncio.gather(*self._worker_tasks, return_exceptions=True)
+        self._worker_tasks = []
+        logger.info("Jobbpool stoppad.")
+
+    def retry_after_s(self) -> int:
+        # Uppskattad tid tills det finns plats: köns längd gånger snittiden, delat på antalet workers.
+        pending = self._queue.qsize() + 1 if self._queue else 1
+        return max(1, math.ceil(pending * self._avg_duration_s / self.workers))
+
+    def submit(
+        self,
+        location: str,
+        preferences: str,
+        image_contents: Optional[bytes],
+        image_mime_type: Optional[str],
+        image_analysis_result: str,
+        priority: int = 0
+    ) -> Job:
+        """Lägger ett jobb i kön. Högre priority (0–9, kläms annars) körs först. Kastar QueueFullError när kön är full."""
+        priority = max(JOB_MIN_PRIORITY, min(priority, JOB_MAX_PRIORITY))
+        self._purge_expired()
+        if self._queue is None or self._queue.qsize() >= self.queue_max:
+            _jobs_rejected_total.inc()
+            raise QueueFullError(self.retry_after_s())
+
+        job = Job(
+            id=str(uuid.uuid4()),
+            location=location,
+            preferences=preferences,
+            priority=priority,
+            created_at=time.time(),
+            image_contents=image_contents,
+            image_mime_type=image_mime_type,
+            image_analysis_result=image_analysis_result
+        )
+        self._jobs[job.id] = job
+        self._queue.put_nowait((-priority, next(self._sequence), job.id))
+        _queue_depth.set(self._queue.qsize())
+        logger.info(f"Jobb [{job.id}]: Lagt i kön (prioritet {priority}, kö {self._queue.qsize()}).")
+        return job
+
+    def get(self, job_id: str) -> Optional[Job]:
+        self._purge_expired()
+        return self._jobs.get(job_id)
+
+    def _purge_expired(self):
+        now = time.time()
+        expired = [job_id for job_id, job in self._jobs.items() if job.expires_at is not None and job.expires_at < now]
+        for job_id in expired:
+            del self._jobs[job_id]
+
+    async def _worker(self, index: int):
+        while True:
+            _, _, job_id = await self._queue.get()
+            _queue_depth.set(self._queue.qsize())
+            job = self._jobs.get(job_id)
+            if job is None:
+                continue
+            _jobs_running.inc()
+            try:
+                await self._run_job(job)
+            finally:
+                _jobs_running.dec()
+
+    async def _run_job(self, job: Job):
+        job.status = "running"
+        job.started_at = time.time()
+        _job_wait_seconds.observe(job.started_at - job.created_at)
+        logger.info(f"Jobb [{job.id}]: Startar efter {job.started_at - job.created_at:.1f}s i kön.")
+
+        run = advice_pipeline.AdviceRun(job.id, job.location, job.preferences)
+        run.image_analysis_result = job.image_analysis_result
+        contents, mime_type = job.image_contents, job.image_mime_type
+        job.image_contents = None
+        try:
+            if contents is not None:
+                await run.start_image(contents, mime_type)
+            await run.image_analysis()
+            llm_output = await run.design()
+            job.result = (await run.finish(llm_output)).model_dump()
+            job.status = "succeeded"
+        except HTTPException as http_exc:
+            logger.warning(f"Jobb [{job.id}]: Hanterat fel (HTTPException): {http_exc.status_code} - {http_exc.detail}")
+            job.status = "failed"
+            job.error = {"status": http_exc.status_code, "detail": http_exc.detail}
+        except asyncio.CancelledError:
+            job.status = "failed"
+            job.error = {"status": 503, "detail": "Jobbet avbröts när servern stängdes ner."}
+            raise
+        except Exception as e:
+            logger.error(f"Jobb [{job.id}]: Oväntat serverfel: {e}", exc_info=True)
+            job.status = "failed"
+            job.error = {"status": 500, "detail": f"Ett oväntat internt fel uppstod (ID: {job.id}). Kontakta support om problemet kvarstår."}
+        finally:
+            run.cancel_pending()
+            job.finished_at = time.time()
+            job.expires_at = job.finished_at + self.result_ttl_s
+            job.stage_timings_ms = {"queue_wait": round((job.started_at - job.created_at) * 1000, 1), **run.stage_timings_ms}
+            duration = job.finished_at - job.started_at
+            _job_run_seconds.observe(duration)
+            _jobs_total.inc(result=job.status)
+            # Glidande medelvärde för Retry-After-uppskattningen
+            self._avg_duration_s = 0.8 * self._avg_duration_s + 0.2 * duration
+            logger.info(f"Jobb [{job.id}]: {job.status} efter {duration:.1f}s.")
+
+
+job_manager = JobManager()
@@ -0,0 +1,285 @@
+import logging
+import os
+import time
+from typing import List, Tuple
+
+import numpy as np
+
+from .models import GardenPlanData, LayoutReport
+
+logger = logging.getLogger(__name__)
+
+# Kontroll och lagning av planens layout innan den ritas: växter som överlappar varandra, ligger
+# på en gång (paths-polygon) eller sticker ut utanför ytan. Kandidatpar hittas med ett rutnät
+# (spatial hash) och alla tester görs vektoriserat i NumPy; lagningen flyttar växterna
+# iterativt isär (relaxation) tills inga konflikter finns kvar eller tidsbudgeten är slut.
+# Rutstorleken följer en percentil av diametrarna, inte den största: ett enda träd skulle annars
+# göra rutorna så stora att nästan alla par blir kandidater. Större växter testas för sig.
+LAYOUT_REPAIR_ENABLED = os.getenv("LAYOUT_REPAIR_ENABLED", "true").lower() == "true"
+LAYOUT_TIME_BUDGET_MS = float(os.getenv("LAYOUT_TIME_BUDGET_MS", "200"))
+LAYOUT_MAX_ITERATIONS = int(os.getenv("LAYOUT_MAX_ITERATIONS", "200"))
+LAYOUT_TOLERANCE_CM = float(os.getenv("LAYOUT_TOLERANCE_CM", "1")) # Överlapp under detta räknas inte (avrundning till hela cm)
+LAYOUT_GRID_PERCENTILE = float(os.getenv("LAYOUT_GRID_PERCENTILE", "95")) # Diameterpercentil som blir rutstorlek
+
+# Grannrutor åt ett håll, så att varje par bara testas en gång.
+_HALF_NEIGHBOURHOOD = ((0, 0), (1, -1), (1, 0), (1, 1), (0, 1))
+
+
+def _grid_cell(r: np.ndarray) -> float:
+    # Toleransen med, så att par som lagas till r + r + LAYOUT_TOLERANCE_CM isär fortfarande är grannar.
+    return max(float(np.percentile(r, LAYOUT_GRID_PERCENTILE)) * 2 + LAYOUT_TOLERANCE_CM, 1.0)
+
+
+def _grid_pairs(x: np.ndarray, y: np.ndarray, cell: float) -> Tuple[np.ndarray, np.ndarray]:
+    """Par (i, j) i samma eller angränsande ruta. Växter med diameter högst cell som överlappar
+    hamnar alltid i samma eller närliggande rutor."""
+    n = len(x)
+    if n < 2:
+        empty = np.empty(0, dtype=np.int64)
+        return empty, empty
+    cx = np.floor(x / cell).astype(np.int64)
+    cy = np.floor(y / cell).astype(np.int64)
+    cx -= cx.min() - 1
+    cy -= cy.min() - 1
+    stride = int(cy.max()) + 3
+    keys = cx * stride + cy
+    order = np.argsort(keys, kind="stable")
+    sorted_keys = keys[order]
+
+    firsts, seconds = [], []
+    for dx, dy in _HALF_NEIGHBOURHOOD:
+        target = keys + dx * stride + dy
+        lo = np.searchsorted(sorted_keys, target, side="left")
+        hi = np.searchsorted(sorted_keys, target, side="right")
+        counts = hi - lo
+        total = int(counts.sum())
+        if total == 0:
+            continue
+        i = np.repeat(np.arange(n), counts)
+        # Position inom varje intervall [lo, hi) utan Python-loop.
+        offsets = np.arange(total) - np.repeat(np.cumsum(counts) - counts, counts)
+        j = order[np.repeat(lo, counts) + offsets]
+        if dx == 0 and dy == 0:
+            keep = i < j
+            i, j = i[keep], j[keep]
+        firsts.append(i)
+        seconds.append(j)
+    if not firsts:
+        empty = np.empty(0, dtype=np.int64)
+        return empty, empty
+    return np.concatenate(firsts), np.concatenate(seconds)
+
+
+def _candidate_pairs(x: np.ndarray, y: np.ndarray, r: np.ndarray, cell: float) -> Tuple[np.ndarray, np.ndarray]:
+    """Alla par som kan överlappa: rutnätet för växter som får plats i en ruta, och varje större
+    växt mot de växter som når in i dess omslutande kvadrat. De större är få (ovanför
+    LAYOUT_GRID_PERCENTILE), så matrisen stora x alla hålls liten."""
+    oversized = 2 * r + LAYOUT_TOLERANCE_CM > cell
+    if not oversized.any():
+        return _grid_pairs(x, y, cell)
+    small = np.nonzero(~oversized)[0]
+    i, j = _grid_pairs(x[small], y[small], cell)
+    big = np.nonzero(oversized)[0]
+    reach = r[big][:, None] + r[None, :] + LAYOUT_TOLERANCE_CM
+    near = (np.abs(x[None, :] - x[big][:, None]) < reach) & (np.abs(y[None, :] - y[big][:, None]) < reach)
+    others = np.arange(len(x))[None, :]
+    # Par mellan två stora tas bara med en gång.
+    near &= (others != big[:, None]) & (~oversized[None, :] | (others > big[:, None]))
+    rows, bj = np.nonzero(near)
+    return np.concatenate([small[i], big[rows]]), np.concatenate([small[j], bj])
+
+
+def _circle_overlaps(x, y, r, cell, tolerance: float) -> Tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
+    # Negativ tolerans betyder att paret ska ha minst så mycket luft emellan.
+    i, j = _candidate_pairs(x, y, r, cell)
+    dx = x[j] - x[i]
+    dy = y[j] - y[i]
+    dist = np.hypot(dx, dy)
+    overlap = r[i] + r[j] - dist
+    hit = overlap > tolerance
+    return i[hit], j[hit], dx[hit], dy[hit], overlap[hit]
+
+
+def _polygon_push(x, y, r, polygon: np.ndarray, tolerance: float) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """Växter som ligger på polygonen och vektorn som flyttar ut dem: (index, push_x, push_y)."""
+    min_xy = polygon.min(axis=0)
+    max_xy = polygon.max(axis=0)
+    # Grov gallring mot polygonens omslutande rektangel.
+    near = np.nonzero(
+        (x + r > min_xy[0]) & (x - r < max_xy[0]) & (y + r > min_xy[1]) & (y - r < max_xy[1])
+    )[0]
+    if len(near) == 0 or len(polygon) < 3:
+        return near[:0], np.empty(0), np.empty(0)
+    px, py, pr = x[near][:, None], y[near][:, None], r[near][:, None]
+
+    a = polygon
+    b = np.roll(polygon, -1, axis=0)
+    ex, ey = (b - a)[:, 0], (b - a)[:, 1]
+    length_sq = np.maximum(ex * ex + ey * ey, 1e-9)
+    # Närmaste punkt på varje kant, för alla växter på en gång (växter x kanter).
+    t = np.clip(((px - a[:, 0]) * ex + (py - a[:, 1]) * ey) / length_sq, 0.0, 1.0)
+    qx = a[:, 0] + t * ex
+    qy = a[:, 1] + t * ey
+    dist = np.hypot(px - qx, py - qy)
+    nearest = np.argmin(dist, axis=1)
+    rows = np.arange(len(near))
+    edge_dist = dist[rows, nearest]
+    nx = px[:, 0] - qx[rows, nearest]
+    ny = py[:, 0] - qy[rows, nearest]
+
+    # Jämn-udda-regeln för punkt-i-polygon.
+    crosses = ((a[:, 1] > py) != (b[:, 1] > py)) & (
+        px < (b[:, 0] - a[:, 0]) * (py - a[:, 1]) / np.where(b[:, 1] == a[:, 1], 1e-9, b[:, 1] - a[:, 1]) + a[:, 0]
+    )
+    inside = crosses.sum(axis=1) % 2 == 1
+
+    pr = pr[:, 0]
+    conflict = inside | (edge_dist < pr - tolerance)
+    if not conflict.any():
+        return near[:0], np.empty(0), np.empty(0)
+    # Utanför: flytta bort från kanten tills avståndet är r. Inuti: över närmaste kant och r till.
+    norm = np.maximum(edge_dist, 1e-9)
+    direction = np.where(inside, -1.0, 1.0)
+    step = np.where(inside, edge_dist + pr, pr - edge_dist) - np.minimum(tolerance, 0.0)
+    push_x = direction * nx / norm * step
+    push_y = direction * ny / norm * step
+    # Mittpunkt exakt på kanten saknar riktning; använd kantens normal.
+    degenerate = edge_dist < 1e-9
+    if degenerate.any():
+        edge_norm = np.sqrt(length_sq[nearest])
+        push_x = np.where(degenerate, -ey[nearest] / edge_norm * pr, push_x)
+        push_y = np.where(degenerate, ex[nearest] / edge_norm * pr, push_y)
+    return near[conflict], push_x[conflict], push_y[conflict]
+
+
+def _out_of_bounds(x, y, r, width, height) -> np.ndarray:
+    tol = LAYOUT_TOLERANCE_CM
+    return (x - r < -tol) | (y - r < -tol) | (x + r > width + tol) | (y + r > height + tol)
+
+
+def _count_conflicts(x, y, r, polygons, width, height, cell) -> int:
+    count = len(_circle_overlaps(x, y, r, cell, LAYOUT_TOLERANCE_CM)[0])
+    for polygon in polygons:
+        count += len(_polygon_push(x, y, r, polygon, LAYOUT_TOLERANCE_CM)[0])
+    return count + int(_out_of_bounds(x, y, r, width, height).sum())
+
+
+def _estimate_conflicts(overlap, polygon_hits: int, x, y, r, width, height) -> int:
+    # Konflikter räknade ur varvets egna tester (före flytten), när budgeten inte räcker till en ny räkning.
+    return int((overlap > LAYOUT_TOLERANCE_CM).sum()) + polygon_hits + int(_out_of_bounds(x, y, r, width, height).sum())
+
+
+def _clamp_to_area(x, y, r, width, height):
+    # Växter bredare än ytan hamnar i mitten; de går inte att laga.
+    np.copyto(x, np.where(2 * r >= width, width / 2, np.clip(x, r, width - r)))
+    np.copyto(y, np.where(2 * r >= height, height / 2, np.clip(y, r, height - r)))
+
+
+def repair_plan(plan: GardenPlanData) -> LayoutReport:
+    """Hittar och lagar konflikter i planen. Ändrar plan.plants på plats och returnerar en rapport."""
+    started = time.perf_counter()
+    plants = plan.plants or []
+    if not plants:
+        return LayoutReport()
+    width = float(plan.area_width_cm)
+    height = float(plan.area_height_cm)
+    x = np.array([p.x for p in plants], dtype=np.float64)
+    y = np.array([p.y for p in plants], dtype=np.float64)
+    r = np.array([max(p.diameter, 0) / 2 for p in plants], dtype=np.float64)
+    polygons: List[np.ndarray] = [
+        np.asarray(path.points, dtype=np.float64) for path in (plan.paths or []) if len(path.points) >= 3
+    ]
+    cell = _grid_cell(r)
+
+    found = _count_conflicts(x, y, r, polygons, width, height, cell)
+    if found == 0 or not LAYOUT_REPAIR_ENABLED:
+        return LayoutReport(
+            conflicts_found=found,
+            conflicts_remaining=found,
+            elapsed_ms=round((time.perf_counter() - started) * 1000, 2)
+        )
+
+    original_x, original_y = x.copy(), y.copy()
+    rng = np.random.default_rng(0) # Deterministisk riktning för växter med samma mittpunkt
+    # Större växter flyttas mindre: varje part tar en andel av överlappet omvänt mot sin yta.
+    area = np.maximum(r * r, 1.0)
+    # Slutet (avrundning och tillbakaskrivning till plan.plants) växer med antalet växter, ungefär som
+    # den första räkningen; så mycket tid hålls undan från budgeten.
+    finish_s = time.perf_counter() - started
+    deadline = started + LAYOUT_TIME_BUDGET_MS / 1000 - finish_s
+    iterations = 0
+    remaining = None
+    estimate = found
+    # Ett nytt varv startas bara om det förra hade fått plats i den tid som är kvar.
+    iteration_s = 0.0
+    while iterations < LAYOUT_MAX_ITERATIONS and time.perf_counter() + iteration_s < deadline:
+        iteration_started = time.perf_counter()
+        iterations += 1
+        move_x = np.zeros_like(x)
+        move_y = np.zeros_like(y)
+
+        # Lagningen siktar på LAYOUT_TOLERANCE_CM luft, så att avrundningen till hela cm inte skapar nya konflikter.
+        i, j, dx, dy, overlap = _circle_overlaps(x, y, r, cell, -LAYOUT_TOLERANCE_CM)
+        # Klart när de avrundade positionerna är konfliktfria, även om luften inte nåtts överallt
+        # (t.ex. växter som trycks mot kanten av ytan).
+        if (len(overlap) == 0 or overlap.max() <= LAYOUT_TOLERANCE_CM) and \
+                _count_conflicts(np.rint(x), np.rint(y), r, polygons, width, height, cell) == 0:
+            remaining = 0
+            break
+        moved = len(i) > 0
+        if moved:
+            dist = np.hypot(dx, dy)
+            same = dist < 1e-9
+            if same.any():
+                angle = rng.uniform(0, 2 * np.pi, int(same.sum()))
+                dx[same], dy[same], dist[same] = np.cos(angle), np.sin(angle), 1.0
+            ux, uy = dx / dist, dy / dist
+            share_i = area[j] / (area[i] + area[j])
+            step = overlap + LAYOUT_TOLERANCE_CM
+            np.add.at(move_x, i, -ux * step * share_i)
+            np.add.at(move_y, i, -uy * step * share_i)
+            np.add.at(move_x, j, ux * step * (1 - share_i))
+            np.add.at(move_y, j, uy * step * (1 - share_i))
+
+        polygon_hits = 0
+        for polygon in polygons:
+            idx, push_x, push_y = _polygon_push(x, y, r, polygon, -LAYOUT_TOLERANCE_CM)
+            if len(idx):
+                moved = True
+                polygon_hits += len(idx)
+                np.add.at(move_x, idx, push_x)
+                np.add.at(move_y, idx, push_y)
+
+        estimate = _estimate_conflicts(overlap, polygon_hits, x, y, r, width, height)
+        if not moved and estimate == 0:
+            break
+        x += move_x
+        y += move_y
+        _clamp_to_area(x, y, r, width, height)
+        iteration_s = time.perf_counter() - iteration_started
+
+    # Planens koordinater är hela cm.
+    x = np.rint(x)
+    y = np.rint(y)
+    if remaining is None:
+        # Räknas bara om när det hinns före deadline; annars används varvets egen räkning.
+        remaining = _count_conflicts(x, y, r, polygons, width, height, cell) if time.perf_counter() + finish_s < deadline else estimate
+    changed = np.nonzero((x != original_x) | (y != original_y))[0]
+    for index in changed:
+        plants[index].x = int(x[index])
+        plants[index].y = int(y[index])
+
+    elapsed_ms = round((time.perf_counter() - started) * 1000, 2)
+    report = LayoutReport(
+        conflicts_found=found,
+        conflicts_fixed=max(0, found - remaining),
+        conflicts_remaining=remaining,
+        plants_moved=len(changed),
+        iterations=iterations,
+        elapsed_ms=elapsed_ms
+    )
+    logger.info(
+        f"Layout lagad: {report.conflicts_fixed} av {found} konflikter åtgärdade, "
+        f"{len(changed)} växter flyttade ({iterations} varv, {elapsed_ms} ms)."
+    )
+    return report
@@ -0,0 +1,240 @@
+import asyncio
+import datetime
+import logging
+import os
+import threading
+import time
+from typing import Any, Dict, Optional, Tuple
+
+import httpx
+
+logger = logging.getLogger(__name__)
+
+# Delade klienter för LLM-anropen, knutna till appens lifespan: färdigbyggda modellhandtag
+# per (modell-id, generationskonfiguration) och en gemensam keep-alive httpx.AsyncClient.
+LLM_HTTP_MAX_CONNECTIONS = int(os.getenv("LLM_HTTP_MAX_CONNECTIONS", "20"))
+LLM_HTTP_MAX_KEEPALIVE = int(os.getenv("LLM_HTTP_MAX_KEEPALIVE", "10"))
+LLM_HTTP_KEEPALIVE_EXPIRY_S = float(os.getenv("LLM_HTTP_KEEPALIVE_EXPIRY_S", "60"))
+LLM_HTTP_TIMEOUT_S = float(os.getenv("LLM_HTTP_TIMEOUT_S", "30"))
+LLM_WARMUP_ENABLED = os.getenv("LLM_WARMUP_ENABLED", "true").lower() == "true"
+LLM_WARMUP_TIMEOUT_S = float(os.getenv("LLM_WARMUP_TIMEOUT_S", "20"))
+# Statiska promptprefix registreras som cachat kontext hos Vertex och förnyas innan TTL går ut.
+LLM_PROMPT_CACHE_ENABLED = os.getenv("LLM_PROMPT_CACHE_ENABLED", "true").lower() == "true"
+LLM_PROMPT_CACHE_TTL_S = float(os.getenv("LLM_PROMPT_CACHE_TTL_S", "3600"))
+
+# Ett statiskt prefix: (modell-id, config_name, generation_config, system_instruction).
+# generation_config är en dict med GenerationConfig-fälten; den blir en GenerationConfig när handtaget byggs.
+CachedPrefix = Tuple[str, str, Optional[dict], str]
+
+# Vertex AI-SDK:t (google.cloud.aiplatform och vertexai) tar flera sekunder att importera och är
+# den största delen av appens kallstart. Det importeras därför först i load_vertex(), som lifespan
+# kör i bakgrunden (se ClientRegistry.start) och som annars körs vid första modellanropet.
+# Skript och bänkar kan sätta en egen GenerativeModel innan dess; då importeras inget SDK.
+GenerativeModel = None
+GenerationConfig = None
+Part = None
+_caching = None
+_vertex_lock = threading.Lock()
+_vertex_loaded = False
+
+
+def load_vertex(project: Optional[str], location: Optional[str]):
+    """Importerar Vertex AI-SDK:t och kör aiplatform.init, en gång per process. Blockerande."""
+    global GenerativeModel, GenerationConfig, Part, _caching, _vertex_loaded
+    if _vertex_loaded:
+        return
+    with _vertex_lock:
+        if _vertex_loaded:
+            return
+        if GenerativeModel is None:
+            started = time.perf_counter()
+            from google.cloud import aiplatform
+            from vertexai.preview import caching
+            from vertexai.preview import generative_models
+            aiplatform.init(project=project, location=location)
+            _caching = caching
+            Part = generative_models.Part
+            GenerationConfig = generative_models.GenerationConfig
+            GenerativeModel = generative_models.GenerativeModel
+            logger.info(f"Vertex AI-SDK:t laddat och initierat på {time.perf_counter() - started:.2f}s (Projekt: {project}, Plats: {location}).")
+        _vertex_loaded = True
+
+
+def vertex_loaded() -> bool:
+    return _vertex_loaded
+
+
+def _generation_config(config: Optional[dict]):
+    # GenerationConfig (inte dicten direkt) så att response_schema översätts till Vertex schemaformat.
+    if isinstance(config, dict) and GenerationConfig is not None:
+        return GenerationConfig(**config)
+    return config
+
+
+def image_part(data: bytes, mime_type: str):
+    """En bilddel till generate_content. Kräver load_vertex(); utan SDK (fejkad modell) skickas en dict."""
+    if Part is None:
+        return {"mime_type": mime_type, "data": data}
+    return Part.from_data(data=data, mime_type=mime_type)
+
+
+class ClientRegistry:
+    def __init__(self):
+        self._models: Dict[Tuple[str, str], Any] = {}
+        # Handtag byggda från cachat kontext, med tidpunkt (monotonic) då de slutar gälla.
+        self._cached_models: Dict[Tuple[str, str], Tuple[Any, float, object]] = {}
+        self._http: Optional[httpx.AsyncClient] = None
+        self._project: Optional[str] = None
+        self._location: Optional[str] = None
+        self._startup_task: Optional[asyncio.Task] = None
+        self._warmup_task: Optional[asyncio.Task] = None
+        self._prompt_cache_task: Optional[asyncio.Task] = None
+        self.startup_error: Optional[str] = None
+
+    def configure(self, project: Optional[str], location: Optional[str]):
+        # Projekt och plats för aiplatform.init; sätts av llm_services vid import (utan att importera SDK:t).
+        self._project = project
+        self._location = location
+
+    async def ensure_vertex(self):
+        """Laddar Vertex AI-SDK:t i en tråd om det inte redan är gjort, så att event-loopen inte blockeras."""
+        if not _vertex_loaded:
+            await asyncio.to_thread(load_vertex, self._project, self._location)
+
+    def model(
+        self,
+        model_id: str,
+        config_name: str,
+        generation_config: Optional[dict] = None,
+        system_instruction: Optional[str] = None
+    ):
+        """Returnerar ett återanvänt modellhandtag. config_name identifierar generation_config
+        (och system_instruction) i cachen. Finns ett giltigt cachat kontext för nyckeln används det.
+        Importerar Vertex-SDK:t blockerande om ensure_vertex() inte har körts."""
+        key = (model_id, config_name)
+        cached = self._cached_models.get(key)
+        if cached is not None and cached[1] > time.monotonic():
+            return cached[0]
+        handle = self._models.get(key)
+        if handle is None:
+            load_vertex(self._project, self._location)
+            handle = GenerativeModel(model_id, generation_config=_generation_config(generation_config), system_instruction=system_instruction)
+            self._models[key] = handle
+            logger.info(f"Modellhandtag skapat för {model_id} ({config_name}).")
+        return handle
+
+    def has_cached_prefix(self, model_id: str, config_name: str) -> bool:
+        cached = self._cached_models.get((model_id, config_name))
+        return cached is not None and cached[1] > time.monotonic()
+
+    async def register_cached_prefix(self, prefix: CachedPrefix) -> bool:
+        """Registrerar system_instruction som cachat kontext hos Vertex. False om det inte stöds
+        (t.ex. modellen saknar stöd eller prefixet är under minsta cachestorlek); då används vanliga handtag."""
+        model_id, config_name, generation_config, system_instruction = prefix
+        try:
+            await self.ensure_vertex()
+            cached_content = await asyncio.to_thread(
+                _caching.CachedContent.create,
+                model_name=model_id,
+                system_instruction=system_instruction,
+                ttl=datetime.timedelta(seconds=LLM_PROMPT_CACHE_TTL_S),
+                display_name=f"{config_name}-{model_id}"[:128]
+            )
+            handle = GenerativeModel.from_cached_content(cached_content, generation_config=_generation_config(generation_config))
+        except Exception as e:
+            logger.info(f"Cachat kontext stöds inte för {model_id} ({config_name}), skickar prefixet per anrop: {str(e)[:200]}")
+            return False
+        # Marginal så att handtaget byts ut innan Vertex tar bort kontextet.
+        expires_at = time.monotonic() + LLM_PROMPT_CACHE_TTL_S * 0.9
+        previous = self._cached_models.get((model_id, config_name))
+        self._cached_models[(model_id, config_name)] = (handle, expires_at, cached_content)
+        if previous is not None:
+            await self._delete_cached_content(previous[2])
+        logger.info(f"Cachat kontext registrerat för {model_id} ({config_name}).")
+        return True
+
+    async def _refresh_cached_prefixes(self, prefixes: Tuple[CachedPrefix, ...]):
+        while True:
+            results = await asyncio.gather(*(self.register_cached_prefix(p) for p in prefixes))
+            if not any(results):
+                return # Inget stöds; inget att förnya
+            await asyncio.sleep(LLM_PROMPT_CACHE_TTL_S * 0.8)
+
+    @staticmethod
+    async def _delete_cached_content(cached_content):
+        try:
+            await asyncio.to_thread(cached_content.delete)
+        except Exception as e:
+            logger.warning(f"Kunde inte ta bort cachat kontext (icke-kritiskt, går ut av sig självt): {e}")
+
+    @property
+    def http(self) -> httpx.AsyncClient:
+        # Skapas vid behov om lifespan inte har startat registret (t.ex. i skript).
+        if self._http is None or self._http.is_closed:
+            self._http = httpx.AsyncClient(
+                limits=httpx.Limits(
+                    max_connections=LLM_HTTP_MAX_CONNECTIONS,
+                    max_keepalive_connections=LLM_HTTP_MAX_KEEPALIVE,
+                    keepalive_expiry=LLM_HTTP_KEEPALIVE_EXPIRY_S
+                ),
+                timeout=LLM_HTTP_TIMEOUT_S
+            )
+        return self._http
+
+    @property
+    def ready(self) -> bool:
+        """Sant när SDK:t är laddat och modellhandtagen från start() är byggda."""
+        return _vertex_loaded and self._startup_task is not None and self._startup_task.done() and self.startup_error is None
+
+    def start(
+        self,
+        warmup_models: Tuple[Tuple[str, str, Optional[dict], Optional[str]], ...] = (),
+        cached_prefixes: Tuple[CachedPrefix, ...] = ()
+    ):
+        """Startar laddningen av Vertex-SDK:t, modellhandtagen, uppvärmningen och de cachade
+        promptprefixen i bakgrunden. Returnerar direkt så att appen kan svara medan det pågår."""
+        _ = self.http
+        self.startup_error = None
+        self._startup_task = asyncio.create_task(self._start_background(warmup_models, cached_prefixes))
+
+    async def _start_background(self, warmup_models, cached_prefixes):
+        if not warmup_models:
+            return # Vertex är inte konfigurerat; inget att ladda
+        try:
+            await self.ensure_vertex()
+            for model_id, config_name, generation_config, system_instruction in warmup_models:
+                self.model(model_id, config_name, generation_config, system_instruction)
+        except Exception as e:
+            self.startup_error = f"{type(e).__name__}: {str(e)[:200]}"
+            logger.error(f"Kunde inte ladda Vertex AI i bakgrunden: {e}", exc_info=True)
+            return
+        if LLM_WARMUP_ENABLED:
+            model_id, config_name, _, _ = warmup_models[0]
+            self._warmup_task = asyncio.create_task(self._warm_up(self.model(model_id, config_name)))
+        if LLM_PROMPT_CACHE_ENABLED and cached_prefixes:
+            self._prompt_cache_task = asyncio.create_task(self._refresh_cached_prefixes(cached_prefixes))
+
+    async def _warm_up(self, model):
+        # count_tokens kostar inga genererade tokens men sätter upp autentisering och gRPC-kanal,
+        # så att första användaren inte betalar för kallstarten.
+        try:
+            await asyncio.wait_for(model.count_tokens_async("Hej"), timeout=LLM_WARMUP_TIMEOUT_S)
+            logger.info("Anslutningen till Vertex AI är uppvärmd.")
+        except Exception as e:
+            logger.warning(f"Uppvärmning av Vertex AI misslyckades (icke-kritiskt): {e}")
+
+    async def close(self):
+        for task in (self._startup_task, self._warmup_task, self._prompt_cache_task):
+            if task is not None and not task.done():
+                task.cancel()
+        for _, _, cached_content in self._cached_models.values():
+            await self._delete_cached_content(cached_content)
+        self._cached_models.clear()
+        if self._http is not None:
+            await self._http.aclose()
+            self._http = None
+        self._models.clear()
+        logger.info("LLM-klienter stängda.")
+
+
+registry = ClientRegistry()
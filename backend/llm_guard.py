@@ -0,0 +1,325 @@
+import asyncio
+import logging
+import os
+import time
+from collections import deque
+from contextlib import asynccontextmanager
+from typing import AsyncIterator, Callable, Deque, Dict
+
+from . import metrics
+
+logger = logging.getLogger(__name__)
+
+# Skydd framför Gemini-anropen: en adaptiv samtidighetsgräns (AIMD) per anropstyp och en
+# circuit breaker per modell. Gränsen växer långsamt så länge svaren är snabba och halveras
+# ungefär när Vertex svarar 429/5xx eller blir långsamt; breakern slår ifrån när en stor andel
+# av de senaste anropen är överbelastningsfel, så att nya anrop får 503 direkt i stället för
+# att vänta ut hela tidsgränsen, och släpper sedan igenom ett provanrop för att se om Vertex är tillbaka.
+LLM_LIMIT_INITIAL = float(os.getenv("LLM_LIMIT_INITIAL", "8"))
+LLM_LIMIT_MIN = int(os.getenv("LLM_LIMIT_MIN", "1"))
+LLM_LIMIT_MAX = int(os.getenv("LLM_LIMIT_MAX", "32"))
+LLM_LIMIT_BACKOFF = float(os.getenv("LLM_LIMIT_BACKOFF", "0.7")) # Faktor vid överbelastning
+LLM_LIMIT_MAX_WAIT_S = float(os.getenv("LLM_LIMIT_MAX_WAIT_S", "10")) # Längsta väntan på en plats innan 503
+LLM_ANALYSIS_LATENCY_TARGET_S = float(os.getenv("LLM_ANALYSIS_LATENCY_TARGET_S", "20"))
+LLM_DESIGN_LATENCY_TARGET_S = float(os.getenv("LLM_DESIGN_LATENCY_TARGET_S", "60"))
+
+LLM_BREAKER_WINDOW = int(os.getenv("LLM_BREAKER_WINDOW", "20")) # Antal senaste utfall som bedöms
+LLM_BREAKER_MIN_CALLS = int(os.getenv("LLM_BREAKER_MIN_CALLS", "5"))
+LLM_BREAKER_FAILURE_RATIO = float(os.getenv("LLM_BREAKER_FAILURE_RATIO", "0.5"))
+LLM_BREAKER_OPEN_S = float(os.getenv("LLM_BREAKER_OPEN_S", "30"))
+LLM_BREAKER_HALF_OPEN_PROBES = int(os.getenv("LLM_BREAKER_HALF_OPEN_PROBES", "1"))
+
+# HTTP-statuskoder som betyder att Vertex är överbelastat eller trasigt (google.api_core-felen har .code).
+OVERLOAD_STATUS_CODES = {429, 500, 502, 503, 504}
+
+_limit_gauge = metrics.gauge("llm_concurrency_limit", "Aktuell samtidighetsgräns per anropstyp")
+_inflight_gauge = metrics.gauge("llm_inflight", "Pågående Gemini-anrop per anropstyp")
+_waiting_gauge = metrics.gauge("llm_limiter_waiting", "Anrop som väntar på en plats per anropstyp")
+_rejected_total = metrics.counter("llm_rejected_total", "Anrop som nekats direkt per anropstyp och orsak (limit/circuit_open)")
+_call_seconds = metrics.histogram("llm_call_seconds", "Gemini-anropens tid per anropstyp och utfall")
+_circuit_state_gauge = metrics.gauge("llm_circuit_state", "Breakerns läge per modell (0=closed, 1=half_open, 2=open)")
+_circuit_changes_total = metrics.counter("llm_circuit_state_changes_total", "Lägesbyten per modell och nytt läge")
+
+CLOSED = "closed"
+HALF_OPEN = "half_open"
+OPEN = "open"
+_STATE_VALUES = {CLOSED: 0, HALF_OPEN: 1, OPEN: 2}
+
+
+class GuardRejectedError(Exception):
+    """Anropet nekades innan det nådde Vertex. retry_after_s är en uppskattning för Retry-After."""
+
+    def __init__(self, message: str, retry_after_s: int):
+        super().__init__(message)
+        self.retry_after_s = retry_after_s
+
+
+class CircuitOpenError(GuardRejectedError):
+    pass
+
+
+class LimiterTimeoutError(GuardRejectedError):
+    pass
+
+
+def is_overload_error(e: BaseException) -> bool:
+    if isinstance(e, asyncio.TimeoutError):
+        return True
+    code = getattr(e, "code", None)
+    return isinstance(code, int) and code in OVERLOAD_STATUS_CODES
+
+
+class AdaptiveLimiter:
+    """AIMD-gräns för samtidiga anrop: +1/limit per lyckat anrop när gränsen utnyttjas,
+    gånger LLM_LIMIT_BACKOFF vid överbelastning eller latens över målet (högst en gång per mål-latens)."""
+
+    def __init__(
+        self,
+        name: str,
+        latency_target_s: float,
+        initial: float = LLM_LIMIT_INITIAL,
+        min_limit: int = LLM_LIMIT_MIN,
+        max_limit: int = LLM_LIMIT_MAX,
+        backoff: float = LLM_LIMIT_BACKOFF,
+        max_wait_s: float = LLM_LIMIT_MAX_WAIT_S,
+        clock: Callable[[], float] = time.monotonic
+    ):
+        self.name = name
+        self.latency_target_s = latency_target_s
+        self.min_limit = max(1, min_limit)
+        self.max_limit = max(self.min_limit, max_limit)
+        self.backoff = backoff
+        self.max_wait_s = max_wait_s
+        self._clock = clock
+        self._limit = min(self.max_limit, max(self.min_limit, initial))
+        self._inflight = 0
+        self._waiters: Deque[asyncio.Future] = deque()
+        self._last_decrease = 0.0
+        _limit_gauge.set(self._limit, call=name)
+
+    @property
+    def limit(self) -> int:
+        return max(self.min_limit, int(self._limit))
+
+    @property
+    def inflight(self) -> int:
+        return self._inflight
+
+    async def acquire(self):
+        if self._inflight < self.limit and not self._waiters:
+            self._take_slot()
+            return
+        waiter = asyncio.get_running_loop().create_future()
+        self._waiters.append(waiter)
+        _waiting_gauge.set(len(self._waiters), call=self.name)
+        try:
+            # Platsen lämnas över av release() via waiter.set_result; _take_slot har då redan körts.
+            await asyncio.wait_for(waiter, timeout=self.max_wait_s)
+        except asyncio.TimeoutError:
+            _rejected_total.inc(call=self.name, reason="limit")
+            raise LimiterTimeoutError(
+                f"Ingen ledig plats för {self.name} inom {self.max_wait_s}s (gräns {self.limit}).",
+                retry_after_s=max(1, round(self.latency_target_s / 2))
+            )
+        except asyncio.CancelledError:
+            if waiter.done() and not waiter.cancelled():
+                self.release() # Platsen hann lämnas över innan anroparen avbröts
+            raise
+        finally:
+            if waiter in self._waiters:
+                self._waiters.remove(waiter)
+            _waiting_gauge.set(len(self._waiters), call=self.name)
+
+    def release(self):
+        self._inflight -= 1
+        _inflight_gauge.set(self._inflight, call=self.name)
+        self._wake()
+
+    def on_result(self, latency_s: float, overloaded: bool):
+        if overloaded or latency_s > self.latency_target_s:
+            now = self._clock()
+            # Ett enda utbrott av fel ska bara minska gränsen en gång.
+            if now - self._last_decrease >= self.latency_target_s:
+                self._last_decrease = now
+                self._limit = max(float(self.min_limit), self._limit * self.backoff)
+                logger.warning(f"LLM-gräns '{self.name}' sänkt till {self.limit} ({'överbelastning' if overloaded else f'latens {latency_s:.1f}s'}).")
+        elif self._inflight >= self.limit / 2:
+            # Öka bara när gränsen faktiskt används, annars växer den obegränsat under låg last.
+            self._limit = min(float(self.max_limit), self._limit + 1.0 / self._limit)
+        _limit_gauge.set(self._limit, call=self.name)
+        self._wake()
+
+    def _take_slot(self):
+        self._inflight += 1
+        _inflight_gauge.set(self._inflight, call=self.name)
+
+    def _wake(self):
+        while self._waiters and self._inflight < self.limit:
+            waiter = self._waiters.popleft()
+            if not waiter.done():
+                self._take_slot()
+                waiter.set_result(None)
+
+    def status(self) -> dict:
+        return {
+            "limit": self.limit,
+            "limit_exact": round(self._limit, 3),
+            "inflight": self._inflight,
+            "waiting": len(self._waiters),
+            "latency_target_s": self.latency_target_s,
+        }
+
+
+class CircuitBreaker:
+    def __init__(
+        self,
+        name: str,
+        window: int = LLM_BREAKER_WINDOW,
+        min_calls: int = LLM_BREAKER_MIN_CALLS,
+        failure_ratio: float = LLM_BREAKER_FAILURE_RATIO,
+        open_s: float = LLM_BREAKER_OPEN_S,
+        half_open_probes: int = LLM_BREAKER_HALF_OPEN_PROBES,
+        clock: Callable[[], float] = time.monotonic
+    ):
+        self.name = name
+        self.min_calls = min_calls
+        self.failure_ratio = failure_ratio
+        self.open_s = open_s
+        self.half_open_probes = max(1, half_open_probes)
+        self._clock = clock
+        self.state = CLOSED
+        self._outcomes: Deque[bool] = deque(maxlen=window) # True = överbelastningsfel
+        self._opened_at = 0.0
+        self._probes = 0
+        _circuit_state_gauge.set(0, model=name)
+
+    def before_call(self) -> bool:
+        """Kastar CircuitOpenError om anropet inte får gå igenom. Returnerar True för provanrop."""
+        if self.state == OPEN:
+            remaining = self._opened_at + self.open_s - self._clock()
+            if remaining > 0:
+                raise CircuitOpenError(f"AI-tjänsten ({self.name}) svarar inte just nu.", retry_after_s=max(1, round(remaining)))
+            self._set_state(HALF_OPEN)
+        if self.state == HALF_OPEN:
+            if self._probes >= self.half_open_probes:
+                raise CircuitOpenError(f"AI-tjänsten ({self.name}) testas igen, försök om en stund.", retry_after_s=max(1, round(self.open_s / 2)))
+            self._probes += 1
+            return True
+        return False
+
+    def record(self, failed: bool, probe: bool):
+        if probe:
+            self._probes = max(0, self._probes - 1)
+            if self.state == HALF_OPEN:
+                if failed:
+                    self._open()
+                else:
+                    self._outcomes.clear()
+                    self._set_state(CLOSED)
+                return
+        self._outcomes.append(failed)
+        if self.state == CLOSED and len(self._outcomes) >= self.min_calls and self.failure_rate() >= self.failure_ratio:
+            self._open()
+
+    def release_probe(self):
+        # Provanropet avbröts utan utfall; nästa anrop får prova i stället.
+        self._probes = max(0, self._probes - 1)
+
+    def failure_rate(self) -> float:
+        if not self._outcomes:
+            return 0.0
+        return sum(self._outcomes) / len(self._outcomes)
+
+    def _open(self):
+        self._opened_at = self._clock()
+        self._set_state(OPEN)
+        logger.error(f"Circuit breaker '{self.name}' öppen i {self.open_s}s (felandel {self.failure_rate():.0%}).")
+
+    def _set_state(self, state: str):
+        if state == self.state:
+            return
+        self.state = state
+        _circuit_state_gauge.set(_STATE_VALUES[state], model=self.name)
+        _circuit_changes_total.inc(model=self.name, state=state)
+        if state != OPEN:
+            logger.info(f"Circuit breaker '{self.name}' är nu {state}.")
+
+    def status(self) -> dict:
+        result = {
+            "state": self.state,
+            "failure_rate": round(self.failure_rate(), 3),
+            "window_calls": len(self._outcomes),
+            "half_open_probes": self._probes,
+        }
+        if self.state == OPEN:
+            result["open_remaining_s"] = round(max(0.0, self._opened_at + self.open_s - self._clock()), 1)
+        return result
+
+
+class LLMGuard:
+    """En anropstyp (t.ex. design): egen adaptiv gräns, gemensamma breakers per modell."""
+
+    def __init__(self, name: str, latency_target_s: float, clock: Callable[[], float] = time.monotonic):
+        self.name = name
+        self.limiter = AdaptiveLimiter(name, latency_target_s, clock=clock)
+        self._clock = clock
+
+    @asynccontextmanager
+    async def call(self, model_id: str) -> AsyncIterator[None]:
+        breaker = get_breaker(model_id)
+        try:
+            probe = breaker.before_call()
+        except CircuitOpenError:
+            _rejected_total.inc(call=self.name, reason="circuit_open")
+            raise
+        try:
+            await self.limiter.acquire()
+        except BaseException:
+            if probe:
+                breaker.release_probe()
+            raise
+
+        started = self._clock()
+        outcome = "cancelled"
+        try:
+            yield
+            outcome = "ok"
+        except Exception as e:
+            outcome = "overloaded" if is_overload_error(e) else "error"
+            raise
+        finally:
+            elapsed = self._clock() - started
+            _call_seconds.observe(elapsed, call=self.name, outcome=outcome)
+            if outcome == "cancelled":
+                # Avbrutet av anroparen (tidsgräns eller frånkopplad klient): bara latensen räknas.
+                self.limiter.on_result(elapsed, overloaded=False)
+                if probe:
+                    breaker.release_probe()
+            else:
+                overloaded = outcome == "overloaded"
+                self.limiter.on_result(elapsed, overloaded=overloaded)
+                # Andra fel (t.ex. ogiltig fråga) betyder att Vertex svarade och räknas som friska.
+                breaker.record(failed=overloaded, probe=probe)
+            self.limiter.release()
+
+
+_breakers: Dict[str, CircuitBreaker] = {}
+
+
+def get_breaker(model_id: str) -> CircuitBreaker:
+    breaker = _breakers.get(model_id)
+    if breaker is None:
+        breaker = _breakers[model_id] = CircuitBreaker(model_id)
+    return breaker
+
+
+image_analysis_guard = LLMGuard("image_analysis", LLM_ANALYSIS_LATENCY_TARGET_S)
+design_guard = LLMGuard("design", LLM_DESIGN_LATENCY_TARGET_S)
+
+
+def status() -> dict:
+    """Gränser, fönster och breakerlägen för /metrics/llm."""
+    return {
+        "limiters": {guard.name: guard.limiter.status() for guard in (image_analysis_guard, design_guard)},
+        "breakers": {model_id: breaker.status() for model_id, breaker in _breakers.items()},
+    }
@@ -0,0 +1,143 @@
+import asyncio
+import logging
+import os
+import time
+from typing import Any, Awaitable, Callable, Dict, List, Sequence
+
+from . import metrics
+
+logger = logging.getLogger(__name__)
+
+# Hedgade anrop över en lista modellnivåer (t.ex. Pro, sedan Flash). Första nivån startas direkt;
+# om den inte svarat när dess latens passerat LLM_HEDGE_PERCENTILE startas ett parallellt anrop
+# mot nästa nivå, och det svar som kommer först vinner medan det andra avbryts. Misslyckas alla
+# startade anrop (t.ex. modellen finns inte, breakern är öppen eller svaret gick inte att tolka)
+# faller vi direkt tillbaka på nästa nivå.
+LLM_HEDGE_ENABLED = os.getenv("LLM_HEDGE_ENABLED", "true").lower() == "true"
+LLM_HEDGE_PERCENTILE = float(os.getenv("LLM_HEDGE_PERCENTILE", "0.9"))
+LLM_HEDGE_MIN_SAMPLES = int(os.getenv("LLM_HEDGE_MIN_SAMPLES", "20")) # Färre mätningar -> standardfördröjningen används
+LLM_HEDGE_ANALYSIS_DELAY_S = float(os.getenv("LLM_HEDGE_ANALYSIS_DELAY_S", "8"))
+LLM_HEDGE_DESIGN_DELAY_S = float(os.getenv("LLM_HEDGE_DESIGN_DELAY_S", "30"))
+
+_model_latency = metrics.histogram("llm_model_latency_seconds", "Lyckade anrop per anropstyp och modell")
+_model_calls_total = metrics.counter("llm_model_calls_total", "Anrop per anropstyp, modell och utfall (ok/error/cancelled)")
+_races_total = metrics.counter("llm_races_total", "Anrop via hedged_call per anropstyp")
+_hedges_total = metrics.counter("llm_hedges_total", "Extra anrop mot nästa nivå per anropstyp och orsak (latency/fallback)")
+_wins_total = metrics.counter("llm_wins_total", "Vilken modell som gav svaret per anropstyp")
+
+_models_seen: Dict[str, List[str]] = {}
+
+
+def is_model_unavailable_error(e: BaseException) -> bool:
+    # Vertex svarar 404 (NotFound) eller "Publisher Model ... was not found / is not supported".
+    if getattr(e, "code", None) == 404:
+        return True
+    message = str(e)
+    return "Publisher Model" in message or "is not supported" in message or "was not found" in message
+
+
+def hedge_delay_s(call: str, model_id: str, default_delay_s: float) -> float:
+    if _model_latency.count(call=call, model=model_id) < LLM_HEDGE_MIN_SAMPLES:
+        return default_delay_s
+    return _model_latency.quantile(LLM_HEDGE_PERCENTILE, call=call, model=model_id)
+
+
+async def _timed_attempt(call: str, model_id: str, attempt: Callable[[str], Awaitable[Any]]) -> Any:
+    started = time.perf_counter()
+    try:
+        result = await attempt(model_id)
+    except asyncio.CancelledError:
+        _model_calls_total.inc(call=call, model=model_id, result="cancelled")
+        raise
+    except Exception:
+        _model_calls_total.inc(call=call, model=model_id, result="error")
+        raise
+    _model_latency.observe(time.perf_counter() - started, call=call, model=model_id)
+    _model_calls_total.inc(call=call, model=model_id, result="ok")
+    return result
+
+
+async def hedged_call(
+    call: str,
+    tiers: Sequence[str],
+    attempt: Callable[[str], Awaitable[Any]],
+    default_delay_s: float
+) -> Any:
+    """Kör attempt(model_id) mot tiers enligt ovan. attempt ska kasta om svaret inte är giltigt.
+
+    Högst ett hedgat anrop startas på latens (mot nivå två); fler nivåer används bara som fallback.
+    Om alla nivåer misslyckas kastas det sista felet.
+    """
+    tiers = list(dict.fromkeys(tiers))
+    known = _models_seen.setdefault(call, [])
+    known.extend(m for m in tiers if m not in known)
+    _races_total.inc(call=call)
+
+    pending: Dict[asyncio.Task, str] = {}
+    next_tier = 0
+
+    def launch():
+        nonlocal next_tier
+        model_id = tiers[next_tier]
+        next_tier += 1
+        pending[asyncio.create_task(_timed_attempt(call, model_id, attempt))] = model_id
+
+    loop = asyncio.get_running_loop()
+    launch()
+    hedge_at = loop.time() + hedge_delay_s(call, tiers[0], default_delay_s)
+    last_error: BaseException = RuntimeError(f"Inga modeller att anropa för {call}.")
+    try:
+        while pending:
+            # Timern gäller bara så länge enbart första nivån är startad.
+            can_hedge = LLM_HEDGE_ENABLED and next_tier == 1 and next_tier < len(tiers)
+            timeout = max(0.0, hedge_at - loop.time()) if can_hedge else None
+            done, _ = await asyncio.wait(pending, timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+            if not done:
+                _hedges_total.inc(call=call, reason="latency")
+                logger.info(f"{call}: {tiers[0]} har inte svarat efter {hedge_delay_s(call, tiers[0], default_delay_s):.1f}s, startar parallellt anrop mot {tiers[next_tier]}.")
+                launch()
+                continue
+
+            for task in done:
+                model_id = pending.pop(task)
+                error = task.exception()
+                if error is None:
+                    _wins_total.inc(call=call, model=model_id)
+                    if model_id != tiers[0]:
+                        logger.info(f"{call}: svaret kom från {model_id}.")
+                    return task.result()
+                last_error = error
+                unavailable = " (modellen är inte tillgänglig)" if is_model_unavailable_error(error) else ""
+                logger.warning(f"{call}: anropet mot {model_id} misslyckades{unavailable}: {str(error)[:200]}")
+
+            if not pending and next_tier < len(tiers):
+                _hedges_total.inc(call=call, reason="fallback")
+                logger.info(f"{call}: faller tillbaka på {tiers[next_tier]}.")
+                launch()
+        raise last_error
+    finally:
+        for task in pending:
+            task.cancel()
+
+
+def status() -> dict:
+    """Latens och vinstandel per modell, samt aktuell hedge-fördröjning, för /metrics/llm."""
+    result = {}
+    defaults = {"image_analysis": LLM_HEDGE_ANALYSIS_DELAY_S, "design": LLM_HEDGE_DESIGN_DELAY_S}
+    for call, models in _models_seen.items():
+        races = _races_total.value(call=call)
+        result[call] = {
+            "races": races,
+            "hedge_delay_s": round(hedge_delay_s(call, models[0], defaults.get(call, 0.0)), 3),
+            "models": {
+                model_id: {
+                    "samples": _model_latency.count(call=call, model=model_id),
+                    "p50_s": round(_model_latency.quantile(0.5, call=call, model=model_id), 3),
+                    "p95_s": round(_model_latency.quantile(0.95, call=call, model=model_id), 3),
+                    "wins": _wins_total.value(call=call, model=model_id),
+                    "win_rate": round(_wins_total.value(call=call, model=model_id) / races, 3) if races else 0.0,
+                }
+                for model_id in models
+            },
+        }
+    return result
@@ -0,0 +1,323 @@
+import json
+import logging
+import re
+from typing import Any, Callable, Dict, List, Optional, Tuple, Type
+
+from pydantic import BaseModel, ValidationError
+
+from . import metrics
+from .models import LLMCatalogDesignOutput, LLMCatalogDesignVariantsOutput, LLMDesignOutput, LLMDesignVariantsOutput
+
+logger = logging.getLogger(__name__)
+
+# Tolkning av JSON-svar från Gemini: ett valideringspass direkt mot Pydantic-modellen,
+# och bara om det misslyckas en lokal reparation (prosa runt JSON, avklippta listor,
+# tal som strängar) innan anroparen behöver fråga modellen igen.
+
+_parse_total = metrics.counter("llm_json_parse_total", "Tolkning av LLM-JSON per utfall (ok/repaired/failed)")
+
+_NUMBER_IN_STRING = re.compile(r"-?\d+(?:[.,]\d+)?")
+_TRAILING_COMMA = re.compile(r",\s*([}\]])")
+
+# Fält i GardenPlanData/PlantData som ska vara heltal (cm)
+_INT_FIELDS = {"x", "y", "diameter", "area_width_cm", "area_height_cm"}
+
+# Med växtkatalogen (promptversion v3) svarar modellen med id och position per växt, och expand
+# (plant_catalog.expand_design) gör om svaret till LLMDesignOutput. Kastar ValueError om inga
+# växter finns i katalogen, vilket räknas som ett otolkbart svar.
+DesignExpander = Callable[[LLMCatalogDesignOutput], LLMDesignOutput]
+
+
+def pydantic_to_response_schema(model: Type[BaseModel]) -> Dict[str, Any]:
+    """Gör om modellens JSON-schema till den OpenAPI-delmängd som Vertex AI tar som response_schema.
+
+    $ref löses upp inline, Optional blir nullable och tupler blir listor med fast längd.
+    """
+    schema = model.model_json_schema()
+    return _convert_schema(schema, schema.get("$defs", {}))
+
+
+def _convert_schema(node: Dict[str, Any], defs: Dict[str, Any]) -> Dict[str, Any]:
+    if "$ref" in node:
+        converted = _convert_schema(defs[node["$ref"].split("/")[-1]], defs)
+        if "description" in node:
+            converted["description"] = node["description"]
+        return converted
+
+    if "anyOf" in node:
+        variants = [v for v in node["anyOf"] if v.get("type") != "null"]
+        # Vertex-schemat saknar unioner; första icke-null-typen används (t.ex. height_3d -> number).
+        converted = _convert_schema(variants[0], defs) if variants else {"type": "string"}
+        if len(variants) < len(node["anyOf"]):
+            converted["nullable"] = True
+        if "description" in node:
+            converted["description"] = node["description"]
+        return converted
+
+    converted: Dict[str, Any] = {"type": node.get("type", "string")}
+    if "description" in node:
+        converted["description"] = node["description"]
+    if converted["type"] == "object":
+        converted["properties"] = {
+            name: _convert_schema(prop, defs) for name, prop in node.get("properties", {}).items()
+        }
+        if node.get("required"):
+            converted["required"] = list(node["required"])
+    elif converted["type"] == "array":
+        if "prefixItems" in node:
+            converted["items"] = _convert_schema(node["prefixItems"][0], defs)
+            converted["minItems"] = len(node["prefixItems"])
+            converted["maxItems"] = len(node["prefixItems"])
+        elif "items" in node:
+            converted["items"] = _convert_schema(node["items"], defs)
+    return converted
+
+
+def strip_code_fences(text: str) -> str:
+    text = text.strip()
+    if text.startswith("```"):
+        text = text.split("\n", 1)[1] if "\n" in text else text[3:]
+        if text.startswith("json"):
+            text = text[len("json"):]
+    if text.endswith("```"):
+        text = text[:-3]
+    return text.strip()
+
+
+def repair_json_text(text: str) -> str:
+    """Lagar vanliga fel i modellens JSON-text: kodstaket, prosa före/efter, avslutande
+    kommatecken och avklippta strängar/listor/objekt (t.ex. när max_output_tokens tar slut)."""
+    text = strip_code_fences(text)
+    start = text.find("{")
+    if start == -1:
+        return text
+    text = text[start:]
+
+    # Gå igenom texten och håll reda på öppna klamrar utanför strängar.
+    stack = []
+    in_string = False
+    escaped = False
+    end = None
+    for i, ch in enumerate(text):
+        if in_string:
+            if escaped:
+                escaped = False
+            elif ch == "\\":
+                escaped = True
+            elif ch == '"':
+                in_string = False
+            continue
+        if ch == '"':
+            in_string = True
+        elif ch in "{[":
+            stack.append(ch)
+        elif ch in "}]":
+            if stack:
+                stack.pop()
+            if not stack:
+                end = i + 1
+                break
+
+    if end is not None:
+        # Komplett objekt; allt efter sista } är prosa.
+        text = text[:end]
+    else:
+        # Avklippt svar: stäng sträng, ta bort halvfärdigt sista element och stäng klamrarna.
+        if in_string:
+            text += '"'
+        text = text.rstrip()
+        text = re.sub(r'[,:]\s*$', "", text)
+        text = re.sub(r',\s*"[^"]*"$', "", text) # Nyckel utan värde
+        text += "".join("}" if opener == "{" else "]" for opener in reversed(stack))
+
+    return _TRAILING_COMMA.sub(r"\1", text)
+
+
+def _coerce_number(value: Any) -> Any:
+    if isinstance(value, float):
+        return int(round(value))
+    if isinstance(value, str):
+        match = _NUMBER_IN_STRING.search(value)
+        if match:
+            return int(round(float(match.group(0).replace(",", "."))))
+    return value
+
+
+def _repair_design_data(data: Dict[str, Any], catalog: bool = False) -> Dict[str, Any]:
+    # Modellnära lagning efter json.loads: tal som strängar ("120 cm"), flyttal där heltal krävs,
+    # saknade ytmått och text_advice som inte är text.
+    required = {"id", "x", "y"} if catalog else {"name", "x", "y", "diameter"}
+    if not isinstance(data.get("text_advice"), str) and "text_advice" in data:
+        data["text_advice"] = str(data["text_advice"])
+    plan = data.get("garden_plan_data")
+    if not isinstance(plan, dict):
+        return data
+    plan.setdefault("area_width_cm", 500)
+    plan.setdefault("area_height_cm", 300)
+    if plan.get("paths") is None:
+        plan["paths"] = []
+    for key in ("area_width_cm", "area_height_cm"):
+        plan[key] = _coerce_number(plan[key])
+    plants = []
+    for plant in plan.get("plants") or []:
+        # Ofullständiga växter (oftast den sista i ett avklippt svar) tas bort.
+        if not isinstance(plant, dict) or not required <= plant.keys() or not plant.get("id" if catalog else "name"):
+            continue
+        for key in _INT_FIELDS & plant.keys():
+            plant[key] = _coerce_number(plant[key])
+        plants.append(plant)
+    plan["plants"] = plants
+    for path in plan["paths"]:
+        if isinstance(path, dict) and isinstance(path.get("points"), list):
+            path["points"] = [
+                [_coerce_number(c) for c in point[:2]]
+                for point in path["points"] if isinstance(point, (list, tuple)) and len(point) >= 2
+            ]
+    return data
+
+
+def parse_design_output(text: str, expand: Optional[DesignExpander] = None) -> Tuple[Optional[LLMDesignOutput], Optional[str]]:
+    """Returnerar (resultat, felmeddelande). Först ett model_validate_json-pass, sedan lokal reparation.
+
+    Med expand tolkas svaret som det kompakta katalogsvaret och fylls i från katalogen.
+    """
+    model = LLMCatalogDesignOutput if expand else LLMDesignOutput
+    try:
+        result = model.model_validate_json(strip_code_fences(text))
+        outcome = "ok"
+    except ValidationError as first_error:
+        logger.info(f"LLM-JSON klarade inte direkt validering, försöker laga lokalt: {str(first_error)[:200]}")
+        result = None
+
+    try:
+        if result is None:
+            data = json.loads(repair_json_text(text))
+            if not isinstance(data, dict):
+                raise ValueError("JSON-svaret är inte ett objekt.")
+            result = model.model_validate(_repair_design_data(data, catalog=expand is not None))
+            outcome = "repaired"
+            logger.info("LLM-JSON lagades lokalt utan nytt modellanrop.")
+        if expand:
+            result = expand(result)
+        _parse_total.inc(result=outcome)
+        return result, None
+    except (ValueError, ValidationError) as e:
+        _parse_total.inc(result="failed")
+        return None, str(e)
+
+
+def parse_design_variants(text: str, expand: Optional[DesignExpander] = None) -> Tuple[List[LLMDesignOutput], Optional[str]]:
+    """Returnerar (giltiga varianter, felmeddelande). Varianter som inte går att laga hoppas över,
+    så att ett delvis trasigt svar ändå ger de varianter som gick att tolka."""
+    variants_model, model = (
+        (LLMCatalogDesignVariantsOutput, LLMCatalogDesignOutput) if expand else (LLMDesignVariantsOutput, LLMDesignOutput)
+    )
+    raw_variants = None
+    try:
+        raw_variants = variants_model.model_validate_json(strip_code_fences(text)).variants
+        outcome = "ok"
+    except ValidationError as first_error:
+        logger.info(f"LLM-JSON (varianter) klarade inte direkt validering, försöker laga lokalt: {str(first_error)[:200]}")
+        outcome = "repaired"
+
+    if raw_variants is None:
+        try:
+            data = json.loads(repair_json_text(text))
+        except ValueError as e:
+            _parse_total.inc(result="failed")
+            return [], str(e)
+        raw_variants = data.get("variants") if isinstance(data, dict) else data
+        if not isinstance(raw_variants, list):
+            _parse_total.inc(result="failed")
+            return [], "JSON-svaret saknar listan \"variants\"."
+    variants, errors = [], []
+    for raw in raw_variants:
+        try:
+            if isinstance(raw, dict):
+                raw = model.model_validate(_repair_design_data(raw, catalog=expand is not None))
+            elif not isinstance(raw, model):
+                raise ValueError("Varianten är inte ett objekt.")
+            variants.append(expand(raw) if expand else raw)
+        except (ValueError, ValidationError) as e:
+            errors.append(str(e)[:200])
+    if outcome == "ok" and errors:
+        outcome = "repaired"
+    _parse_total.inc(result=outcome if variants else "failed")
+    return variants, "; ".join(errors) or None
+
+
+class TextAdviceStreamExtractor:
+    """Plockar ut värdet för "text_advice" ur ett JSON-svar som strömmas i bitar.
+
+    feed() returnerar den nya, avkodade texten sedan förra anropet, så att råden kan visas
+    för användaren medan resten av JSON-objektet (garden_plan_data) fortfarande genereras.
+    """
+
+    _KEY = re.compile(r'"text_advice"\s*:\s*"')
+    _HIGH_SURROGATE_TAIL = re.compile(r'(?<!\\)\\u[dD][89abAB][0-9a-fA-F]{2}$')
+
+    def __init__(self):
+        self._buffer = ""
+        self._start: Optional[int] = None # Index för första tecknet i strängvärdet
+        self._emitted = 0 # Antal avkodade tecken som redan skickats
+        self.done = False
+
+    def feed(self, chunk: str) -> str:
+        if self.done:
+            return ""
+        self._buffer += chunk
+        if self._start is None:
+            match = self._KEY.search(self._buffer)
+            if not match:
+                return ""
+            self._start = match.end()
+
+        raw = self._buffer[self._start:]
+        end = self._find_string_end(raw)
+        if end is not None:
+            self.done = True
+            safe = raw[:end]
+        else:
+            safe = self._safe_prefix(raw)
+            # En ensam hög surrogat (\ud83c) väntar på sin andra halva innan den avkodas.
+            safe = self._HIGH_SURROGATE_TAIL.sub("", safe)
+        try:
+            decoded = json.loads(f'"{safe}"')
+        except json.JSONDecodeError:
+            return ""
+        delta = decoded[self._emitted:]
+        self._emitted = len(decoded)
+        return delta
+
+    @staticmethod
+    def _find_string_end(raw: str) -> Optional[int]:
+        escaped = False
+        for i, ch in enumerate(raw):
+            if escaped:
+                escaped = False
+            elif ch == "\\":
+                escaped = True
+            elif ch == '"':
+                return i
+        return None
+
+    @staticmethod
+    def _safe_prefix(raw: str) -> str:
+        # Klipp av en halvfärdig escape-sekvens (t.ex. "\" eller "\u00e") i slutet av bufferten.
+        backslash = raw.rfind("\\")
+        if backslash == -1:
+            return raw
+        run = 0
+        i = backslash
+        while i >= 0 and raw[i] == "\\":
+            run += 1
+            i -= 1
+        # Ett jämnt antal backslashes i rad betyder att den sista är en escapad backslash.
+        if run % 2 == 0:
+            return raw
+        tail = raw[backslash + 1:]
+        if not tail:
+            return raw[:backslash]
+        if tail[0] == "u" and len(tail) < 5:
+            return raw[:backslash]
+        return raw
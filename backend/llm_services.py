@@ -1,16 +1,31 @@
+import asyncio
 import os
 from fastapi import HTTPException
-from google.cloud import aiplatform
-from vertexai.preview.generative_models import GenerativeModel, Part, GenerationConfig
-import json
 import logging
 import httpx # Importera httpx för att hämta bilddata
+from typing import Any, AsyncIterator, List, Optional, Tuple, Union
 
 # Importera Pydantic-modeller
-from .models import LLMDesignOutput, GardenPlanData, PlantData, PathData
+from .models import LLMCatalogDesignOutput, LLMCatalogDesignVariantsOutput, LLMDesignOutput, LLMDesignVariantsOutput
+from . import cache
+from . import llm_clients
+from . import llm_guard
+from . import llm_hedge
+from . import llm_json
+from . import metrics
+from . import plant_catalog
+from . import prompts
+from . import single_flight
+from . import tracing
 
 logger = logging.getLogger(__name__)
 
+# Modellnivåer i prioritetsordning, t.ex. en Pro-modell och sedan en snabbare Flash-modell.
+# Senare nivåer används för hedgade anrop och som fallback (se llm_hedge.py).
+GEMINI_MODEL_TIERS = [
+    m.strip() for m in os.getenv("GEMINI_MODEL_TIERS", "gemini-2.5-pro-preview-05-06,gemini-2.5-flash").split(",") if m.strip()
+]
+
 # Global variabel för vald Gemini-modell
 CHOSEN_GEMINI_MODEL = None
 GOOGLE_PROJECT_ID_USED = None # För loggning
@@ -25,14 +40,14 @@ try:
     if not PROJECT_ID or not LOCATION:
         logger.error("VIKTIGT: GOOGLE_PROJECT_ID eller GOOGLE_LOCATION är inte satta som miljövariabler på Render!")
     else:
-        aiplatform.init(project=PROJECT_ID, location=LOCATION)
+        # Själva aiplatform.init körs när Vertex-SDK:t laddas (se llm_clients.load_vertex).
+        llm_clients.registry.configure(PROJECT_ID, LOCATION)
         logger.info(f"Försöker prata med Google Vertex AI i projekt '{PROJECT_ID}' och plats '{LOCATION}'.")
 
-        # HÄR VÄLJER DU DIN SENASTE MODELL!
+        # HÄR VÄLJER DU DIN SENASTE MODELL! Första nivån i GEMINI_MODEL_TIERS används i första hand.
         # VERIFIERA DETTA EXAKTA MODELL-ID I DIN GOOGLE CLOUD CONSOLE (Vertex AI > Model Garden)
         # FÖR DITT PROJEKT 'tradgardsleads' OCH REGION 'europe-north1'.
-        CHOSEN_GEMINI_MODEL = "gemini-2.5-pro-preview-05-06"  # <-- UPPDATERAD TILL MODELL-ID FRÅN DOKUMENTATIONEN!
-                                                              # VERIFIERA ATT DENNA ÄR TILLGÄNGLIG FÖR DIG!
+        CHOSEN_GEMINI_MODEL = GEMINI_MODEL_TIERS[0]
         
         logger.info(f"Vald Gemini-modell för användning: {CHOSEN_GEMINI_MODEL} (Projekt: {PROJECT_ID}, Plats: {LOCATION})")
 
@@ -40,10 +55,76 @@ except Exception as e:
     logger.error(f"ALLVARLIGT FEL: Kunde inte starta kopplingen till Vertex AI: {e} (Projekt: {GOOGLE_PROJECT_ID_USED}, Plats: {GOOGLE_LOCATION_USED})", exc_info=True)
     # CHOSEN_GEMINI_MODEL förblir None
 
-async def analyze_image_with_google_llm(image_url: str, actual_mime_type: str) -> str:
-    logger.info(f"Bild-roboten ({CHOSEN_GEMINI_MODEL if CHOSEN_GEMINI_MODEL else 'Odefinierad modell'}) ska titta på bild från URL: {image_url} med typ: {actual_mime_type}")
+# Strukturerat svar: Gemini får ett response_schema härlett från LLMDesignOutput (JSON MIME-typ).
+LLM_STRUCTURED_OUTPUT = os.getenv("LLM_STRUCTURED_OUTPUT", "true").lower() == "true"
+# Antal nya frågor till modellen om svaret inte går att tolka ens efter lokal reparation.
+LLM_DESIGN_MAX_REPROMPTS = int(os.getenv("LLM_DESIGN_MAX_REPROMPTS", "1"))
+DESIGN_RESPONSE_SCHEMA = llm_json.pydantic_to_response_schema(LLMDesignOutput)
+DESIGN_VARIANTS_RESPONSE_SCHEMA = llm_json.pydantic_to_response_schema(LLMDesignVariantsOutput)
+# Kompakta scheman (id + position per växt) för promptversionen med växtkatalogen
+DESIGN_CATALOG_RESPONSE_SCHEMA = llm_json.pydantic_to_response_schema(LLMCatalogDesignOutput)
+DESIGN_CATALOG_VARIANTS_RESPONSE_SCHEMA = llm_json.pydantic_to_response_schema(LLMCatalogDesignVariantsOutput)
+# Flera stilvarianter i ett anrop (batch-endpointen) behöver plats för flera planer i svaret.
+LLM_DESIGN_VARIANTS_MAX_OUTPUT_TOKENS = int(os.getenv("LLM_DESIGN_VARIANTS_MAX_OUTPUT_TOKENS", "8192"))
+
+_design_reprompts_total = metrics.counter("llm_design_reprompts_total", "Nya designanrop p.g.a. otolkbar JSON")
+
+# Designfrågan (statisk mall + suffix) finns i prompts.py. Prefix under Vertex minsta storlek för
+# cachat kontext registreras inte; de skickas då som system_instruction per anrop.
+LLM_PROMPT_CACHE_MIN_TOKENS = int(os.getenv("LLM_PROMPT_CACHE_MIN_TOKENS", "2048"))
+
+_prompt_tokens_total = metrics.counter("llm_prompt_tokens_total", "Indatatokens för designanropet per promptversion och typ (uncached/cached)")
+
+# Öka versionen när frågan ändras, så att gamla cachade analyser inte återanvänds.
+IMAGE_ANALYSIS_PROMPT_VERSION = "v1"
+IMAGE_ANALYSIS_PROMPT = (
+    "Titta noga på den här bilden av en trädgård på svenska. Berätta kort om: "
+    "1. Vad ser du för ytor (gräs, sten, rabatt)? "
+    "2. Finns det stora saker (hus, staket, stora träd)? "
+    "3. Ser det soligt, skuggigt eller mittemellan ut? "
+    "4. Ser du några växter du känner igen (gissa inte om du är osäker)? "
+    "Fokusera på vad som är viktigt om man ska planera en trädgård där."
+)
+
+# Analystext per (bildhash, modell, promptversion). Samma foto som skickas igen kostar inget nytt Gemini-anrop.
+_image_analysis_cache = cache.get_cache("image_analysis")
+
+
+# Samtidiga identiska anrop delar på ett pågående anrop (se single_flight.py).
+_image_analysis_flights = single_flight.SingleFlight("image_analysis")
+_design_flights = single_flight.SingleFlight("design")
+
+
+def image_analysis_cache_key(image_hash: str) -> str:
+    return f"{image_hash}:{CHOSEN_GEMINI_MODEL}:{IMAGE_ANALYSIS_PROMPT_VERSION}"
+
+
+async def analyze_image_with_google_llm(
+    image_url: Optional[str],
+    actual_mime_type: str,
+    image_bytes: Optional[Union[bytes, memoryview]] = None,
+    image_hash: Optional[str] = None
+) -> str:
+    # Om image_bytes skickas med används de direkt och bilden hämtas inte igen från image_url.
+    # Med image_hash (se cache.content_hash) återanvänds en tidigare analys av samma bild, och
+    # samtidiga analyser av samma bild delar på ett enda Gemini-anrop.
+    if not image_hash:
+        return await _analyze_image(image_url, actual_mime_type, image_bytes, image_hash)
+    key = single_flight.make_key(image_hash, CHOSEN_GEMINI_MODEL, IMAGE_ANALYSIS_PROMPT_VERSION)
+    return await _image_analysis_flights.do(
+        key, lambda: _analyze_image(image_url, actual_mime_type, image_bytes, image_hash)
+    )
+
+
+async def _analyze_image(
+    image_url: Optional[str],
+    actual_mime_type: str,
+    image_bytes: Optional[Union[bytes, memoryview]],
+    image_hash: Optional[str]
+) -> str:
+    logger.info(f"Bild-roboten ({CHOSEN_GEMINI_MODEL if CHOSEN_GEMINI_MODEL else 'Odefinierad modell'}) ska titta på bild från {'minnet' if image_bytes is not None else f'URL: {image_url}'} med typ: {actual_mime_type}")
     
-    if not image_url:
+    if image_bytes is None and not image_url:
         return "Ingen bild att titta på (URL saknas)!"
     if not actual_mime_type:
         logger.warning("MIME-typ saknas för bildanalys, kan inte fortsätta.")
@@ -52,46 +133,64 @@ async def analyze_image_with_google_llm(image_url: str, actual_mime_type: str) -
         logger.error("analyze_image_with_google_llm: Vertex AI är inte korrekt initierad (CHOSEN_GEMINI_MODEL är None).")
         return "Fel: AI-tjänsten för bildanalys är inte korrekt konfigurerad."
 
+    if image_hash:
+        cached_text = await _image_analysis_cache.get(image_analysis_cache_key(image_hash))
+        if cached_text:
+            logger.info(f"Bildanalys hämtad från cache för bild {image_hash[:12]}.")
+            return cached_text
+
+    clean_image_url = image_url.rstrip('?') if image_url else None
     try:
-        clean_image_url = image_url.rstrip('?')
-        logger.info(f"Rensad bild-URL för hämtning: {clean_image_url}")
+        if image_bytes is None:
+            logger.info(f"Rensad bild-URL för hämtning: {clean_image_url}")
 
-        async with httpx.AsyncClient() as client:
+            # Delad klient med keep-alive (se llm_clients.py) i stället för en ny per anrop.
+            client = llm_clients.registry.http
             logger.info(f"Försöker hämta bilddata från: {clean_image_url}")
-            response = await client.get(clean_image_url)
-            response.raise_for_status() 
+            with tracing.span("image_fetch"):
+                response = await client.get(clean_image_url)
+                response.raise_for_status() 
             image_bytes = response.content
+            tracing.record_bytes("image_fetch", len(image_bytes))
             logger.info(f"Bilddata hämtad, storlek: {len(image_bytes)} bytes.")
-
-        model = GenerativeModel(CHOSEN_GEMINI_MODEL)
-        image_part = Part.from_data(data=image_bytes, mime_type=actual_mime_type) 
-
-        fraga_till_roboten = (
-            "Titta noga på den här bilden av en trädgård på svenska. Berätta kort om: "
-            "1. Vad ser du för ytor (gräs, sten, rabatt)? "
-            "2. Finns det stora saker (hus, staket, stora träd)? "
-            "3. Ser det soligt, skuggigt eller mittemellan ut? "
-            "4. Ser du några växter du känner igen (gissa inte om du är osäker)? "
-            "Fokusera på vad som är viktigt om man ska planera en trädgård där."
-        )
-
-        svar_fran_roboten = await model.generate_content_async(
-            [image_part, fraga_till_roboten],
-            generation_config=GenerationConfig(temperature=0.2, max_output_tokens=500)
+        elif isinstance(image_bytes, memoryview):
+            image_bytes = image_bytes.tobytes() # Part.from_data vill ha bytes
+
+        await llm_clients.registry.ensure_vertex()
+        image_part = llm_clients.image_part(image_bytes, actual_mime_type)
+        tracing.record_bytes("vision_call", len(image_bytes))
+
+        async def attempt(model_id: str) -> Tuple[str, str]:
+            model = llm_clients.registry.model(model_id, "image_analysis", IMAGE_ANALYSIS_GENERATION_CONFIG)
+            # Adaptiv gräns + circuit breaker (se llm_guard.py) framför anropet.
+            async with llm_guard.image_analysis_guard.call(model_id):
+                with tracing.span("vision_call"):
+                    svar_fran_roboten = await model.generate_content_async([image_part, IMAGE_ANALYSIS_PROMPT])
+            tracing.record_usage("image_analysis", model_id, svar_fran_roboten)
+            text_svar = _response_text(svar_fran_roboten).strip()
+            if not text_svar:
+                raise EmptyLLMResponseError(f"Bild-roboten ({model_id}) gav ett konstigt eller tomt svar: {svar_fran_roboten}")
+            return model_id, text_svar
+
+        winning_model, text_svar = await llm_hedge.hedged_call(
+            "image_analysis", model_tiers(), attempt, llm_hedge.LLM_HEDGE_ANALYSIS_DELAY_S
         )
-        
-        if svar_fran_roboten.candidates and svar_fran_roboten.candidates[0].content.parts:
-            text_svar = "".join(part.text for part in svar_fran_roboten.candidates[0].content.parts if hasattr(part, 'text'))
-            if text_svar:
-                logger.info("Bild-roboten gav ett svar.")
-                return text_svar.strip()
-        
-        logger.warning(f"Bild-roboten gav ett konstigt eller tomt svar: {svar_fran_roboten}")
+        logger.info(f"Bild-roboten ({winning_model}) gav ett svar.")
+        # Cachen gäller förstahandsmodellens analys; ett svar från en lägre nivå (hedge eller
+        # fallback) sparas inte, så att nästa anrop får en chans till förstahandsmodellen.
+        if image_hash and winning_model == CHOSEN_GEMINI_MODEL:
+            await _image_analysis_cache.set(image_analysis_cache_key(image_hash), text_svar)
+        return text_svar
+
+    except EmptyLLMResponseError as empty_err:
+        logger.warning(str(empty_err))
         return "Tyvärr kunde jag inte förstå bilden just nu."
-
     except httpx.HTTPStatusError as http_err:
         logger.error(f"HTTP-fel vid hämtning av bild från Supabase URL ({clean_image_url}): {http_err}", exc_info=True)
         return f"Kunde inte hämta bilden från molnet för analys (HTTP-fel: {http_err.response.status_code})."
+    except llm_guard.GuardRejectedError as guard_err:
+        logger.warning(f"Bildanalysen nekades direkt: {guard_err}")
+        return "Bildanalys kunde inte utföras (AI-tjänsten är överbelastad just nu)."
     except Exception as e:
         logger.error(f"Aj! Något gick fel när bild-roboten jobbade: {e}", exc_info=True)
         if "Publisher Model" in str(e) or "is not supported" in str(e) or "was not found" in str(e):
@@ -99,10 +198,176 @@ async def analyze_image_with_google_llm(image_url: str, actual_mime_type: str) -
         return f"Ett tekniskt fel uppstod under bildanalysen: {str(e)[:150]}"
 
 
+def _design_generation_config(response_schema: dict = DESIGN_RESPONSE_SCHEMA) -> dict:
+    if LLM_STRUCTURED_OUTPUT:
+        # Gemini tvingas svara med JSON enligt schemat från LLMDesignOutput (eller katalogvarianten).
+        return dict(
+            temperature=0.7,
+            max_output_tokens=2048,
+            response_mime_type="application/json",
+            response_schema=response_schema
+        )
+    else:
+        return dict(
+            temperature=0.7,
+            max_output_tokens=2048,
+        )
+
+
+def _design_variants_generation_config(response_schema: dict = DESIGN_VARIANTS_RESPONSE_SCHEMA) -> dict:
+    if LLM_STRUCTURED_OUTPUT:
+        return dict(
+            temperature=0.7,
+            max_output_tokens=LLM_DESIGN_VARIANTS_MAX_OUTPUT_TOKENS,
+            response_mime_type="application/json",
+            response_schema=response_schema
+        )
+    return dict(temperature=0.7, max_output_tokens=LLM_DESIGN_VARIANTS_MAX_OUTPUT_TOKENS)
+
+
+# Generationskonfigurationerna byggs en gång och sitter i de återanvända modellhandtagen. De är
+# vanliga dicts (GenerationConfig-fälten) så att modulen kan importeras utan Vertex-SDK:t.
+IMAGE_ANALYSIS_GENERATION_CONFIG = dict(temperature=0.2, max_output_tokens=500)
+DESIGN_GENERATION_CONFIG = _design_generation_config()
+DESIGN_VARIANTS_GENERATION_CONFIG = _design_variants_generation_config()
+DESIGN_CATALOG_GENERATION_CONFIG = _design_generation_config(DESIGN_CATALOG_RESPONSE_SCHEMA)
+DESIGN_CATALOG_VARIANTS_GENERATION_CONFIG = _design_variants_generation_config(DESIGN_CATALOG_VARIANTS_RESPONSE_SCHEMA)
+
+
+class EmptyLLMResponseError(Exception):
+    pass
+
+
+def model_tiers() -> List[str]:
+    """Vald modell först, sedan övriga nivåer i ordning."""
+    return [CHOSEN_GEMINI_MODEL] + [m for m in GEMINI_MODEL_TIERS if m != CHOSEN_GEMINI_MODEL]
+
+
+def _design_config_name() -> str:
+    return f"design:{prompts.design_prompt_version()}"
+
+
+def _design_config() -> dict:
+    return DESIGN_CATALOG_GENERATION_CONFIG if prompts.design_uses_catalog() else DESIGN_GENERATION_CONFIG
+
+
+def _design_variants_config() -> dict:
+    return DESIGN_CATALOG_VARIANTS_GENERATION_CONFIG if prompts.design_uses_catalog() else DESIGN_VARIANTS_GENERATION_CONFIG
+
+
+def _design_expander(user_location: str) -> Optional[llm_json.DesignExpander]:
+    """Fyller i katalogsvaret för platsens växtzon, eller None när frågan inte använder katalogen."""
+    if not prompts.design_uses_catalog():
+        return None
+    zone = plant_catalog.parse_zone(user_location)
+    return lambda output: plant_catalog.expand_design(output, zone)
+
+
+async def _prepare_design():
+    # Vertex-SDK:t och växtkatalogen förladdas i bakgrunden (startup.py). Har det inte hunnit klart
+    # laddas de här i en tråd, så att importen och katalogens lås aldrig tas på event-loopen.
+    await llm_clients.registry.ensure_vertex()
+    if prompts.design_uses_catalog() and not plant_catalog.catalog.loaded:
+        await asyncio.to_thread(plant_catalog.catalog.available)
+
+
+def _design_model(model_id: str):
+    # Den statiska mallen sitter i handtaget (system_instruction eller cachat kontext).
+    return llm_clients.registry.model(model_id, _design_config_name(), _design_config(), prompts.design_system_prompt())
+
+
+def warmup_models() -> Tuple[Tuple[str, str, dict, Optional[str]], ...]:
+    """Modellhandtagen som byggs vid start; det första (design på vald modell) värms även upp."""
+    if not CHOSEN_GEMINI_MODEL:
+        return ()
+    return tuple(
+        (model_id, config_name, config, system_instruction)
+        for config_name, config, system_instruction in (
+            (_design_config_name(), _design_config(), prompts.design_system_prompt()),
+            ("image_analysis", IMAGE_ANALYSIS_GENERATION_CONFIG, None),
+        )
+        for model_id in model_tiers()
+    )
+
+
+def cached_prefixes() -> Tuple[llm_clients.CachedPrefix, ...]:
+    """Designmallen som cachat kontext per modellnivå, om den är stor nog för Vertex context caching."""
+    system_prompt = prompts.design_system_prompt()
+    if not CHOSEN_GEMINI_MODEL or system_prompt is None:
+        return ()
+    estimated = prompts.estimate_tokens(system_prompt)
+    if estimated < LLM_PROMPT_CACHE_MIN_TOKENS:
+        logger.info(
+            f"Designmallen ({prompts.design_prompt_version()}) är ca {estimated} tokens, under {LLM_PROMPT_CACHE_MIN_TOKENS}; "
+            "den skickas som system_instruction per anrop i stället för som cachat kontext."
+        )
+        return ()
+    return tuple((model_id, _design_config_name(), _design_config(), system_prompt) for model_id in model_tiers())
+
+
+def _log_design_usage(model_id: str, response, prompt: str):
+    # Promptversion och indatatokens loggas med varje designsvar. Vertex usage_metadata används när
+    # det finns, annars den lokala uppskattningen i prompts.estimate_tokens.
+    version = prompts.design_prompt_version()
+    usage = getattr(response, "usage_metadata", None)
+    prompt_tokens = getattr(usage, "prompt_token_count", 0) or 0
+    cached_tokens = getattr(usage, "cached_content_token_count", 0) or 0
+    source = "Vertex"
+    if not prompt_tokens:
+        source = "uppskattat"
+        static_tokens = prompts.estimate_tokens(prompts.design_system_prompt() or "")
+        prompt_tokens = prompts.estimate_tokens(prompt) + static_tokens
+        cached_tokens = static_tokens if llm_clients.registry.has_cached_prefix(model_id, _design_config_name()) else 0
+    _prompt_tokens_total.inc(prompt_tokens - cached_tokens, prompt_version=version, kind="uncached")
+    _prompt_tokens_total.inc(cached_tokens, prompt_version=version, kind="cached")
+    logger.info(f"Designsvar från {model_id} (prompt {version}): {prompt_tokens} indatatokens, varav {cached_tokens} cachade ({source}).")
+
+
+def _response_text(response) -> str:
+    if response.candidates and response.candidates[0].content.parts:
+        return "".join(part.text for part in response.candidates[0].content.parts if hasattr(part, 'text'))
+    return ""
+
+
+def _design_http_error(e: Exception) -> HTTPException:
+    logger.error(f"Aj! Något gick fel när text-roboten jobbade: {e}", exc_info=True)
+    if "Publisher Model" in str(e) or "is not supported" in str(e) or "was not found" in str(e):
+        return HTTPException(status_code=503, detail=f"Ett tekniskt fel med AI-designen: Modellen '{CHOSEN_GEMINI_MODEL}' kunde inte användas. Kontrollera modellnamn och tillgänglighet i Google Cloud. Fel: {str(e)[:100]}")
+    return HTTPException(status_code=503, detail=f"Ett tekniskt fel uppstod med AI-designen: {str(e)[:150]}")
+
+
+def _overloaded_http_error(e: llm_guard.GuardRejectedError) -> HTTPException:
+    # Nekat av gränsen eller breakern: snabbt 503 med Retry-After i stället för att vänta ut tidsgränsen.
+    logger.warning(f"Designanropet nekades direkt: {e}")
+    return HTTPException(
+        status_code=503,
+        detail="AI-tjänsten är överbelastad just nu. Försök igen om en stund.",
+        headers={"Retry-After": str(e.retry_after_s)}
+    )
+
+
 async def get_garden_advice_from_google_llm(
     image_analysis_text: str,
     user_location: str,
     user_preferences: str
+) -> LLMDesignOutput:
+    if CHOSEN_GEMINI_MODEL:
+        await _prepare_design() # Före nyckeln: promptversionen beror på om katalogen gick att läsa
+    # Dubbelklick och omförsök med samma indata delar på ett pågående designanrop. Analystexten
+    # kommer från den cachade analysen av bildens hash, så den står här för bilden i nyckeln.
+    key = single_flight.make_key(
+        image_analysis_text, user_location, user_preferences, CHOSEN_GEMINI_MODEL, prompts.design_prompt_version(), LLM_STRUCTURED_OUTPUT
+    )
+    llm_output = await _design_flights.do(
+        key, lambda: _get_garden_advice(image_analysis_text, user_location, user_preferences)
+    )
+    return llm_output.model_copy(deep=True) # Varje väntare får en egen kopia att bearbeta vidare
+
+
+async def _get_garden_advice(
+    image_analysis_text: str,
+    user_location: str,
+    user_preferences: str
 ) -> LLMDesignOutput:
     logger.info(f"Text-roboten ({CHOSEN_GEMINI_MODEL if CHOSEN_GEMINI_MODEL else 'Odefinierad modell'}) ska designa en trädgård. Info: Plats='{user_location}', Bildanalys='{image_analysis_text[:50]}...'")
 
@@ -110,111 +375,199 @@ async def get_garden_advice_from_google_llm(
         logger.error("get_garden_advice_from_google_llm: Vertex AI är inte korrekt initierad (CHOSEN_GEMINI_MODEL är None).")
         raise HTTPException(status_code=503, detail="Fel: AI-tjänsten för textgenerering är inte korrekt konfigurerad.")
 
-    instruktion_till_roboten = f"""
-    Du är en superduktig trädgårdsdesigner som pratar svenska.
-    Här är informationen du har:
-    - Plats och växtzon: {user_location}
-    - Vad bild-roboten såg: {image_analysis_text}
-    - Vad användaren önskar sig: {user_preferences}
-
-    Din uppgift är att svara med en JSON-kod. JSON-koden ska ha två huvuddelar: "text_advice" och "garden_plan_data".
-
-    1.  "text_advice": (Detta ska vara en vanlig text) Skriv en trevlig text som förklarar:
-        * Vilken stil på trädgården du föreslår (t.ex. "mysig stugträdgård", "modern och enkel").
-        * Varför du valde den stilen.
-        * Lite om hur växterna ska placeras.
-        * Några enkla skötselråd.
-        * Kanske förslag på en fin gång eller en bänk.
-
-    2.  "garden_plan_data": (Detta ska vara mer JSON-kod inuti) Här beskriver du planen mer exakt:
-        * "area_width_cm": (Ett tal) Hur bred är trädgården i centimeter (t.ex. 500 om den är 5 meter)? Gör en smart gissning.
-        * "area_height_cm": (Ett tal) Hur djup är trädgården i centimeter (t.ex. 300 om den är 3 meter)? Gör en smart gissning.
-        * "plants": (En lista med växter) Ge förslag på 5-7 växter. För varje växt, skriv:
-            * "name": (Text) Svenskt namn på växten.
-            * "latin_name": (Text, valfritt) Latinskt namn.
-            * "x": (Ett tal) Var på en karta (vänster till höger, från 0) växten ska vara, i cm.
-            * "y": (Ett tal) Var på en karta (uppe till nere, från 0) växten ska vara, i cm.
-            * "diameter": (Ett tal) Hur bred växten blir när den är stor, i cm.
-            * "color_2d": (Text) Vilken färg den ska ha på vår enkla karta (t.ex. "rosa", "mörkgrön", "lightblue").
-            * "height_3d": (Ett tal i meter, eller texten "okänd") Hur hög växten blir.
-        * "paths": (En lista med gångar, kan vara tom [{{"points": [[x1,y1],[x2,y2],...], "color": "gray"}}]) Om du föreslår en gång, beskriv den med en lista av punkter (x,y) i cm och en färg.
-
-    Exempel på hur "garden_plan_data" ska se ut (OBS: ge mig bara JSON-objektet, inget extra prat före eller efter):
-    ```json
-    {{
-        "area_width_cm": 700,
-        "area_height_cm": 400,
-        "plants": [
-            {{"name": "Stjärnflocka", "latin_name": "Astrantia major", "x": 100, "y": 150, "diameter": 40, "color_2d": "pink", "height_3d": 0.6}},
-            {{"name": "Jättedaggkåpa", "latin_name": "Alchemilla mollis", "x": 200, "y": 250, "diameter": 50, "color_2d": "limegreen", "height_3d": 0.4}}
-        ],
-        "paths": [
-            {{"points": [[0, 350], [700, 350], [700, 380], [0, 380]], "color": "lightgray"}}
-        ]
-    }}
-    ```
-    Se till att hela ditt svar är en enda giltig JSON-sträng som börjar med {{ och slutar med }}.
-    """
+    instruktion_till_roboten = prompts.build_design_prompt(image_analysis_text, user_location, user_preferences)
+    expand = _design_expander(user_location)
 
     try:
-        model = GenerativeModel(CHOSEN_GEMINI_MODEL)
+        # Hedgat över modellnivåerna: ett långsamt eller trasigt Pro-anrop ersätts av nästa nivå.
+        return await llm_hedge.hedged_call(
+            "design",
+            model_tiers(),
+            lambda model_id: _design_with_model(model_id, instruktion_till_roboten, expand),
+            llm_hedge.LLM_HEDGE_DESIGN_DELAY_S
+        )
+    except HTTPException: 
+        raise
+    except llm_guard.GuardRejectedError as e:
+        raise _overloaded_http_error(e)
+    except Exception as e:
+        raise _design_http_error(e)
+
 
-        svar_fran_roboten = await model.generate_content_async(
-            instruktion_till_roboten,
-            generation_config=GenerationConfig(
-                temperature=0.7,
-                max_output_tokens=2048,
+async def _design_with_model(
+    model_id: str,
+    instruktion_till_roboten: str,
+    expand: Optional[llm_json.DesignExpander] = None
+) -> LLMDesignOutput:
+    # Ett designförsök mot en modell, med ny fråga om svaret inte går att tolka. Kastar vid ogiltigt svar.
+    model = _design_model(model_id)
+    prompt = instruktion_till_roboten
+
+    for attempt in range(LLM_DESIGN_MAX_REPROMPTS + 1):
+        async with llm_guard.design_guard.call(model_id):
+            with tracing.span("design_call"):
+                svar_fran_roboten = await model.generate_content_async(prompt)
+
+        _log_design_usage(model_id, svar_fran_roboten, prompt)
+        tracing.record_usage("design", model_id, svar_fran_roboten)
+        json_text_svar = _response_text(svar_fran_roboten).strip()
+        tracing.record_bytes("design_call", len(json_text_svar))
+        if not json_text_svar:
+            logger.warning(f"Text-roboten ({model_id}) gav ett konstigt eller tomt svar: {svar_fran_roboten}")
+            raise HTTPException(status_code=503, detail="AI:n kunde inte generera trädgårdsråd just nu.")
+
+        logger.debug(f"Rå JSON från LLM: {json_text_svar}")
+
+        # Ett valideringspass mot LLMDesignOutput, med lokal reparation innan vi frågar igen.
+        # Med katalogen fylls växterna i här; ett svar utan giltiga id:n räknas som otolkbart.
+        with tracing.span("json_parse"):
+            llm_output, parse_error = llm_json.parse_design_output(json_text_svar, expand)
+        if llm_output is not None:
+            logger.info(f"Text-roboten ({model_id}) gav ett bra svar och det kunde förstås.")
+            return llm_output
+
+        logger.error(f"Kunde inte tolka JSON från text-roboten (försök {attempt + 1}): {parse_error[:300]}. Svar var: {json_text_svar[:500]}")
+        if attempt < LLM_DESIGN_MAX_REPROMPTS:
+            _design_reprompts_total.inc()
+            prompt = (
+                instruktion_till_roboten
+                + f"\n\nDitt förra svar kunde inte tolkas ({parse_error[:200]}). "
+                "Svara igen med enbart ett giltigt JSON-objekt enligt beskrivningen ovan."
             )
-        )
 
-        if svar_fran_roboten.candidates and svar_fran_roboten.candidates[0].content.parts:
-            json_text_svar = "".join(part.text for part in svar_fran_roboten.candidates[0].content.parts if hasattr(part, 'text')).strip()
-            
-            if json_text_svar.startswith("```json"):
-                json_text_svar = json_text_svar[len("```json"):]
-            if json_text_svar.endswith("```"):
-                json_text_svar = json_text_svar[:-len("```")]
-            json_text_svar = json_text_svar.strip()
-            
-            logger.debug(f"Rå JSON från LLM: {json_text_svar}")
-
-            try:
-                llm_data = json.loads(json_text_svar)
-            except json.JSONDecodeError as json_e:
-                logger.error(f"Kunde inte förstå JSON från text-roboten: {json_e}. Svar var: {json_text_svar}", exc_info=True)
-                raise HTTPException(status_code=500, detail=f"AI:n gav ett svar i ett format som inte kunde tolkas (JSON-fel): {json_text_svar[:200]}")
-
-            if "text_advice" not in llm_data or "garden_plan_data" not in llm_data:
-                logger.error(f"Nödvändiga nycklar saknas i LLM JSON-svar: {llm_data.keys()}")
-                raise HTTPException(status_code=500, detail="AI:n gav ett ofullständigt svar (saknar nödvändiga delar).")
-
-            try:
-                raw_plan_data = llm_data["garden_plan_data"]
-                plants_list = [PlantData(**p) for p in raw_plan_data.get("plants", [])]
-                paths_list = [PathData(**p) for p in raw_plan_data.get("paths", [])] if raw_plan_data.get("paths") is not None else []
-
-                garden_plan = GardenPlanData(
-                    area_width_cm=raw_plan_data.get("area_width_cm", 500),
-                    area_height_cm=raw_plan_data.get("area_height_cm", 300),
-                    plants=plants_list,
-                    paths=paths_list
-                )
-                text_advice = str(llm_data["text_advice"])
-
-                logger.info("Text-roboten gav ett bra svar och det kunde förstås.")
-                return LLMDesignOutput(text_advice=text_advice, garden_plan_data=garden_plan)
-
-            except Exception as pydantic_e:
-                logger.error(f"Fel när Pydantic skulle validera LLM-data: {pydantic_e}. Rådata för garden_plan_data: {raw_plan_data}", exc_info=True)
-                raise HTTPException(status_code=500, detail=f"AI:n gav data i ett oväntat format (valideringsfel): {str(pydantic_e)[:150]}")
-        
-        logger.warning(f"Text-roboten gav ett konstigt eller tomt svar: {svar_fran_roboten}")
-        raise HTTPException(status_code=503, detail="AI:n kunde inte generera trädgårdsråd just nu.")
+    raise HTTPException(status_code=500, detail=f"AI:n gav ett svar i ett format som inte kunde tolkas (JSON-fel): {json_text_svar[:200]}")
 
-    except HTTPException: 
+
+async def get_garden_variants_from_google_llm(
+    image_analysis_text: str,
+    user_location: str,
+    user_preferences: str,
+    styles: List[str]
+) -> List[LLMDesignOutput]:
+    """Flera stilvarianter av samma trädgård i ett enda designanrop, i samma ordning som styles.
+
+    Kan ge färre varianter än begärt om svaret bara delvis gick att tolka; anroparen designar
+    då de saknade var för sig.
+    """
+    logger.info(f"Text-roboten ({CHOSEN_GEMINI_MODEL if CHOSEN_GEMINI_MODEL else 'Odefinierad modell'}) ska designa {len(styles)} varianter. Info: Plats='{user_location}'")
+
+    if not CHOSEN_GEMINI_MODEL:
+        logger.error("get_garden_variants_from_google_llm: Vertex AI är inte korrekt initierad (CHOSEN_GEMINI_MODEL är None).")
+        raise HTTPException(status_code=503, detail="Fel: AI-tjänsten för textgenerering är inte korrekt konfigurerad.")
+
+    await _prepare_design()
+    instruktion_till_roboten = prompts.build_design_variants_prompt(image_analysis_text, user_location, user_preferences, styles)
+    expand = _design_expander(user_location)
+    try:
+        return await llm_hedge.hedged_call(
+            "design_variants",
+            model_tiers(),
+            lambda model_id: _design_variants_with_model(model_id, instruktion_till_roboten, len(styles), expand),
+            llm_hedge.LLM_HEDGE_DESIGN_DELAY_S
+        )
+    except HTTPException:
         raise
+    except llm_guard.GuardRejectedError as e:
+        raise _overloaded_http_error(e)
     except Exception as e:
-        logger.error(f"Aj! Något gick fel när text-roboten jobbade: {e}", exc_info=True)
-        if "Publisher Model" in str(e) or "is not supported" in str(e) or "was not found" in str(e):
-             raise HTTPException(status_code=503, detail=f"Ett tekniskt fel med AI-designen: Modellen '{CHOSEN_GEMINI_MODEL}' kunde inte användas. Kontrollera modellnamn och tillgänglighet i Google Cloud. Fel: {str(e)[:100]}")
-        raise HTTPException(status_code=503, detail=f"Ett tekniskt fel uppstod med AI-designen: {str(e)[:150]}")
+        raise _design_http_error(e)
+
+
+async def _design_variants_with_model(
+    model_id: str,
+    instruktion_till_roboten: str,
+    expected: int,
+    expand: Optional[llm_json.DesignExpander] = None
+) -> List[LLMDesignOutput]:
+    model = llm_clients.registry.model(
+        model_id, f"design_variants:{prompts.design_prompt_version()}", _design_variants_config(), prompts.design_system_prompt()
+    )
+    async with llm_guard.design_guard.call(model_id):
+        with tracing.span("design_call"):
+            svar_fran_roboten = await model.generate_content_async(instruktion_till_roboten)
+
+    _log_design_usage(model_id, svar_fran_roboten, instruktion_till_roboten)
+    tracing.record_usage("design_variants", model_id, svar_fran_roboten)
+    json_text_svar = _response_text(svar_fran_roboten).strip()
+    tracing.record_bytes("design_call", len(json_text_svar))
+    if not json_text_svar:
+        logger.warning(f"Text-roboten ({model_id}) gav ett konstigt eller tomt svar: {svar_fran_roboten}")
+        raise HTTPException(status_code=503, detail="AI:n kunde inte generera trädgårdsråd just nu.")
+
+    with tracing.span("json_parse"):
+        variants, parse_error = llm_json.parse_design_variants(json_text_svar, expand)
+    if not variants:
+        logger.error(f"Kunde inte tolka varianter från text-roboten: {(parse_error or '')[:300]}. Svar var: {json_text_svar[:500]}")
+        raise HTTPException(status_code=500, detail=f"AI:n gav ett svar i ett format som inte kunde tolkas (JSON-fel): {json_text_svar[:200]}")
+    if len(variants) < expected:
+        logger.warning(f"Text-roboten ({model_id}) gav {len(variants)} av {expected} varianter: {(parse_error or '')[:300]}")
+    else:
+        logger.info(f"Text-roboten ({model_id}) gav {expected} varianter och de kunde förstås.")
+    return variants[:expected]
+
+
+async def stream_garden_advice_from_google_llm(
+    image_analysis_text: str,
+    user_location: str,
+    user_preferences: str
+) -> AsyncIterator[Tuple[str, Any]]:
+    """Strömmande variant av get_garden_advice_from_google_llm.
+
+    Ger ("text_delta", text) medan "text_advice" växer fram i JSON-svaret och till sist ("result", LLMDesignOutput).
+    """
+    logger.info(f"Text-roboten ({CHOSEN_GEMINI_MODEL if CHOSEN_GEMINI_MODEL else 'Odefinierad modell'}) ska designa en trädgård (strömmande). Info: Plats='{user_location}'")
+
+    if not CHOSEN_GEMINI_MODEL:
+        logger.error("stream_garden_advice_from_google_llm: Vertex AI är inte korrekt initierad (CHOSEN_GEMINI_MODEL är None).")
+        raise HTTPException(status_code=503, detail="Fel: AI-tjänsten för textgenerering är inte korrekt konfigurerad.")
+
+    await _prepare_design()
+    instruktion_till_roboten = prompts.build_design_prompt(image_analysis_text, user_location, user_preferences)
+    expand = _design_expander(user_location)
+    extractor = llm_json.TextAdviceStreamExtractor()
+    chunks = []
+    # En ström går inte att hedga när text redan skickats till klienten; nästa modellnivå
+    # används bara om anropet misslyckas innan första biten kommit.
+    tiers = model_tiers()
+    for tier_index, model_id in enumerate(tiers):
+        try:
+            model = _design_model(model_id)
+            # Platsen i gränsen hålls tills hela strömmen är läst.
+            async with llm_guard.design_guard.call(model_id):
+                # Spannet täcker hela strömmen, inklusive tiden som klienten tar på sig att läsa bitarna.
+                with tracing.span("design_call"):
+                    stream = await model.generate_content_async(instruktion_till_roboten, stream=True)
+                    last_chunk = None
+                    async for chunk in stream:
+                        last_chunk = chunk # Sista biten bär usage_metadata för hela svaret
+                        text = _response_text(chunk)
+                        if not text:
+                            continue
+                        chunks.append(text)
+                        delta = extractor.feed(text)
+                        if delta:
+                            yield "text_delta", delta
+            _log_design_usage(model_id, last_chunk, instruktion_till_roboten)
+            tracing.record_usage("design", model_id, last_chunk)
+            break
+        except Exception as e:
+            if not chunks and tier_index + 1 < len(tiers):
+                logger.warning(f"Strömmande anrop mot {model_id} misslyckades innan svar ({str(e)[:200]}), faller tillbaka på {tiers[tier_index + 1]}.")
+                continue
+            if isinstance(e, HTTPException):
+                raise
+            if isinstance(e, llm_guard.GuardRejectedError):
+                raise _overloaded_http_error(e)
+            raise _design_http_error(e)
+
+    json_text_svar = "".join(chunks)
+    tracing.record_bytes("design_call", len(json_text_svar))
+    with tracing.span("json_parse"):
+        llm_output, parse_error = llm_json.parse_design_output(json_text_svar, expand)
+    if llm_output is None:
+        # Samma väg som det vanliga anropet (med ny fråga) om det strömmade svaret inte gick att tolka.
+        logger.error(f"Kunde inte tolka strömmad JSON från text-roboten: {parse_error[:300]}. Försöker igen utan strömning.")
+        llm_output = await get_garden_advice_from_google_llm(image_analysis_text, user_location, user_preferences)
+    else:
+        logger.info("Text-roboten gav ett bra strömmat svar och det kunde förstås.")
+    yield "result", llm_output
@@ -1,13 +1,27 @@
-from fastapi import FastAPI, HTTPException, File, UploadFile, Form
+from fastapi import FastAPI, HTTPException, File, UploadFile, Form, Header, Query
 from fastapi.middleware.cors import CORSMiddleware
-import backend.llm_services as llm_services # Ändrat alias för tydlighet
+from fastapi.responses import JSONResponse, PlainTextResponse, Response, StreamingResponse
 import backend.supabase_services as supabase_services # Ändrat alias för tydlighet
-import backend.svg_generator as svg_generator # Ändrat alias för tydlighet
-from backend.models import UserInput, AdviceResponse, LLMDesignOutput
+import backend.advice_batch as advice_batch
+import backend.advice_pipeline as advice_pipeline
+import backend.db_writer as db_writer
+import backend.design_history as design_history
+import backend.jobs as jobs
+import backend.metrics as metrics
+import backend.startup as startup
+import backend.tracing as tracing
+import backend.image_processing as image_processing
+import backend.llm_clients as llm_clients
+import backend.llm_guard as llm_guard
+import backend.llm_hedge as llm_hedge
+from backend.models import AdviceResponse, BatchAdviceItem, BatchAdviceResponse, DesignDetail, DesignListResponse, JobStatusResponse, LLMDesignOutput
+import hmac
+import json
+from contextlib import asynccontextmanager
 import uuid
 import logging
-from typing import Optional # För UploadFile
-import base64 # Importerad för base64-kodning
+from typing import List, Optional # För UploadFile
+from pydantic import TypeAdapter, ValidationError
 
 # Konfigurera loggning
 logging.basicConfig(
@@ -17,7 +31,23 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
-app = FastAPI(title="Trädgårdsrådgivare AI API")
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    await db_writer.garden_designs_writer.start() # Spelar även upp journalen från förra körningen
+    await jobs.job_manager.start()
+    # Vertex-SDK, modellhandtag, Supabase-klient, uppvärmning och promptcache laddas i bakgrunden
+    # (se startup.py) så att appen svarar direkt; /health/ready säger när allt är klart.
+    startup.startup.start()
+    yield
+    # Nedstängning: stoppa jobbpoolen, töm skrivkön och släpp sedan trådpool och HTTP-anslutningar mot Supabase.
+    await startup.startup.stop()
+    await jobs.job_manager.stop()
+    await db_writer.garden_designs_writer.stop()
+    await llm_clients.registry.close()
+    image_processing.shutdown()
+    await supabase_services.shutdown()
+
+app = FastAPI(title="Trädgårdsrådgivare AI API", lifespan=lifespan)
 
 # CORS-inställningar
 allowed_origins = [
@@ -33,13 +63,43 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["POST", "GET", "OPTIONS"],
     allow_headers=["*"],
+    expose_headers=["Server-Timing"],
 )
+# Spans per steg och Server-Timing-header på svaren (se tracing.py).
+app.add_middleware(tracing.TracingMiddleware, timing_allow_origins=allowed_origins)
 
 @app.get("/")
 async def root():
     logger.info("Root endpoint anropad (health check).")
     return {"message": "Trädgårdsrådgivare AI API är igång!"}
 
+@app.get("/health/live")
+async def liveness():
+    # Processen lever och event-loopen svarar; säger inget om beroendena.
+    return {"status": "ok"}
+
+@app.get("/health/ready")
+async def readiness():
+    # 503 tills Vertex AI, Supabase-klienten och förladdade moduler är klara (se startup.py).
+    status = startup.startup.status()
+    return JSONResponse(status_code=200 if status["ready"] else 503, content=status)
+
+@app.get("/metrics")
+async def metrics_endpoint(format: Optional[str] = None, accept: Optional[str] = Header(None)):
+    # Prometheus textformat som standard; ?format=json (eller Accept: application/json) ger den gamla JSON-vyn.
+    if format == "json" or (format is None and accept and "application/json" in accept):
+        return metrics.snapshot()
+    return PlainTextResponse(metrics.render_prometheus(), media_type="text/plain; version=0.0.4; charset=utf-8")
+
+@app.get("/metrics/llm")
+async def llm_metrics_endpoint():
+    # Samtidighetsgränser och breakerlägen (llm_guard.py) samt latens och vinstandel per modell (llm_hedge.py).
+    return {**llm_guard.status(), "models": llm_hedge.status()}
+
+def _sse_event(event: str, data: dict) -> str:
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+
 @app.post("/get_advice", response_model=AdviceResponse)
 async def get_garden_advice_endpoint(
     location: str = Form(...),
@@ -49,90 +109,18 @@ async def get_garden_advice_endpoint(
     request_id = str(uuid.uuid4())
     logger.info(f"Request [{request_id}]: Startar. Plats='{location}', Bild: {'Ja' if imageFile and imageFile.filename else 'Nej'}")
 
-    image_supabase_url: Optional[str] = None
-    image_analysis_result: str = "Ingen bildanalys utförd (ingen bild skickad)."
-    # Ny variabel för att hålla den faktiska MIME-typen från den uppladdade filen
-    actual_image_mime_type: Optional[str] = None
-
+    run = advice_pipeline.AdviceRun(request_id, location, preferences)
     try:
-        if imageFile and imageFile.filename: # Kontrollera också att filename inte är tomt
-            if imageFile.size == 0:
-                logger.info(f"Request [{request_id}]: Mottagen bildfil har storlek 0, ingen bild behandlas.")
-                image_analysis_result = "Bildanalys kunde inte utföras (tom fil)."
-            else:
-                logger.info(f"Request [{request_id}]: Bearbetar uppladdad bild: {imageFile.filename}, Storlek: {imageFile.size}, Typ: {imageFile.content_type}")
-                
-                # Spara den faktiska MIME-typen från UploadFile-objektet
-                actual_image_mime_type = imageFile.content_type
-
-                unique_filename_stem = f"garden_image_{request_id}"
-                contents = await imageFile.read()
-
-                if not contents:
-                    logger.warning(f"Request [{request_id}]: Innehållet i den uppladdade filen är tomt efter läsning.")
-                    image_analysis_result = "Bildanalys kunde inte utföras (tomt filinnehåll)."
-                elif not actual_image_mime_type:
-                    logger.warning(f"Request [{request_id}]: MIME-typ saknas för uppladdad fil, kan inte skapa data_url eller analysera.")
-                    image_analysis_result = "Bildanalys kunde inte utföras (MIME-typ saknas)."
-                else:
-                    encoded_string = base64.b64encode(contents).decode('utf-8')
-                    data_url = f"data:{actual_image_mime_type};base64,{encoded_string}"
-                    
-                    # Antag att upload_image_from_data_url i supabase_services.py
-                    # har uppdaterats för att returnera (url, mime_type_from_data_url)
-                    # eller så använder vi actual_image_mime_type direkt.
-                    # För enkelhetens skull, om upload_image_from_data_url bara returnerar URL:
-                    temp_url, mime_type_from_upload = await supabase_services.upload_image_from_data_url(data_url, unique_filename_stem)
-                    image_supabase_url = temp_url
-                    # Vi litar på MIME-typen från den ursprungliga UploadFile om möjligt,
-                    # men mime_type_from_upload kan användas som fallback eller för verifiering.
-                    # För nu använder vi den direkt från UploadFile.
-
-                    logger.info(f"Request [{request_id}]: Bild uppladdad till: {image_supabase_url}")
-
-                    # ---- VIKTIG ÄNDRING HÄR ----
-                    # Anropa analyze_image_with_google_llm med den faktiska MIME-typen
-                    image_analysis_result = await llm_services.analyze_image_with_google_llm(
-                        image_url=image_supabase_url,
-                        actual_mime_type=actual_image_mime_type # Skicka med den korrekta MIME-typen
-                    )
-                    logger.info(f"Request [{request_id}]: Bildanalys klar: {image_analysis_result[:100]}...") # Logga början av resultatet
-        else:
-            logger.info(f"Request [{request_id}]: Ingen bildfil skickades med eller filnamn saknas.")
-
-
-        user_data = UserInput(location=location, preferences=preferences, image_supabase_url=image_supabase_url)
-        
-        logger.info(f"Request [{request_id}]: Hämtar trädgårdsråd från LLM.")
-        llm_output: LLMDesignOutput = await llm_services.get_garden_advice_from_google_llm(
-            image_analysis_text=image_analysis_result, # Använd resultatet från bildanalysen
-            user_location=user_data.location,
-            user_preferences=user_data.preferences
-        )
-        logger.info(f"Request [{request_id}]: LLM-råd mottaget.")
-        
-        logger.info(f"Request [{request_id}]: Genererar SVG-plan.")
-        svg_plan_str = svg_generator.create_2d_garden_svg(llm_output.garden_plan_data)
-        logger.info(f"Request [{request_id}]: SVG-plan genererad.")
+        contents, mime_type, run.image_analysis_result = await advice_pipeline.read_image_file(request_id, imageFile)
+        if contents is not None:
+            await run.start_image(contents, mime_type)
 
-        try:
-            await supabase_services.save_garden_advice_to_db(
-                user_input=user_data.dict(), # Skicka som dict
-                image_analysis=image_analysis_result,
-                text_advice=llm_output.text_advice,
-                svg_plan_str=svg_plan_str,
-                image_supabase_url=image_supabase_url
-            )
-            logger.info(f"Request [{request_id}]: Resultat sparat till DB.")
-        except Exception as db_e:
-            logger.error(f"Request [{request_id}]: Fel vid sparande till DB (icke-kritiskt): {db_e}", exc_info=True)
+        await run.image_analysis()
+        llm_output = await run.design()
+        response = await run.finish(llm_output)
 
         logger.info(f"Request [{request_id}]: Skickar framgångsrikt svar.")
-        return AdviceResponse(
-            text_advice=llm_output.text_advice,
-            svg_plan=svg_plan_str,
-            image_analysis_text=image_analysis_result
-        )
+        return response
 
     except HTTPException as http_exc:
         logger.warning(f"Request [{request_id}]: Hanterat fel (HTTPException): {http_exc.status_code} - {http_exc.detail}")
@@ -140,4 +128,179 @@ async def get_garden_advice_endpoint(
     except Exception as e:
         logger.error(f"Request [{request_id}]: Oväntat serverfel: {e}", exc_info=True)
         raise HTTPException(status_code=500, detail=f"Ett oväntat internt fel uppstod (ID: {request_id}). Kontakta support om problemet kvarstår.")
+    finally:
+        run.cancel_pending()
 
+
+@app.post("/get_advice/stream")
+async def get_garden_advice_stream_endpoint(
+    location: str = Form(...),
+    preferences: str = Form(...),
+    imageFile: Optional[UploadFile] = File(None)
+):
+    # Samma formulär som /get_advice, men svaret skickas som Server-Sent Events allteftersom stegen blir klara:
+    # started -> image_analysis -> text_advice (delar) -> garden_plan -> done (eller error).
+    request_id = str(uuid.uuid4())
+    logger.info(f"Request [{request_id}]: Startar (stream). Plats='{location}', Bild: {'Ja' if imageFile and imageFile.filename else 'Nej'}")
+
+    # Filen läses innan svaret börjar strömmas, eftersom UploadFile stängs när endpointen returnerat.
+    contents, mime_type, initial_analysis = await advice_pipeline.read_image_file(request_id, imageFile)
+
+    async def events():
+        run = advice_pipeline.AdviceRun(request_id, location, preferences)
+        run.image_analysis_result = initial_analysis
+        try:
+            yield _sse_event("started", {"request_id": request_id})
+            if contents is not None:
+                await run.start_image(contents, mime_type)
+            image_analysis_text = await run.image_analysis()
+            yield _sse_event("image_analysis", {"image_analysis_text": image_analysis_text})
+
+            llm_output: Optional[LLMDesignOutput] = None
+            async for kind, payload in run.design_stream():
+                if kind == "text_delta":
+                    yield _sse_event("text_advice", {"delta": payload})
+                else:
+                    llm_output = payload
+
+            response = await run.finish(llm_output)
+            yield _sse_event("garden_plan", {
+                "text_advice": response.text_advice,
+                "garden_plan_data": llm_output.garden_plan_data.model_dump(),
+                "svg_plan": response.svg_plan,
+                "layout": response.layout.model_dump() if response.layout else None
+            })
+            yield _sse_event("done", {})
+            logger.info(f"Request [{request_id}]: Ström avslutad framgångsrikt.")
+        except HTTPException as http_exc:
+            logger.warning(f"Request [{request_id}]: Hanterat fel (HTTPException): {http_exc.status_code} - {http_exc.detail}")
+            yield _sse_event("error", {"status": http_exc.status_code, "detail": http_exc.detail})
+        except Exception as e:
+            logger.error(f"Request [{request_id}]: Oväntat serverfel: {e}", exc_info=True)
+            yield _sse_event("error", {"status": 500, "detail": f"Ett oväntat internt fel uppstod (ID: {request_id}). Kontakta support om problemet kvarstår."})
+        finally:
+            run.cancel_pending()
+
+    return StreamingResponse(
+        events(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+
+_batch_items_adapter = TypeAdapter(List[BatchAdviceItem])
+
+
+@app.post("/get_advice/batch", response_model=BatchAdviceResponse)
+async def get_garden_advice_batch_endpoint(
+    items: str = Form(...),
+    imageFiles: Optional[List[UploadFile]] = File(None)
+):
+    # items är en JSON-lista med {location, preferences, image_index, variants}; image_index pekar in i imageFiles.
+    # Svaret innehåller ett resultat eller fel per post och variant (delvis lyckade batchar ger ändå 200).
+    request_id = str(uuid.uuid4())
+    try:
+        batch_items = _batch_items_adapter.validate_json(items)
+    except ValidationError as e:
+        raise HTTPException(status_code=400, detail=f"Ogiltig items-lista: {str(e)[:300]}")
+    image_files = imageFiles or []
+    advice_batch.validate_items(batch_items, len(image_files))
+    logger.info(f"Request [{request_id}]: Startar batch med {len(batch_items)} poster och {len(image_files)} bilder.")
+
+    # Bara bilder som någon post pekar på läses in.
+    images = {
+        image_index: await advice_pipeline.read_image_file(request_id, image_files[image_index])
+        for image_index in advice_batch.referenced_images(batch_items)
+    }
+    try:
+        return await advice_batch.run_batch(request_id, batch_items, images)
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"Request [{request_id}]: Oväntat serverfel: {e}", exc_info=True)
+        raise HTTPException(status_code=500, detail=f"Ett oväntat internt fel uppstod (ID: {request_id}). Kontakta support om problemet kvarstår.")
+
+
+@app.post("/jobs", response_model=JobStatusResponse, status_code=202)
+async def create_advice_job(
+    location: str = Form(...),
+    preferences: str = Form(...),
+    imageFile: Optional[UploadFile] = File(None),
+    priority: int = Form(jobs.JOB_MIN_PRIORITY, ge=jobs.JOB_MIN_PRIORITY, le=jobs.JOB_MAX_PRIORITY)
+):
+    # Samma formulär som /get_advice; svarar direkt med ett jobb-id som kan följas via GET /jobs/{id}.
+    # priority är 0–9 (högre körs först); värden utanför ger 422.
+    request_id = str(uuid.uuid4())
+    contents, mime_type, image_analysis_result = await advice_pipeline.read_image_file(request_id, imageFile)
+    try:
+        job = jobs.job_manager.submit(location, preferences, contents, mime_type, image_analysis_result, priority=priority)
+    except jobs.QueueFullError as e:
+        logger.warning(f"Request [{request_id}]: Jobbkön är full, svarar 429 (Retry-After {e.retry_after_s}s).")
+        return JSONResponse(
+            status_code=429,
+            content={"detail": "Tjänsten är hårt belastad just nu. Försök igen om en stund."},
+            headers={"Retry-After": str(e.retry_after_s)}
+        )
+    return job.to_dict()
+
+
+@app.get("/jobs/{job_id}", response_model=JobStatusResponse)
+async def get_advice_job(job_id: str):
+    job = jobs.job_manager.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Jobbet finns inte eller har gått ut.")
+    return job.to_dict()
+
+
+def _check_designs_token(authorization: Optional[str]):
+    # Stängt som standard: utan konfigurerad token svarar historiken 404, om inte DESIGNS_PUBLIC=true.
+    token = design_history.DESIGNS_API_TOKEN
+    if token:
+        if not hmac.compare_digest((authorization or "").encode("utf-8"), f"Bearer {token}".encode("utf-8")):
+            raise HTTPException(status_code=401, detail="Saknar eller har fel behörighet för designhistoriken.")
+    elif not design_history.DESIGNS_PUBLIC:
+        raise HTTPException(status_code=404, detail="Designhistoriken är inte aktiverad.")
+
+
+def _etag_response(cached: dict, if_none_match: Optional[str]) -> Response:
+    # Färdigserialiserad JSON från design_history; 304 utan kropp när klienten redan har samma version.
+    headers = {"ETag": cached["etag"], "Cache-Control": "private, no-cache"}
+    if design_history.etag_matches(if_none_match, cached["etag"]):
+        return Response(status_code=304, headers=headers)
+    return Response(content=cached["body"], media_type="application/json", headers=headers)
+
+
+async def _read_designs(read):
+    try:
+        return await read()
+    except design_history.InvalidCursorError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except Exception as e:
+        logger.error(f"Kunde inte läsa designhistoriken: {e}", exc_info=True)
+        raise HTTPException(status_code=503, detail="Designhistoriken är inte tillgänglig just nu.")
+
+
+@app.get("/designs", response_model=DesignListResponse)
+async def list_designs(
+    limit: Optional[int] = Query(None, ge=1),
+    cursor: Optional[str] = None,
+    if_none_match: Optional[str] = Header(None),
+    authorization: Optional[str] = Header(None)
+):
+    # Nyast först. next_cursor i svaret ger nästa (äldre) sida; listan innehåller ingen plan eller SVG.
+    _check_designs_token(authorization)
+    cached = await _read_designs(lambda: design_history.list_designs(limit, cursor))
+    return _etag_response(cached, if_none_match)
+
+
+@app.get("/designs/{design_id}", response_model=DesignDetail)
+async def get_design(
+    design_id: int,
+    if_none_match: Optional[str] = Header(None),
+    authorization: Optional[str] = Header(None)
+):
+    _check_designs_token(authorization)
+    cached = await _read_designs(lambda: design_history.get_design(design_id))
+    if cached is None:
+        raise HTTPException(status_code=404, detail="Designen finns inte.")
+    return _etag_response(cached, if_none_match)
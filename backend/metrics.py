@@ -0,0 +1,197 @@
+import threading
+from collections import deque
+from typing import Dict, List, Tuple
+
+# Enkel metrikregistrering i processen. Mätvärden skapas med counter()/gauge()/histogram()
+# och visas av /metrics i main.py, som Prometheus-text (render_prometheus) eller JSON (snapshot).
+
+HISTOGRAM_RESERVOIR_SIZE = 1024 # Antal senaste observationer som percentiler räknas på
+QUANTILES = (0.5, 0.95, 0.99)
+
+LabelKey = Tuple[Tuple[str, str], ...]
+
+
+def _label_key(labels: Dict[str, object]) -> LabelKey:
+    return tuple(sorted((k, str(v)) for k, v in labels.items()))
+
+
+class _Metric:
+    kind = "untyped"
+
+    def __init__(self, name: str, description: str):
+        self.name = name
+        self.description = description
+        self._lock = threading.Lock()
+        self._values: Dict[LabelKey, object] = {}
+
+    def _series(self) -> List[Tuple[Dict[str, str], object]]:
+        with self._lock:
+            return [(dict(key), value) for key, value in self._values.items()]
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def inc(self, amount: float = 1.0, **labels):
+        key = _label_key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+    def value(self, **labels) -> float:
+        return self._values.get(_label_key(labels), 0.0)
+
+    def snapshot(self) -> List[dict]:
+        return [{"labels": labels, "value": value} for labels, value in self._series()]
+
+
+class Gauge(_Metric):
+    kind = "gauge"
+
+    def set(self, value: float, **labels):
+        with self._lock:
+            self._values[_label_key(labels)] = float(value)
+
+    def inc(self, amount: float = 1.0, **labels):
+        key = _label_key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+    def dec(self, amount: float = 1.0, **labels):
+        self.inc(-amount, **labels)
+
+    def value(self, **labels) -> float:
+        return self._values.get(_label_key(labels), 0.0)
+
+    def snapshot(self) -> List[dict]:
+        return [{"labels": labels, "value": value} for labels, value in self._series()]
+
+
+class _HistogramSeries:
+    __slots__ = ("count", "total", "reservoir")
+
+    def __init__(self):
+        self.count = 0
+        self.total = 0.0
+        self.reservoir = deque(maxlen=HISTOGRAM_RESERVOIR_SIZE)
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def observe(self, value: float, **labels):
+        key = _label_key(labels)
+        with self._lock:
+            series = self._values.get(key)
+            if series is None:
+                series = self._values[key] = _HistogramSeries()
+            series.count += 1
+            series.total += value
+            series.reservoir.append(value)
+
+    def count(self, **labels) -> int:
+        series = self._values.get(_label_key(labels))
+        return series.count if series is not None else 0
+
+    def quantile(self, q: float, **labels) -> float:
+        with self._lock:
+            series = self._values.get(_label_key(labels))
+            values = list(series.reservoir) if series is not None else []
+        return _quantile(sorted(values), q)
+
+    def _copies(self) -> List[Tuple[Dict[str, str], int, float, List[float]]]:
+        # (labels, count, sum, reservoarens värden) kopierade under låset; observe() kan lägga till
+        # i dequen medan den sorteras annars.
+        with self._lock:
+            return [(dict(key), s.count, s.total, list(s.reservoir)) for key, s in self._values.items()]
+
+    def snapshot(self) -> List[dict]:
+        result = []
+        for labels, count, total, values in self._copies():
+            ordered = sorted(values)
+            result.append({
+                "labels": labels,
+                "count": count,
+                "sum": total,
+                "quantiles": {str(q): _quantile(ordered, q) for q in QUANTILES},
+            })
+        return result
+
+
+def _quantile(ordered: List[float], q: float) -> float:
+    if not ordered:
+        return 0.0
+    index = min(len(ordered) - 1, int(round(q * (len(ordered) - 1))))
+    return ordered[index]
+
+
+_registry: Dict[str, _Metric] = {}
+_registry_lock = threading.Lock()
+
+
+def _get_or_create(cls, name: str, description: str):
+    with _registry_lock:
+        metric = _registry.get(name)
+        if metric is None:
+            metric = _registry[name] = cls(name, description)
+        elif not isinstance(metric, cls):
+            raise ValueError(f"Mätvärdet '{name}' finns redan med typen {metric.kind}.")
+        return metric
+
+
+def counter(name: str, description: str = "") -> Counter:
+    return _get_or_create(Counter, name, description)
+
+
+def gauge(name: str, description: str = "") -> Gauge:
+    return _get_or_create(Gauge, name, description)
+
+
+def histogram(name: str, description: str = "") -> Histogram:
+    return _get_or_create(Histogram, name, description)
+
+
+def snapshot() -> Dict[str, dict]:
+    with _registry_lock:
+        metrics = list(_registry.values())
+    return {
+        metric.name: {"type": metric.kind, "description": metric.description, "values": metric.snapshot()}
+        for metric in metrics
+    }
+
+
+def _escape_label(value: str) -> str:
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _labels_text(labels: Dict[str, str], **extra: str) -> str:
+    items = list(labels.items()) + list(extra.items())
+    if not items:
+        return ""
+    return "{" + ",".join(f'{k}="{_escape_label(str(v))}"' for k, v in items) + "}"
+
+
+def render_prometheus() -> str:
+    """Alla mätvärden i Prometheus textformat (0.0.4).
+
+    Histogrammen har bara en reservoar av senaste värden, så de exponeras som summary med
+    kvantilerna i QUANTILES plus _sum och _count.
+    """
+    with _registry_lock:
+        registered = sorted(_registry.values(), key=lambda m: m.name)
+    lines = []
+    for metric in registered:
+        description = metric.description.replace("\\", "\\\\").replace("\n", "\\n")
+        lines.append(f"# HELP {metric.name} {description}")
+        if isinstance(metric, Histogram):
+            lines.append(f"# TYPE {metric.name} summary")
+            for labels, count, total, values in metric._copies():
+                ordered = sorted(values)
+                for q in QUANTILES:
+                    lines.append(f"{metric.name}{_labels_text(labels, quantile=str(q))} {_quantile(ordered, q)}")
+                lines.append(f"{metric.name}_sum{_labels_text(labels)} {total}")
+                lines.append(f"{metric.name}_count{_labels_text(labels)} {count}")
+        else:
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            for labels, value in metric._series():
+                lines.append(f"{metric.name}{_labels_text(labels)} {value}")
+    return "\n".join(lines) + "\n"
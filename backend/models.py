@@ -29,7 +29,89 @@ class LLMDesignOutput(BaseModel):
     text_advice: str
     garden_plan_data: GardenPlanData
 
+class LLMDesignVariantsOutput(BaseModel):
+    variants: List[LLMDesignOutput] # En design per begärd stil, i samma ordning
+
+# Kompakt designsvar när frågan bär växtkatalogens id:n (promptversion v3). Namn, mått, färg och
+# höjd fylls i från plant_catalog.py efteråt, så modellen skriver bara id och position.
+class CatalogPlantRef(BaseModel):
+    id: str = Field(description="Växtens id i växtlistan")
+    x: int = Field(description="X-koordinat på 2D-planen i cm")
+    y: int = Field(description="Y-koordinat på 2D-planen i cm")
+
+class CatalogGardenPlanData(BaseModel):
+    area_width_cm: int = Field(description="Trädgårdsytans bredd i cm")
+    area_height_cm: int = Field(description="Trädgårdsytans höjd i cm")
+    plants: List[CatalogPlantRef]
+    paths: Optional[List[PathData]] = None
+
+class LLMCatalogDesignOutput(BaseModel):
+    text_advice: str
+    garden_plan_data: CatalogGardenPlanData
+
+class LLMCatalogDesignVariantsOutput(BaseModel):
+    variants: List[LLMCatalogDesignOutput]
+
+class LayoutReport(BaseModel):
+    conflicts_found: int = 0 # Överlapp, växter på gångar och utanför ytan före lagning
+    conflicts_fixed: int = 0
+    conflicts_remaining: int = 0
+    plants_moved: int = 0
+    iterations: int = 0
+    elapsed_ms: float = 0.0
+
 class AdviceResponse(BaseModel):
     text_advice: str
     svg_plan: str
     image_analysis_text: Optional[str] = None
+    layout: Optional[LayoutReport] = None
+
+class BatchAdviceItem(BaseModel):
+    location: str
+    preferences: str
+    image_index: Optional[int] = None # Index i batchens imageFiles; samma bild kan användas av flera poster
+    variants: Optional[List[str]] = None # Stilar, t.ex. ["modern", "stugträdgård"]; en design per stil
+
+class BatchAdviceResult(BaseModel):
+    index: int # Postens plats i items
+    variant: Optional[str] = None
+    status: str # succeeded eller failed
+    result: Optional[AdviceResponse] = None
+    error: Optional[Dict[str, Any]] = None
+    latency_ms: float # Från batchens start tills posten var klar
+    stage_timings_ms: Dict[str, float] = {}
+
+class BatchAdviceResponse(BaseModel):
+    results: List[BatchAdviceResult]
+    succeeded: int
+    failed: int
+    unique_images: int
+    total_latency_ms: float
+
+class DesignSummary(BaseModel):
+    id: int
+    created_at: str
+    location: Optional[str] = None
+    preferences: Optional[str] = None
+    image_url: Optional[str] = None
+
+class DesignListResponse(BaseModel):
+    designs: List[DesignSummary]
+    next_cursor: Optional[str] = None # Skickas som ?cursor= för nästa sida; None på sista sidan
+
+class DesignDetail(DesignSummary):
+    image_analysis_text: Optional[str] = None
+    text_advice: Optional[str] = None
+    garden_plan_data: Optional[GardenPlanData] = None
+    svg_plan: Optional[str] = None
+
+class JobStatusResponse(BaseModel):
+    job_id: str
+    status: str # queued, running, succeeded eller failed
+    priority: int = 0
+    created_at: float
+    started_at: Optional[float] = None
+    finished_at: Optional[float] = None
+    stage_timings_ms: Dict[str, float] = {}
+    result: Optional[AdviceResponse] = None
+    error: Optional[Dict[str, Any]] = None
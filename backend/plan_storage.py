@@ -0,0 +1,216 @@
+import base64
+import hashlib
+import json
+import logging
+import os
+import threading
+import xml.etree.ElementTree as ET
+import zlib
+from collections import OrderedDict
+from typing import Optional
+
+from . import metrics
+from . import svg_generator
+from .models import GardenPlanData
+
+logger = logging.getLogger(__name__)
+
+# Lagring av planen i garden_designs: istället för hela SVG-texten sparas GardenPlanData i en kompakt
+# JSON-form (kolumnen plan_data) med schemaversion, kodning och en hash av planen. SVG:n är härledd
+# och ritas vid behov från planen, med en LRU i processen nyckad på planens hash.
+#
+# Kompakt form, schemaversion 1:
+#   {"w": bredd, "h": höjd,
+#    "p": [[namn, latinskt namn, x, y, diameter, färg, höjd], ...],
+#    "g": [[[[x, y], ...], färg], ...]}
+PLAN_SCHEMA_VERSION = 1
+
+# "json" sparar den kompakta formen som text, "zlib" komprimerar den och base64-kodar resultatet.
+PLAN_STORAGE_ENCODING = os.getenv("PLAN_STORAGE_ENCODING", "zlib").lower()
+# Skriv även svg_plan-kolumnen, t.ex. medan äldre läsare fortfarande behöver den.
+PLAN_STORE_SVG = os.getenv("PLAN_STORE_SVG", "false").lower() == "true"
+SVG_CACHE_MAX_ENTRIES = int(os.getenv("SVG_CACHE_MAX_ENTRIES", "256"))
+
+ENCODING_JSON = "json"
+ENCODING_ZLIB = "zlib"
+
+_SVG_NS = "{http://www.w3.org/2000/svg}"
+_XLINK_HREF = "{http://www.w3.org/1999/xlink}href"
+
+_svg_cache_total = metrics.counter("plan_svg_cache_total", "SVG-uppslag i planens LRU per utfall (hit/miss)")
+
+
+class PlanDecodeError(ValueError):
+    pass
+
+
+def _compact(plan: GardenPlanData) -> dict:
+    return {
+        "w": plan.area_width_cm,
+        "h": plan.area_height_cm,
+        "p": [
+            [p.name, p.latin_name, p.x, p.y, p.diameter, p.color_2d, p.height_3d]
+            for p in plan.plants or []
+        ],
+        "g": [[[list(point) for point in path.points], path.color] for path in plan.paths or []],
+    }
+
+
+def _expand(data: dict) -> GardenPlanData:
+    plants = [
+        {
+            "name": name, "latin_name": latin_name, "x": x, "y": y,
+            "diameter": diameter, "color_2d": color_2d, "height_3d": height_3d
+        }
+        for name, latin_name, x, y, diameter, color_2d, height_3d in data.get("p") or []
+    ]
+    paths = [{"points": points, "color": color} for points, color in data.get("g") or []]
+    return GardenPlanData(
+        area_width_cm=data["w"],
+        area_height_cm=data["h"],
+        plants=plants,
+        paths=paths or None
+    )
+
+
+def _compact_json(plan: GardenPlanData) -> str:
+    return json.dumps(_compact(plan), ensure_ascii=False, separators=(",", ":"))
+
+
+def plan_hash(plan: GardenPlanData) -> str:
+    """SHA-256 av planens kompakta form; samma plan ger samma hash oavsett kodning."""
+    return hashlib.sha256(_compact_json(plan).encode("utf-8")).hexdigest()
+
+
+def encode_plan(plan: GardenPlanData, encoding: Optional[str] = None) -> dict:
+    """Kolumnerna för planen i en garden_designs-rad."""
+    encoding = encoding or PLAN_STORAGE_ENCODING
+    text = _compact_json(plan)
+    if encoding == ENCODING_ZLIB:
+        data = base64.b64encode(zlib.compress(text.encode("utf-8"), 9)).decode("ascii")
+    else:
+        encoding = ENCODING_JSON
+        data = text
+    return {
+        "plan_data": data,
+        "plan_encoding": encoding,
+        "plan_schema_version": PLAN_SCHEMA_VERSION,
+        "plan_hash": hashlib.sha256(text.encode("utf-8")).hexdigest(),
+    }
+
+
+def decode_plan(row: dict) -> GardenPlanData:
+    """Läser tillbaka planen ur en rad med kolumnerna från encode_plan."""
+    data = row.get("plan_data")
+    if not data:
+        raise PlanDecodeError("Raden saknar plan_data.")
+    version = row.get("plan_schema_version") or PLAN_SCHEMA_VERSION
+    if version != PLAN_SCHEMA_VERSION:
+        raise PlanDecodeError(f"Okänd schemaversion för plan_data: {version}")
+    try:
+        if row.get("plan_encoding") == ENCODING_ZLIB:
+            data = zlib.decompress(base64.b64decode(data)).decode("utf-8")
+        return _expand(json.loads(data))
+    except Exception as e:
+        raise PlanDecodeError(f"Kunde inte läsa plan_data: {e}") from e
+
+
+class _SvgCache:
+    # Ritas i trådar (se advice_pipeline), därav låset.
+
+    def __init__(self, max_entries: int):
+        self.max_entries = max_entries
+        self._entries: "OrderedDict[str, str]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: str) -> Optional[str]:
+        with self._lock:
+            svg = self._entries.get(key)
+            if svg is not None:
+                self._entries.move_to_end(key)
+            return svg
+
+    def set(self, key: str, svg: str):
+        with self._lock:
+            self._entries[key] = svg
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+svg_cache = _SvgCache(SVG_CACHE_MAX_ENTRIES)
+
+
+def render_svg(plan: GardenPlanData, known_hash: Optional[str] = None) -> str:
+    """SVG för planen, ritad en gång per plan-hash och renderare."""
+    key = f"{svg_generator.SVG_RENDERER}:{known_hash or plan_hash(plan)}"
+    svg = svg_cache.get(key)
+    if svg is not None:
+        _svg_cache_total.inc(result="hit")
+        return svg
+    _svg_cache_total.inc(result="miss")
+    svg = svg_generator.create_2d_garden_svg(plan)
+    svg_cache.set(key, svg)
+    return svg
+
+
+def _svg_number(value) -> int:
+    return int(round(float(str(value).replace("px", ""))))
+
+
+def parse_svg_plan(svg: str) -> Optional[GardenPlanData]:
+    """Tolkar en sparad SVG-plan (från någon av renderarna i svg_generator) tillbaka till planen.
+
+    Latinskt namn och höjd finns inte i SVG:n och blir None. Fel-SVG:er och annat som inte
+    ser ut som en plan ger None.
+    """
+    try:
+        root = ET.fromstring(svg)
+    except ET.ParseError:
+        return None
+    defs = {el.get("id"): el for el in root.iter() if el.get("id")}
+    width = height = None
+    plants, paths = [], []
+    pending = None # Cirkeln vars etikett inte lästs än
+
+    def walk(element):
+        nonlocal width, height, pending
+        for child in element:
+            tag = child.tag.replace(_SVG_NS, "")
+            if tag == "defs":
+                continue
+            if tag == "g":
+                walk(child)
+            elif tag == "rect" and width is None:
+                width, height = _svg_number(child.get("width")), _svg_number(child.get("height"))
+            elif tag == "polygon":
+                points = [
+                    [_svg_number(v) for v in pair.split(",")]
+                    for pair in (child.get("points") or "").replace(", ", ",").split()
+                ]
+                paths.append({"points": points, "color": child.get("fill")})
+            elif tag in ("circle", "use"):
+                if tag == "use":
+                    ref = defs.get((child.get(_XLINK_HREF) or child.get("href") or "").lstrip("#"))
+                    if ref is None:
+                        continue
+                    cx, cy, r, fill = child.get("x", 0), child.get("y", 0), ref.get("r"), ref.get("fill")
+                else:
+                    cx, cy, r, fill = child.get("cx"), child.get("cy"), child.get("r"), child.get("fill")
+                pending = {
+                    "name": "", "x": _svg_number(cx), "y": _svg_number(cy),
+                    "diameter": int(round(float(r) * 2)), "color_2d": fill
+                }
+                plants.append(pending)
+            elif tag == "text" and pending is not None:
+                pending["name"] = child.text or ""
+                pending = None
+
+    walk(root)
+    if width is None or height is None:
+        return None
+    return GardenPlanData(area_width_cm=width, area_height_cm=height, plants=plants, paths=paths or None)
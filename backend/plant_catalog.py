@@ -0,0 +1,416 @@
+import csv
+import functools
+import itertools
+import logging
+import os
+import re
+import sqlite3
+import threading
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Dict, List, Optional, Sequence, Tuple
+
+from . import metrics
+from .models import GardenPlanData, LLMCatalogDesignOutput, LLMDesignOutput, PlantData
+
+logger = logging.getLogger(__name__)
+
+# Lokal växtkatalog för designanropet (promptversion v3). Innan frågan byggs tolkas växtzonen ur
+# platsen och ljuset ur bildanalysen, och en kort lista med kandidater hämtas ur katalogen. Modellen
+# svarar med katalogens id:n och positioner; namn, latinskt namn, diameter, färg och höjd fylls i
+# härifrån efteråt, och okända id:n eller växter som inte klarar zonen tas bort utan nytt modellanrop.
+#
+# Katalogen är en CSV-fil som läses in i en SQLite-databas i minnet vid första användningen (eller
+# vid start, se startup.py). PLANT_CATALOG_PATH kan också peka på en färdigbyggd .sqlite-fil (se
+# tools/build_plant_catalog.py); den öppnas skrivskyddad och minnesmappad.
+PLANT_CATALOG_PATH = os.getenv("PLANT_CATALOG_PATH", os.path.join(os.path.dirname(__file__), "data", "plant_catalog.csv"))
+PLANT_CATALOG_SHORTLIST_SIZE = int(os.getenv("PLANT_CATALOG_SHORTLIST_SIZE", "20"))
+PLANT_CATALOG_MMAP_BYTES = int(os.getenv("PLANT_CATALOG_MMAP_BYTES", str(16 * 1024 * 1024)))
+
+LIGHTS = ("sol", "halvskugga", "skugga")
+# Ordningen kategorierna visas i växtlistan i frågan
+CATEGORY_ORDER = ("perenn", "buske", "träd", "gräs", "ört", "lök", "klätterväxt", "marktäckare")
+
+_plants_total = metrics.counter("plant_catalog_plants_total", "Växter i designsvar per utfall (ok/unknown/not_hardy)")
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS plants (
+    id TEXT PRIMARY KEY,
+    name TEXT NOT NULL,
+    latin_name TEXT,
+    category TEXT NOT NULL,
+    zone_max INTEGER NOT NULL,
+    sol INTEGER NOT NULL,
+    halvskugga INTEGER NOT NULL,
+    skugga INTEGER NOT NULL,
+    height_m REAL,
+    diameter_cm INTEGER NOT NULL,
+    bloom_color TEXT,
+    color_2d TEXT NOT NULL,
+    tags TEXT NOT NULL,
+    rank INTEGER NOT NULL
+);
+CREATE INDEX IF NOT EXISTS plants_zone ON plants (zone_max, rank);
+CREATE INDEX IF NOT EXISTS plants_sol ON plants (sol, zone_max);
+CREATE INDEX IF NOT EXISTS plants_halvskugga ON plants (halvskugga, zone_max);
+CREATE INDEX IF NOT EXISTS plants_skugga ON plants (skugga, zone_max);
+CREATE INDEX IF NOT EXISTS plants_height ON plants (height_m);
+CREATE INDEX IF NOT EXISTS plants_bloom_color ON plants (bloom_color, zone_max);
+"""
+
+_COLUMNS = (
+    "id", "name", "latin_name", "category", "zone_max", "sol", "halvskugga", "skugga",
+    "height_m", "diameter_cm", "bloom_color", "color_2d", "tags", "rank",
+)
+
+
+@dataclass(frozen=True)
+class CatalogPlant:
+    id: str
+    name: str
+    latin_name: Optional[str]
+    category: str
+    zone_max: int # Kallaste odlingszon (1-8) där växten klarar sig
+    light: Tuple[str, ...] # Delmängd av LIGHTS
+    height_m: Optional[float]
+    diameter_cm: int
+    bloom_color: Optional[str]
+    color_2d: str # SVG-färg på 2D-planen
+    tags: Tuple[str, ...]
+    rank: int # Lägre först inom kategorin
+
+    def prompt_entry(self) -> str:
+        """Växten i växtlistan i frågan, t.ex. "ast Stjärnflocka 0.6 m Ø40 rosa"."""
+        height = f" {self.height_m:g} m" if self.height_m is not None else ""
+        bloom = f" {self.bloom_color}" if self.bloom_color else ""
+        return f"{self.id} {self.name}{height} Ø{self.diameter_cm}{bloom}"
+
+
+def _csv_row_values(row: Dict[str, str]) -> tuple:
+    light = set(row["light"].split("|"))
+    return (
+        row["id"].strip().lower(),
+        row["name"].strip(),
+        row["latin_name"].strip() or None,
+        row["category"].strip(),
+        int(row["zone_max"]),
+        int("sol" in light),
+        int("halvskugga" in light),
+        int("skugga" in light),
+        float(row["height_m"]) if row["height_m"] else None,
+        int(row["diameter_cm"]),
+        row["bloom_color"].strip() or None,
+        row["color_2d"].strip() or "green",
+        row["tags"].strip(),
+        int(row["rank"] or 0),
+    )
+
+
+def _plant_from_row(row: sqlite3.Row) -> CatalogPlant:
+    return CatalogPlant(
+        id=row["id"],
+        name=row["name"],
+        latin_name=row["latin_name"],
+        category=row["category"],
+        zone_max=row["zone_max"],
+        light=tuple(light for light in LIGHTS if row[light]),
+        height_m=row["height_m"],
+        diameter_cm=row["diameter_cm"],
+        bloom_color=row["bloom_color"],
+        color_2d=row["color_2d"],
+        tags=tuple(tag for tag in row["tags"].split("|") if tag),
+        rank=row["rank"],
+    )
+
+
+def _load_csv(conn: sqlite3.Connection, csv_path: str):
+    conn.executescript(_SCHEMA)
+    with open(csv_path, encoding="utf-8", newline="") as f:
+        conn.executemany(
+            f"INSERT INTO plants ({', '.join(_COLUMNS)}) VALUES ({', '.join('?' * len(_COLUMNS))})",
+            (_csv_row_values(row) for row in csv.DictReader(f))
+        )
+    conn.commit()
+
+
+def build_database(csv_path: str, target_path: str) -> int:
+    """Bygger en SQLite-fil med index från CSV-katalogen. Returnerar antalet växter."""
+    source = sqlite3.connect(":memory:")
+    target = sqlite3.connect(target_path)
+    try:
+        _load_csv(source, csv_path)
+        source.execute("ANALYZE")
+        source.backup(target)
+        return source.execute("SELECT COUNT(*) FROM plants").fetchone()[0]
+    finally:
+        source.close()
+        target.close()
+
+
+class PlantCatalog:
+    def __init__(self, path: str = PLANT_CATALOG_PATH):
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn: Optional[sqlite3.Connection] = None
+        self._by_id: Dict[str, CatalogPlant] = {}
+        self._error: Optional[str] = None
+
+    @property
+    def failed(self) -> bool:
+        return self._error is not None
+
+    @property
+    def loaded(self) -> bool:
+        return self._conn is not None
+
+    def _open(self) -> sqlite3.Connection:
+        if self.path.lower().endswith(".csv"):
+            conn = sqlite3.connect(":memory:", check_same_thread=False)
+            _load_csv(conn, self.path)
+        else:
+            # Färdigbyggd katalog: skrivskyddad och minnesmappad, delas mellan workers via sidcachen.
+            conn = sqlite3.connect(f"{Path(self.path).resolve().as_uri()}?mode=ro", uri=True, check_same_thread=False)
+            conn.execute(f"PRAGMA mmap_size={PLANT_CATALOG_MMAP_BYTES}")
+        conn.row_factory = sqlite3.Row
+        return conn
+
+    def load(self) -> int:
+        """Läser in katalogen en gång (trådsäkert). Returnerar antalet växter; kastar om den inte går att läsa."""
+        with self._lock:
+            if self._conn is None:
+                try:
+                    conn = self._open()
+                    plants = [_plant_from_row(row) for row in conn.execute("SELECT * FROM plants")]
+                except Exception as e:
+                    self._error = str(e)
+                    logger.error(f"Kunde inte läsa växtkatalogen {self.path}: {e}")
+                    raise
+                self._by_id = {plant.id: plant for plant in plants}
+                self._conn = conn
+                self._error = None
+                logger.info(f"Växtkatalogen laddad: {len(plants)} växter från {self.path}.")
+            return len(self._by_id)
+
+    def available(self) -> bool:
+        """Laddar katalogen vid behov; False (utan nytt försök) om den inte gick att läsa."""
+        if self._conn is not None:
+            return True
+        if self.failed:
+            return False
+        try:
+            self.load()
+            return True
+        except Exception:
+            return False
+
+    def get(self, plant_id: str) -> Optional[CatalogPlant]:
+        if self._conn is None:
+            self.load()
+        return self._by_id.get(plant_id.strip().lower())
+
+    def candidates(
+        self,
+        zone: Optional[int] = None,
+        light: Optional[str] = None,
+        max_height_m: Optional[float] = None,
+        bloom_colors: Sequence[str] = ()
+    ) -> List[CatalogPlant]:
+        """Växter som klarar zonen och ljuset (och höjd/blomfärg om de anges), i rangordning."""
+        if self._conn is None:
+            self.load()
+        clauses, params = ["zone_max >= ?"], [zone or 1]
+        if light in LIGHTS:
+            clauses.append(f"{light} = 1")
+        if max_height_m is not None:
+            clauses.append("height_m <= ?")
+            params.append(max_height_m)
+        if bloom_colors:
+            clauses.append(f"bloom_color IN ({', '.join('?' * len(bloom_colors))})")
+            params.extend(bloom_colors)
+        sql = f"SELECT id FROM plants WHERE {' AND '.join(clauses)} ORDER BY rank, id"
+        with self._lock:
+            rows = self._conn.execute(sql, params).fetchall()
+        return [self._by_id[row[0]] for row in rows]
+
+    def close(self):
+        with self._lock:
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
+
+
+catalog = PlantCatalog()
+
+
+# --- Tolkning av indata ---
+
+_ROMAN = {"I": 1, "II": 2, "III": 3, "IV": 4, "V": 5, "VI": 6, "VII": 7, "VIII": 8}
+# Romerska siffror bara med versaler, så att "zon i Uppsala" inte blir zon 1
+_ZONE_VALUE = r"([1-8]|VIII|VII|VI|IV|V|III|II|I)\b"
+_ZONE = re.compile(rf"(?i:zon)\s*{_ZONE_VALUE}(?:\s*[-–/]\s*{_ZONE_VALUE})?")
+
+# Ungefärlig odlingszon för orter när användaren inte skrivit zonen själv
+_CITY_ZONES = {
+    "malmö": 1, "lund": 1, "helsingborg": 1, "kristianstad": 1, "göteborg": 2, "halmstad": 2,
+    "kalmar": 2, "visby": 2, "karlskrona": 2, "norrköping": 3, "stockholm": 3, "uppsala": 3,
+    "linköping": 3, "örebro": 3, "västerås": 3, "karlstad": 3, "jönköping": 3, "växjö": 3,
+    "gävle": 4, "falun": 5, "sundsvall": 5, "umeå": 5, "östersund": 6, "luleå": 6, "kiruna": 8,
+}
+
+
+def _zone_value(text: str) -> int:
+    return int(text) if text.isdigit() else _ROMAN[text]
+
+
+def parse_zone(user_location: str) -> Optional[int]:
+    """Odlingszon 1-8 ur platsen ("Växtzon 3, Uppsala", "zon III-IV", "Luleå"), eller None.
+
+    Ett intervall ger den kallare zonen, så att förslagen klarar hela intervallet.
+    """
+    text = user_location or ""
+    match = _ZONE.search(text)
+    if match:
+        return max(_zone_value(value) for value in match.groups() if value)
+    for word in re.findall(r"\w+", text.lower()):
+        if word in _CITY_ZONES:
+            return _CITY_ZONES[word]
+    return None
+
+
+_PART_SHADE = re.compile(r"halvskugg|halvsol|delvis (?:sol|skugg)|mittemellan|växlande", re.IGNORECASE)
+_SHADE = re.compile(r"skugg", re.IGNORECASE)
+_SUN = re.compile(r"\bsol", re.IGNORECASE)
+
+
+def parse_sun(text: str) -> Optional[str]:
+    """Ljusläge ("sol", "halvskugga" eller "skugga") ur bildanalysen, eller None om det inte framgår."""
+    text = text or ""
+    if _PART_SHADE.search(text):
+        return "halvskugga"
+    shade, sun = bool(_SHADE.search(text)), bool(_SUN.search(text))
+    if shade and sun:
+        return "halvskugga"
+    if shade:
+        return "skugga"
+    if sun:
+        return "sol"
+    return None
+
+
+_COLOR_WORDS = {
+    "rosa": "rosa", "vit": "vit", "vita": "vit", "vitt": "vit", "blå": "blå", "blåa": "blå", "blått": "blå",
+    "lila": "lila", "gul": "gul", "gula": "gul", "gult": "gul", "röd": "röd", "röda": "röd", "rött": "röd",
+    "orange": "orange",
+}
+_TAG_PATTERNS = tuple((tag, re.compile(pattern, re.IGNORECASE)) for tag, pattern in (
+    ("ätbar", r"ätbar|ätlig|köksträdgård|\bbär|frukt|kryddor"),
+    ("pollinatörer", r"pollinat|\bbin\b|\bbina\b|humlor|fjäril"),
+    ("lättskött", r"lättskött|lite skötsel|tålig"),
+    ("doft", r"doft"),
+    ("vintergrön", r"vintergrön|året runt"),
+    ("torktålig", r"torktålig|torka|torrt"),
+))
+_LOW_PLANTING = re.compile(r"lågväx|låga växter|inga (?:höga|stora) växter", re.IGNORECASE)
+_LOW_PLANTING_MAX_HEIGHT_M = 1.0
+
+
+def _parse_preferences(user_preferences: str) -> Tuple[Tuple[str, ...], Tuple[str, ...], Optional[float]]:
+    # (blomfärger, egenskaper, maxhöjd) ur önskemålen, för att lyfta fram passande växter i listan.
+    text = user_preferences or ""
+    colors = tuple(sorted({_COLOR_WORDS[w] for w in re.findall(r"\w+", text.lower()) if w in _COLOR_WORDS}))
+    tags = tuple(tag for tag, pattern in _TAG_PATTERNS if pattern.search(text))
+    max_height_m = _LOW_PLANTING_MAX_HEIGHT_M if _LOW_PLANTING.search(text) else None
+    return colors, tags, max_height_m
+
+
+# --- Kandidatlista och ifyllnad ---
+
+def shortlist(
+    zone: Optional[int],
+    sun: Optional[str],
+    user_preferences: str = "",
+    size: Optional[int] = None
+) -> Tuple[CatalogPlant, ...]:
+    """Kandidater för frågan: växter som klarar zonen och ljuset, med de som passar önskemålen först."""
+    colors, tags, max_height_m = _parse_preferences(user_preferences)
+    return _shortlist(zone, sun, colors, tags, max_height_m, size or PLANT_CATALOG_SHORTLIST_SIZE)
+
+
+@functools.lru_cache(maxsize=1024)
+def _shortlist(
+    zone: Optional[int],
+    sun: Optional[str],
+    colors: Tuple[str, ...],
+    tags: Tuple[str, ...],
+    max_height_m: Optional[float],
+    size: int
+) -> Tuple[CatalogPlant, ...]:
+    # Rang är per kategori, så rangordningen ger redan en blandning av perenner, buskar, träd osv.
+    base = catalog.candidates(zone, sun, max_height_m)
+    preferred = catalog.candidates(zone, sun, max_height_m, colors) if colors else []
+    if tags:
+        preferred += [plant for plant in base if set(tags) & set(plant.tags)]
+
+    def score(plant: CatalogPlant) -> int:
+        return (plant.bloom_color in colors) + len(set(tags) & set(plant.tags))
+
+    # Som mest halva listan går till växter som matchar önskemålen, så att modellen har val kvar.
+    picked: Dict[str, CatalogPlant] = {}
+    for plant in sorted({p.id: p for p in preferred}.values(), key=lambda p: (-score(p), p.rank))[:size // 2]:
+        picked[plant.id] = plant
+    for plant in base:
+        if len(picked) >= size:
+            break
+        picked.setdefault(plant.id, plant)
+    category_index = {category: i for i, category in enumerate(CATEGORY_ORDER)}
+    return tuple(sorted(picked.values(), key=lambda p: (category_index.get(p.category, len(CATEGORY_ORDER)), p.rank)))
+
+
+def format_shortlist(zone: Optional[int], sun: Optional[str], plants: Sequence[CatalogPlant]) -> str:
+    """Växtlistan för frågan, en rad per kategori (plants ska vara sorterade per kategori som från shortlist)."""
+    conditions = ", ".join(filter(None, (f"zon {zone}" if zone else None, sun)))
+    header = f"Växtlista för {conditions}" if conditions else "Växtlista"
+    lines = "\n".join(
+        f"{category}: " + "; ".join(plant.prompt_entry() for plant in group)
+        for category, group in itertools.groupby(plants, key=lambda plant: plant.category)
+    )
+    return f"{header} (id namn höjd diameter-i-cm blomfärg), per typ:\n{lines}"
+
+
+def expand_design(output: LLMCatalogDesignOutput, zone: Optional[int] = None) -> LLMDesignOutput:
+    """Gör om ett kompakt svar (id + position) till LLMDesignOutput med växtdata från katalogen.
+
+    Okända id:n och växter som inte klarar zonen tas bort; ValueError om ingen växt blir kvar.
+    """
+    plan = output.garden_plan_data
+    plants: List[PlantData] = []
+    dropped: List[str] = []
+    for ref in plan.plants:
+        plant = catalog.get(ref.id)
+        if plant is None or (zone is not None and plant.zone_max < zone):
+            _plants_total.inc(result="unknown" if plant is None else "not_hardy")
+            dropped.append(ref.id)
+            continue
+        _plants_total.inc(result="ok")
+        plants.append(PlantData(
+            name=plant.name,
+            latin_name=plant.latin_name,
+            x=ref.x,
+            y=ref.y,
+            diameter=plant.diameter_cm,
+            color_2d=plant.color_2d,
+            height_3d=plant.height_m,
+        ))
+    if dropped:
+        logger.warning(f"Tog bort {len(dropped)} växter som saknas i katalogen eller inte klarar zon {zone}: {dropped}")
+    if not plants:
+        raise ValueError(f"Inga växter i svaret finns i katalogen för zon {zone} (id: {dropped}).")
+    return LLMDesignOutput(
+        text_advice=output.text_advice,
+        garden_plan_data=GardenPlanData(
+            area_width_cm=plan.area_width_cm,
+            area_height_cm=plan.area_height_cm,
+            plants=plants,
+            paths=plan.paths,
+        ),
+    )
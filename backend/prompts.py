@@ -0,0 +1,198 @@
+import math
+import os
+import re
+from typing import List
+
+from . import plant_catalog
+
+# Designfrågan delad i en statisk, versionerad mall (roll, schema, exempel) och ett kort suffix med
+# användarens fält. Mallen skickas som system_instruction eller som cachat kontext hos Vertex
+# (se llm_clients.py), så att bara suffixet är nya indatatokens per anrop.
+# Öka versionen när mallen ändras; den ingår i nycklar och loggas med varje svar.
+# v3 skickar en kandidatlista ur växtkatalogen (plant_catalog.py) och modellen svarar med id:n.
+DESIGN_PROMPT_VERSION = "v3"
+FREE_FORM_DESIGN_PROMPT_VERSION = "v2"
+LEGACY_DESIGN_PROMPT_VERSION = "v1"
+
+# "v1" ger tillbaka den gamla frågan där allt byggs om som en enda f-sträng per anrop, "v2" mallen
+# där modellen själv skriver namn, mått, färg och höjd för varje växt.
+DESIGN_PROMPT_TEMPLATE = os.getenv("DESIGN_PROMPT_TEMPLATE", DESIGN_PROMPT_VERSION)
+
+DESIGN_SYSTEM_PROMPT_V2 = """Du är en superduktig trädgårdsdesigner som pratar svenska.
+Du får plats och växtzon, vad bild-roboten såg och vad användaren önskar sig.
+
+Svara med ett JSON-objekt med två huvuddelar: "text_advice" och "garden_plan_data".
+
+1. "text_advice": (text) En trevlig text som förklarar:
+  * Vilken stil på trädgården du föreslår (t.ex. "mysig stugträdgård", "modern och enkel").
+  * Varför du valde den stilen.
+  * Lite om hur växterna ska placeras.
+  * Några enkla skötselråd.
+  * Kanske förslag på en fin gång eller en bänk.
+
+2. "garden_plan_data": (objekt) Planen mer exakt:
+  * "area_width_cm": (tal) Trädgårdens bredd i cm (t.ex. 500 om den är 5 meter). Gör en smart gissning.
+  * "area_height_cm": (tal) Trädgårdens djup i cm (t.ex. 300 om den är 3 meter). Gör en smart gissning.
+  * "plants": (lista) 5-7 växter. För varje växt:
+    * "name": (text) Svenskt namn.
+    * "latin_name": (text, valfritt) Latinskt namn.
+    * "x": (tal) Position från vänster, från 0, i cm.
+    * "y": (tal) Position uppifrån, från 0, i cm.
+    * "diameter": (tal) Hur bred växten blir när den är stor, i cm.
+    * "color_2d": (text) Färg på den enkla kartan (t.ex. "rosa", "mörkgrön", "lightblue").
+    * "height_3d": (tal i meter, eller texten "okänd") Hur hög växten blir.
+  * "paths": (lista, kan vara tom) Gångar som {"points": [[x1,y1],[x2,y2],...], "color": "gray"}, punkter i cm.
+
+Exempel på "garden_plan_data":
+{"area_width_cm": 700, "area_height_cm": 400, "plants": [{"name": "Stjärnflocka", "latin_name": "Astrantia major", "x": 100, "y": 150, "diameter": 40, "color_2d": "pink", "height_3d": 0.6}, {"name": "Jättedaggkåpa", "latin_name": "Alchemilla mollis", "x": 200, "y": 250, "diameter": 50, "color_2d": "limegreen", "height_3d": 0.4}], "paths": [{"points": [[0, 350], [700, 350], [700, 380], [0, 380]], "color": "lightgray"}]}
+
+Hela svaret ska vara ett enda giltigt JSON-objekt som börjar med { och slutar med }, utan text före eller efter."""
+
+DESIGN_SYSTEM_PROMPT_V3 = """Du är en superduktig trädgårdsdesigner som pratar svenska.
+Du får plats och växtzon, vad bild-roboten såg, vad användaren önskar sig och en växtlista med id:n.
+
+Svara med ett JSON-objekt med två huvuddelar: "text_advice" och "garden_plan_data".
+
+1. "text_advice": (text) En trevlig text som förklarar:
+  * Vilken stil på trädgården du föreslår (t.ex. "mysig stugträdgård", "modern och enkel").
+  * Varför du valde den stilen.
+  * Lite om hur växterna ska placeras (nämn dem med svenskt namn).
+  * Några enkla skötselråd.
+  * Kanske förslag på en fin gång eller en bänk.
+
+2. "garden_plan_data": (objekt) Planen mer exakt:
+  * "area_width_cm": (tal) Trädgårdens bredd i cm (t.ex. 500 om den är 5 meter). Gör en smart gissning.
+  * "area_height_cm": (tal) Trädgårdens djup i cm (t.ex. 300 om den är 3 meter). Gör en smart gissning.
+  * "plants": (lista) 5-7 växter ur växtlistan. För varje växt bara:
+    * "id": (text) Växtens id i listan.
+    * "x": (tal) Position från vänster, från 0, i cm.
+    * "y": (tal) Position uppifrån, från 0, i cm.
+    Namn, diameter, färg och höjd fylls i från listan; skriv dem inte. Ta hänsyn till diametern när du placerar växterna.
+  * "paths": (lista, kan vara tom) Gångar som {"points": [[x1,y1],[x2,y2],...], "color": "gray"}, punkter i cm.
+
+Exempel på "garden_plan_data":
+{"area_width_cm": 700, "area_height_cm": 400, "plants": [{"id": "ast", "x": 100, "y": 150}, {"id": "alc", "x": 200, "y": 250}], "paths": [{"points": [[0, 350], [700, 350], [700, 380], [0, 380]], "color": "lightgray"}]}
+
+Hela svaret ska vara ett enda giltigt JSON-objekt som börjar med { och slutar med }, utan text före eller efter."""
+
+
+def design_prompt_version() -> str:
+    if DESIGN_PROMPT_TEMPLATE in (LEGACY_DESIGN_PROMPT_VERSION, FREE_FORM_DESIGN_PROMPT_VERSION):
+        return DESIGN_PROMPT_TEMPLATE
+    # Går katalogen inte att läsa används v2, där modellen själv beskriver växterna.
+    return FREE_FORM_DESIGN_PROMPT_VERSION if plant_catalog.catalog.failed else DESIGN_PROMPT_VERSION
+
+
+def design_uses_catalog() -> bool:
+    return design_prompt_version() == DESIGN_PROMPT_VERSION
+
+
+def design_system_prompt():
+    """Den statiska delen, eller None för den gamla frågan (allt i användarmeddelandet)."""
+    version = design_prompt_version()
+    if version == LEGACY_DESIGN_PROMPT_VERSION:
+        return None
+    return DESIGN_SYSTEM_PROMPT_V2 if version == FREE_FORM_DESIGN_PROMPT_VERSION else DESIGN_SYSTEM_PROMPT_V3
+
+
+def build_design_prompt(image_analysis_text: str, user_location: str, user_preferences: str) -> str:
+    """Användarmeddelandet för designanropet enligt vald mallversion."""
+    if design_prompt_version() == LEGACY_DESIGN_PROMPT_VERSION:
+        return build_legacy_design_prompt(image_analysis_text, user_location, user_preferences)
+    prompt = (
+        f"Plats och växtzon: {user_location.strip()}\n"
+        f"Vad bild-roboten såg: {image_analysis_text.strip()}\n"
+        f"Vad användaren önskar sig: {user_preferences.strip()}"
+    )
+    if design_uses_catalog() and plant_catalog.catalog.available():
+        zone = plant_catalog.parse_zone(user_location)
+        sun = plant_catalog.parse_sun(image_analysis_text) or plant_catalog.parse_sun(user_preferences)
+        plants = plant_catalog.shortlist(zone, sun, user_preferences)
+        prompt += "\n\n" + plant_catalog.format_shortlist(zone, sun, plants)
+    return prompt
+
+
+def variant_preferences(user_preferences: str, style: str) -> str:
+    """Önskemålen för en enskild stilvariant (när varianten designas i ett eget anrop)."""
+    return f"{user_preferences.strip()} Stil: {style.strip()}."
+
+
+def build_design_variants_prompt(image_analysis_text: str, user_location: str, user_preferences: str, styles: List[str]) -> str:
+    """Användarmeddelandet för flera stilvarianter av samma trädgård i ett enda anrop."""
+    numbered = "\n".join(f"{i}. {style.strip()}" for i, style in enumerate(styles, start=1))
+    return (
+        build_design_prompt(image_analysis_text, user_location, user_preferences)
+        + f"\n\nGör {len(styles)} olika förslag på samma trädgård, ett per stil:\n{numbered}\n"
+        'Svara med ett JSON-objekt {"variants": [...]} där varje element har "text_advice" och '
+        '"garden_plan_data" enligt beskrivningen, i samma ordning som stilarna.'
+    )
+
+
+def build_legacy_design_prompt(image_analysis_text: str, user_location: str, user_preferences: str) -> str:
+    instruktion_till_roboten = f"""
+    Du är en superduktig trädgårdsdesigner som pratar svenska.
+    Här är informationen du har:
+    - Plats och växtzon: {user_location}
+    - Vad bild-roboten såg: {image_analysis_text}
+    - Vad användaren önskar sig: {user_preferences}
+
+    Din uppgift är att svara med en JSON-kod. JSON-koden ska ha två huvuddelar: "text_advice" och "garden_plan_data".
+
+    1.  "text_advice": (Detta ska vara en vanlig text) Skriv en trevlig text som förklarar:
+        * Vilken stil på trädgården du föreslår (t.ex. "mysig stugträdgård", "modern och enkel").
+        * Varför du valde den stilen.
+        * Lite om hur växterna ska placeras.
+        * Några enkla skötselråd.
+        * Kanske förslag på en fin gång eller en bänk.
+
+    2.  "garden_plan_data": (Detta ska vara mer JSON-kod inuti) Här beskriver du planen mer exakt:
+        * "area_width_cm": (Ett tal) Hur bred är trädgården i centimeter (t.ex. 500 om den är 5 meter)? Gör en smart gissning.
+        * "area_height_cm": (Ett tal) Hur djup är trädgården i centimeter (t.ex. 300 om den är 3 meter)? Gör en smart gissning.
+        * "plants": (En lista med växter) Ge förslag på 5-7 växter. För varje växt, skriv:
+            * "name": (Text) Svenskt namn på växten.
+            * "latin_name": (Text, valfritt) Latinskt namn.
+            * "x": (Ett tal) Var på en karta (vänster till höger, från 0) växten ska vara, i cm.
+            * "y": (Ett tal) Var på en karta (uppe till nere, från 0) växten ska vara, i cm.
+            * "diameter": (Ett tal) Hur bred växten blir när den är stor, i cm.
+            * "color_2d": (Text) Vilken färg den ska ha på vår enkla karta (t.ex. "rosa", "mörkgrön", "lightblue").
+            * "height_3d": (Ett tal i meter, eller texten "okänd") Hur hög växten blir.
+        * "paths": (En lista med gångar, kan vara tom [{{"points": [[x1,y1],[x2,y2],...], "color": "gray"}}]) Om du föreslår en gång, beskriv den med en lista av punkter (x,y) i cm och en färg.
+
+    Exempel på hur "garden_plan_data" ska se ut (OBS: ge mig bara JSON-objektet, inget extra prat före eller efter):
+    ```json
+    {{
+        "area_width_cm": 700,
+        "area_height_cm": 400,
+        "plants": [
+            {{"name": "Stjärnflocka", "latin_name": "Astrantia major", "x": 100, "y": 150, "diameter": 40, "color_2d": "pink", "height_3d": 0.6}},
+            {{"name": "Jättedaggkåpa", "latin_name": "Alchemilla mollis", "x": 200, "y": 250, "diameter": 50, "color_2d": "limegreen", "height_3d": 0.4}}
+        ],
+        "paths": [
+            {{"points": [[0, 350], [700, 350], [700, 380], [0, 380]], "color": "lightgray"}}
+        ]
+    }}
+    ```
+    Se till att hela ditt svar är en enda giltig JSON-sträng som börjar med {{ och slutar med }}.
+    """
+    return instruktion_till_roboten
+
+
+_TOKEN_PIECES = re.compile(r"\w+|[^\w\s]|\s+")
+
+
+def estimate_tokens(text: str) -> int:
+    """Grov lokal uppskattning av Gemini-tokens när count_tokens inte används.
+
+    Ord räknas som en token per påbörjade fyra tecken, skiljetecken som en token var och
+    blanksteg (utom långa indrag, som räknas per fyra tecken) som gratis.
+    """
+    tokens = 0
+    for piece in _TOKEN_PIECES.findall(text or ""):
+        if piece.isspace():
+            if len(piece) > 4:
+                tokens += len(piece) // 4
+        elif piece[0].isalnum() or piece[0] == "_":
+            tokens += math.ceil(len(piece) / 4)
+        else:
+            tokens += 1
+    return tokens
@@ -0,0 +1,65 @@
+import asyncio
+import hashlib
+import json
+import logging
+from typing import Any, Awaitable, Callable, Dict
+
+from . import metrics
+
+logger = logging.getLogger(__name__)
+
+# Single-flight: samtidiga anrop med samma nyckel delar på ett enda pågående anrop.
+# Det delade anropet körs som en egen task, så att en klient som kopplar ner bara slutar
+# vänta; anropet avbryts först när ingen väntar på det längre.
+
+_calls_total = metrics.counter("single_flight_calls_total", "Anrop per grupp och utfall (executed/coalesced)")
+
+
+def make_key(*parts: Any) -> str:
+    """Normaliserad nyckel av anropets indata (trimmade strängar, sorterade dict-nycklar)."""
+    normalized = [p.strip() if isinstance(p, str) else p for p in parts]
+    raw = json.dumps(normalized, sort_keys=True, ensure_ascii=False, default=str)
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+
+class _Flight:
+    __slots__ = ("task", "waiters")
+
+    def __init__(self, task: asyncio.Task):
+        self.task = task
+        self.waiters = 0
+
+
+class SingleFlight:
+    def __init__(self, name: str):
+        self.name = name
+        self._flights: Dict[str, _Flight] = {}
+
+    async def do(self, key: str, func: Callable[[], Awaitable[Any]]) -> Any:
+        flight = self._flights.get(key)
+        if flight is None:
+            flight = _Flight(asyncio.create_task(func()))
+            self._flights[key] = flight
+            flight.task.add_done_callback(lambda _t, k=key, f=flight: self._forget(k, f))
+            _calls_total.inc(group=self.name, result="executed")
+        else:
+            _calls_total.inc(group=self.name, result="coalesced")
+            logger.info(f"Single-flight '{self.name}': ansluter till pågående anrop ({flight.waiters} väntar redan).")
+
+        flight.waiters += 1
+        try:
+            # shield: att den här väntaren avbryts ska inte avbryta det delade anropet.
+            return await asyncio.shield(flight.task)
+        except asyncio.CancelledError:
+            if flight.waiters == 1 and not flight.task.done():
+                logger.info(f"Single-flight '{self.name}': sista väntaren försvann, avbryter anropet.")
+                flight.task.cancel()
+            raise
+        finally:
+            flight.waiters -= 1
+
+    def _forget(self, key: str, flight: _Flight):
+        if self._flights.get(key) is flight:
+            del self._flights[key]
+        if not flight.task.cancelled():
+            flight.task.exception() # Felet hämtas av väntarna; markera det som hämtat
@@ -0,0 +1,114 @@
+import asyncio
+import logging
+import os
+import time
+from typing import Dict, Optional
+
+from . import advice_pipeline
+from . import db_writer
+from . import jobs
+from . import llm_clients
+from . import llm_services
+from . import metrics
+from . import plant_catalog
+from . import prompts
+from . import supabase_services
+
+logger = logging.getLogger(__name__)
+
+# Kallstart: de tunga beroendena (Vertex AI-SDK:t, supabase-paketet, numpy och svgwrite) importeras
+# inte när appen laddas utan i bakgrunden när lifespan har startat, så att processen kan svara
+# direkt. /health/live svarar så fort processen lever; /health/ready först när allt är laddat.
+# Med STARTUP_PRELOAD_ENABLED=false laddas allt i stället vid första användningen.
+STARTUP_PRELOAD_ENABLED = os.getenv("STARTUP_PRELOAD_ENABLED", "true").lower() == "true"
+
+_startup_seconds = metrics.gauge("startup_seconds", "Tid från lifespan-start tills en del var laddad, per del")
+
+# Lägen per del i /health/ready. "disabled" (t.ex. Supabase utan URL/Key) hindrar inte beredskap,
+# precis som appen i övrigt startar utan konfiguration. "degraded" betyder att delen inte gick att
+# ladda men att appen har en reserv (växtkatalogen: promptversion v2), så den hindrar inte heller.
+OK = "ok"
+PENDING = "pending"
+DISABLED = "disabled"
+DEGRADED = "degraded"
+FAILED = "failed"
+
+
+class Startup:
+    def __init__(self):
+        self._started: Optional[float] = None
+        self._preload_task: Optional[asyncio.Task] = None
+        self._done: Dict[str, str] = {} # Del -> OK/FAILED för förladdningen
+        self._ready_logged = False
+
+    def start(self):
+        """Startar förladdningen i bakgrunden och returnerar direkt."""
+        self._started = time.perf_counter()
+        llm_clients.registry.start(llm_services.warmup_models(), llm_services.cached_prefixes())
+        if STARTUP_PRELOAD_ENABLED:
+            self._preload_task = asyncio.create_task(self._preload())
+
+    async def _preload(self):
+        await asyncio.gather(
+            self._load("supabase", supabase_services.get_client),
+            self._load("rendering", advice_pipeline.preload_rendering),
+            self._load("plant_catalog", plant_catalog.catalog.load),
+        )
+
+    async def _load(self, part: str, func):
+        try:
+            await asyncio.to_thread(func)
+            self._done[part] = OK
+        except Exception as e:
+            self._done[part] = FAILED
+            logger.error(f"Kunde inte förladda {part}: {e}", exc_info=True)
+        _startup_seconds.set(round(time.perf_counter() - self._started, 3), part=part)
+
+    def _vertex_state(self) -> str:
+        if not llm_services.CHOSEN_GEMINI_MODEL:
+            return DISABLED
+        if llm_clients.registry.startup_error:
+            return FAILED
+        return OK if llm_clients.registry.ready else PENDING
+
+    def _supabase_state(self) -> str:
+        if supabase_services.client_ready():
+            return OK
+        if not (supabase_services.SUPABASE_URL and supabase_services.SUPABASE_KEY):
+            return DISABLED
+        return self._done.get("supabase", PENDING) if STARTUP_PRELOAD_ENABLED else OK
+
+    def _plant_catalog_state(self) -> str:
+        # Katalogen behövs bara för promptversionen med växtlista (DESIGN_PROMPT_TEMPLATE=v3).
+        if prompts.DESIGN_PROMPT_TEMPLATE in (prompts.LEGACY_DESIGN_PROMPT_VERSION, prompts.FREE_FORM_DESIGN_PROMPT_VERSION):
+            return DISABLED
+        # Går den inte att läsa faller designprompten tillbaka till v2 (prompts.design_prompt_version).
+        if plant_catalog.catalog.failed or self._done.get("plant_catalog") == FAILED:
+            return DEGRADED
+        return self._done.get("plant_catalog", PENDING) if STARTUP_PRELOAD_ENABLED else OK
+
+    def status(self) -> dict:
+        checks = {
+            "vertex": self._vertex_state(),
+            "supabase": self._supabase_state(),
+            "rendering": self._done.get("rendering", PENDING) if STARTUP_PRELOAD_ENABLED else OK,
+            "plant_catalog": self._plant_catalog_state(),
+            "db_writer": OK if db_writer.garden_designs_writer.running else PENDING,
+            "jobs": OK if jobs.job_manager.running else PENDING,
+        }
+        ready = all(state in (OK, DISABLED, DEGRADED) for state in checks.values())
+        if ready and not self._ready_logged and self._started is not None:
+            self._ready_logged = True
+            elapsed = time.perf_counter() - self._started
+            _startup_seconds.set(round(elapsed, 3), part="ready")
+            logger.info(f"Appen är redo {elapsed:.2f}s efter start ({checks}).")
+        return {"ready": ready, "checks": checks}
+
+    async def stop(self):
+        if self._preload_task is not None and not self._preload_task.done():
+            self._preload_task.cancel()
+            await asyncio.gather(self._preload_task, return_exceptions=True)
+        self._preload_task = None
+
+
+startup = Startup()
@@ -1,11 +1,22 @@
 import os
-from supabase import create_client, Client
+import asyncio
+import functools
+import threading
+from concurrent.futures import ThreadPoolExecutor
+import httpx
 from dotenv import load_dotenv
 from fastapi import HTTPException # För felhantering
 import base64
 import mimetypes
 import logging
-from typing import Optional, Tuple # Importera Tuple för returtypen
+from typing import TYPE_CHECKING, List, Optional, Tuple, Union # Importera Tuple för returtypen
+from . import cache
+from . import plan_storage
+from . import tracing
+from .models import GardenPlanData
+
+if TYPE_CHECKING:
+    from supabase import Client
 
 logger = logging.getLogger(__name__)
 load_dotenv() # Laddar variabler från .env för lokal utveckling
@@ -14,6 +25,13 @@ SUPABASE_URL: str = os.getenv("SUPABASE_URL")
 SUPABASE_KEY: str = os.getenv("SUPABASE_KEY")
 BUCKET_NAME: str = os.getenv("SUPABASE_BUCKET_NAME", "garden-images")
 
+# Supabase-klienten är synkron. Alla anrop körs därför i en begränsad trådpool så att
+# event-loopen aldrig blockeras, och klienten delar en poolad keep-alive HTTP-anslutning.
+SUPABASE_MAX_WORKERS: int = int(os.getenv("SUPABASE_MAX_WORKERS", "8"))
+SUPABASE_MAX_CONNECTIONS: int = int(os.getenv("SUPABASE_MAX_CONNECTIONS", str(SUPABASE_MAX_WORKERS)))
+SUPABASE_KEEPALIVE_EXPIRY_S: float = float(os.getenv("SUPABASE_KEEPALIVE_EXPIRY_S", "60"))
+SUPABASE_HTTP_TIMEOUT_S: float = float(os.getenv("SUPABASE_HTTP_TIMEOUT_S", "30"))
+
 if not (SUPABASE_URL and SUPABASE_KEY):
     logger.error("Supabase URL eller Key är inte konfigurerad i miljövariabler!")
     # I en produktionsmiljö kanske du vill att appen inte startar om dessa saknas.
@@ -21,55 +39,176 @@ if not (SUPABASE_URL and SUPABASE_KEY):
     # Om du är säker på att Render har dem, kan detta vara en varning.
     # raise RuntimeError("Supabase URL eller Key måste vara konfigurerade.")
 
-# Initiera Supabase-klienten endast om URL och Key finns
+# Trådpoolen och semaforen skapas vid första anropet och på nytt efter shutdown(), så att en ny
+# lifespan (t.ex. i tester) får fungerande objekt. Semaforen gör att väntande anrop köar på
+# event-loopen istället för i trådpoolens interna kö, så att avbrutna requests aldrig hinner ta en
+# tråd; den hör till en event-loop och skapas därför om när loopen byts.
+_executor: Optional[ThreadPoolExecutor] = None
+_semaphore: Optional[asyncio.Semaphore] = None
+_semaphore_loop: Optional[asyncio.AbstractEventLoop] = None
+
+# Minns vilka innehållsadresserade objekt som redan finns i Storage (nyckel: sökväg i bucketen).
+_uploaded_images = cache.get_cache("storage_objects")
+
+# supabase-paketet (postgrest, storage3, realtime ...) är långsamt att importera, så klienten och
+# dess HTTP-pool skapas först i get_client(): i bakgrunden från lifespan eller vid första anropet.
+# Initiera Supabase-klienten endast om URL och Key finns.
 # Detta förhindrar krasch vid uppstart om variabler saknas (t.ex. under lokal testning utan .env)
-try:
-    if SUPABASE_URL and SUPABASE_KEY:
-        supabase: Client = create_client(SUPABASE_URL, SUPABASE_KEY)
-    else:
-        supabase: Client = None # Sätt till None om konfiguration saknas
-        logger.warning("Supabase-klienten kunde inte initieras p.g.a. saknade URL/Key.")
-except Exception as e:
-    logger.error(f"Fel vid initiering av Supabase-klient: {e}")
-    supabase: Client = None
+supabase: Optional["Client"] = None
+_http_client: Optional[httpx.Client] = None
+_client_lock = threading.Lock()
+_client_initialized = False
 
 
-async def upload_image_from_data_url(image_data_url: str, file_name_stem: str) -> Tuple[Optional[str], Optional[str]]:
-    if not supabase:
-        logger.error("Supabase-klienten är inte initierad. Kan inte ladda upp bild.")
-        raise HTTPException(status_code=500, detail="Bildlagringstjänsten är inte konfigurerad.")
+def get_client() -> Optional["Client"]:
+    """Supabase-klienten, skapad vid första anropet. None om konfiguration saknas. Blockerande."""
+    global supabase, _http_client, _client_initialized
+    if supabase is not None or _client_initialized:
+        return supabase
+    with _client_lock:
+        if supabase is not None or _client_initialized:
+            return supabase
+        try:
+            if SUPABASE_URL and SUPABASE_KEY:
+                from supabase import create_client, ClientOptions
+                _http_client = httpx.Client(
+                    limits=httpx.Limits(
+                        max_connections=SUPABASE_MAX_CONNECTIONS,
+                        max_keepalive_connections=SUPABASE_MAX_CONNECTIONS,
+                        keepalive_expiry=SUPABASE_KEEPALIVE_EXPIRY_S
+                    ),
+                    timeout=SUPABASE_HTTP_TIMEOUT_S
+                )
+                supabase = create_client(SUPABASE_URL, SUPABASE_KEY, options=ClientOptions(httpx_client=_http_client))
+                logger.info("Supabase-klienten är initierad.")
+            else:
+                logger.warning("Supabase-klienten kunde inte initieras p.g.a. saknade URL/Key.")
+        except Exception as e:
+            logger.error(f"Fel vid initiering av Supabase-klient: {e}")
+            supabase = None
+        _client_initialized = True
+        return supabase
 
-    logger.info(f"Försöker ladda upp bild med stamnamn: {file_name_stem}")
+
+async def get_client_async() -> Optional["Client"]:
+    """Som get_client(), men skapar klienten i en tråd så att event-loopen inte blockeras."""
+    if supabase is not None or _client_initialized:
+        return supabase
+    return await asyncio.to_thread(get_client)
+
+
+def client_ready() -> bool:
+    return supabase is not None
+
+
+def _pool(loop: asyncio.AbstractEventLoop) -> Tuple[ThreadPoolExecutor, asyncio.Semaphore]:
+    global _executor, _semaphore, _semaphore_loop
+    if _executor is None:
+        _executor = ThreadPoolExecutor(max_workers=SUPABASE_MAX_WORKERS, thread_name_prefix="supabase")
+    if _semaphore is None or _semaphore_loop is not loop:
+        _semaphore = asyncio.Semaphore(SUPABASE_MAX_WORKERS)
+        _semaphore_loop = loop
+    return _executor, _semaphore
+
+
+async def _run_blocking(func, *args, **kwargs):
+    """Kör ett synkront Supabase-anrop i trådpoolen, begränsat till SUPABASE_MAX_WORKERS samtidiga."""
+    loop = asyncio.get_running_loop()
+    executor, semaphore = _pool(loop)
+    async with semaphore:
+        return await loop.run_in_executor(executor, functools.partial(func, *args, **kwargs))
+
+
+async def shutdown():
+    # Anropas när appen stängs ner: väntar in pågående anrop (i en tråd, så att loopen inte blockeras)
+    # och stänger HTTP-poolen. Nästa anrop skapar en ny trådpool, semafor och klient.
+    global _executor, _semaphore, _semaphore_loop, supabase, _http_client, _client_initialized
+    executor, _executor = _executor, None
+    _semaphore = _semaphore_loop = None
+    if executor is not None:
+        await asyncio.to_thread(executor.shutdown, wait=True)
+    if _http_client is not None:
+        # Klienten delar den stängda HTTP-poolen och kan inte återanvändas.
+        with _client_lock:
+            _http_client.close()
+            supabase = _http_client = None
+            _client_initialized = False
+    logger.info("Supabase-trådpool och HTTP-anslutningar stängda.")
+
+
+async def upload_image_from_data_url(image_data_url: str, file_name_stem: str) -> Tuple[Optional[str], Optional[str]]:
+    # Behålls för anropare som faktiskt har en data-URL. /get_advice använder upload_image_bytes direkt.
     try:
         # Extrahera MIME-typ och base64-data från data URL
         # Exempel: "data:image/png;base64,iVBORw0KGgo..."
         header, encoded = image_data_url.split(",", 1)
         mime_type_part = header.split(":")[1] # "image/png;base64"
         mime_type = mime_type_part.split(";")[0] # "image/png"
+        image_data = base64.b64decode(encoded)
+    except Exception as e:
+        logger.error(f"Kunde inte tolka data-URL för {file_name_stem}: {e}", exc_info=True)
+        raise HTTPException(status_code=400, detail="Bilden kunde inte tolkas (ogiltig data-URL).")
+
+    return await upload_image_bytes(image_data, mime_type, file_name_stem)
+
+
+async def upload_image_bytes(image_data: Union[bytes, memoryview], mime_type: str, file_name_stem: str, folder: str = "uploads") -> Tuple[Optional[str], Optional[str]]:
+    """Laddar upp råa bildbytes till Supabase Storage och returnerar (public_url, mime_type).
+
+    Bytes skickas vidare som de är, utan base64-kodning eller extra kopior. Med en innehållshash
+    som file_name_stem hoppas uppladdningen över om objektet redan finns.
+    """
+    client = await get_client_async()
+    if not client:
+        logger.error("Supabase-klienten är inte initierad. Kan inte ladda upp bild.")
+        raise HTTPException(status_code=500, detail="Bildlagringstjänsten är inte konfigurerad.")
+
+    logger.info(f"Försöker ladda upp bild med stamnamn: {file_name_stem}")
+    try:
+        if isinstance(image_data, memoryview):
+            image_data = image_data.tobytes() # storage3 vill ha bytes
 
         file_extension = mimetypes.guess_extension(mime_type)
         if not file_extension:
             logger.warning(f"Kunde inte gissa filändelse för MIME-typ: {mime_type}. Använder '.png'.")
             file_extension = ".png"
-        
-        image_data = base64.b64decode(encoded)
-        
+
         # Skapa ett unikt filnamn med korrekt filändelse
-        full_file_name = f"uploads/{file_name_stem}{file_extension}"
+        full_file_name = f"{folder}/{file_name_stem}{file_extension}"
+
+        # Filnamnet är innehållets hash, så samma bild som redan laddats upp behöver inte skickas igen.
+        cached_url = await _uploaded_images.get(full_file_name)
+        if cached_url:
+            logger.info(f"Bilden {full_file_name} finns redan i Storage (cache), hoppar över uppladdning.")
+            return cached_url, mime_type
 
-        logger.info(f"Laddar upp {full_file_name} till bucket '{BUCKET_NAME}' med MIME-typ '{mime_type}'.")
+        bucket = client.storage.from_(BUCKET_NAME)
+        already_exists = False
+        if hasattr(bucket, "exists"): # Finns i nyare storage3-versioner
+            try:
+                already_exists = await _run_blocking(bucket.exists, full_file_name)
+            except Exception as exists_e:
+                logger.warning(f"Kunde inte kontrollera om {full_file_name} redan finns, laddar upp ändå: {exists_e}")
 
-        # Supabase Python client v2.x.x syntax
-        response = supabase.storage.from_(BUCKET_NAME).upload(
-            path=full_file_name,
-            file=image_data,
-            file_options={"content-type": mime_type, "upsert": "true"} # upsert: true skriver över om filen finns
-        )
-        # I Supabase Python client v2, om uppladdningen misslyckas, kastas ett undantag (t.ex. StorageApiError).
-        # Om det lyckas, innehåller response oftast bara metadata eller är None, så vi behöver inte kolla response.data här.
+        if already_exists:
+            logger.info(f"Bilden {full_file_name} finns redan i bucket '{BUCKET_NAME}', hoppar över uppladdning.")
+        else:
+            logger.info(f"Laddar upp {full_file_name} ({len(image_data)} bytes) till bucket '{BUCKET_NAME}' med MIME-typ '{mime_type}'.")
+
+            # Supabase Python client v2.x.x syntax
+            with tracing.span("storage_upload"):
+                response = await _run_blocking(
+                    bucket.upload,
+                    path=full_file_name,
+                    file=image_data,
+                    file_options={"content-type": mime_type, "upsert": "true"} # upsert: true skriver över om filen finns
+                )
+            tracing.record_bytes("storage_upload", len(image_data))
+            # I Supabase Python client v2, om uppladdningen misslyckas, kastas ett undantag (t.ex. StorageApiError).
+            # Om det lyckas, innehåller response oftast bara metadata eller är None, så vi behöver inte kolla response.data här.
 
         # Hämta den publika URL:en till den uppladdade filen
-        public_url_data = supabase.storage.from_(BUCKET_NAME).get_public_url(full_file_name)
+        public_url_data = bucket.get_public_url(full_file_name)
         
         public_url = None
         if isinstance(public_url_data, str): # Nyare klienter returnerar oftast strängen direkt
@@ -86,6 +225,7 @@ async def upload_image_from_data_url(image_data_url: str, file_name_stem: str) -
             # Det är bättre att kasta ett fel här om URL:en är kritisk
             raise Exception("Misslyckades att hämta public URL från Supabase efter uppladdning.")
 
+        await _uploaded_images.set(full_file_name, public_url)
         logger.info(f"Bild uppladdad till Supabase: {public_url} med MIME-typ: {mime_type}")
         return public_url, mime_type # ---- VIKTIG ÄNDRING: Returnera både URL och MIME-typ ----
 
@@ -95,8 +235,72 @@ async def upload_image_from_data_url(image_data_url: str, file_name_stem: str) -
         raise HTTPException(status_code=500, detail=f"Kunde inte ladda upp bilden till molnet.")
 
 
-async def save_garden_advice_to_db(user_input: dict, image_analysis: str, text_advice: str, svg_plan_str: str, image_supabase_url: Optional[str] = None):
-    if not supabase:
+def build_garden_design_row(user_input: dict, image_analysis: str, text_advice: str, plan: GardenPlanData, image_supabase_url: Optional[str] = None, svg_plan_str: Optional[str] = None) -> dict:
+    # Se till att dessa nycklar exakt matchar dina kolumnnamn i Supabase-tabellen 'garden_designs'
+    row = {
+        "user_location": user_input.get("location"),
+        "user_preferences": user_input.get("preferences"),
+        "image_url": image_supabase_url, # Kommer från upload_image_bytes
+        "image_analysis_result": image_analysis,
+        "llm_text_advice": text_advice,
+        # Planen sparas kompakt (plan_data m.fl., se plan_storage.py); SVG:n ritas vid behov.
+        **plan_storage.encode_plan(plan)
+        # 'created_at' och 'id' hanteras troligen automatiskt av Supabase
+    }
+    if plan_storage.PLAN_STORE_SVG and svg_plan_str is not None:
+        row["svg_plan"] = svg_plan_str
+    return row
+
+
+async def insert_garden_designs(rows: List[dict]) -> List[dict]:
+    """Infogar flera rader i 'garden_designs' med en enda multi-row insert.
+
+    Kastar undantag vid fel så att anroparen (skrivkön i db_writer.py) kan försöka igen.
+    """
+    client = await get_client_async()
+    if not client:
+        raise RuntimeError("Supabase-klienten är inte initierad. Kan inte spara råd till DB.")
+    if not rows:
+        return []
+    response = await _run_blocking(client.table("garden_designs").insert(rows).execute)
+    return response.data or []
+
+
+async def select_garden_designs(columns: str, limit: int, before: Optional[Tuple[str, int]] = None) -> List[dict]:
+    """En sida ur 'garden_designs', nyast först, med keyset-paginering på (created_at, id).
+
+    before är (created_at, id) för sista raden på föregående sida; bara äldre rader hämtas.
+    """
+    client = await get_client_async()
+    if not client:
+        raise RuntimeError("Supabase-klienten är inte initierad. Kan inte läsa designer.")
+    query = (
+        client.table("garden_designs")
+        .select(columns)
+        .order("created_at", desc=True)
+        .order("id", desc=True)
+        .limit(limit)
+    )
+    if before is not None:
+        created_at, row_id = before
+        # Tidsstämpeln innehåller ':' och '+', därför citattecken i or-filtret.
+        query = query.or_(f'created_at.lt."{created_at}",and(created_at.eq."{created_at}",id.lt.{int(row_id)})')
+    response = await _run_blocking(query.execute)
+    return response.data or []
+
+
+async def get_garden_design(design_id: int, columns: str) -> Optional[dict]:
+    client = await get_client_async()
+    if not client:
+        raise RuntimeError("Supabase-klienten är inte initierad. Kan inte läsa designer.")
+    query = client.table("garden_designs").select(columns).eq("id", design_id).limit(1)
+    response = await _run_blocking(query.execute)
+    return response.data[0] if response.data else None
+
+
+async def save_garden_advice_to_db(user_input: dict, image_analysis: str, text_advice: str, plan: GardenPlanData, image_supabase_url: Optional[str] = None):
+    client = await get_client_async()
+    if not client:
         logger.error("Supabase-klienten är inte initierad. Kan inte spara råd till DB.")
         # Du kan välja att returnera None tyst eller kasta ett fel
         # beroende på hur kritiskt DB-sparandet är.
@@ -104,17 +308,8 @@ async def save_garden_advice_to_db(user_input: dict, image_analysis: str, text_a
 
     logger.info("Försöker spara råd till databasen.")
     try:
-        data_to_insert = {
-            # Se till att dessa nycklar exakt matchar dina kolumnnamn i Supabase-tabellen 'garden_designs'
-            "user_location": user_input.get("location"),
-            "user_preferences": user_input.get("preferences"),
-            "image_url": image_supabase_url, # Kommer från upload_image_from_data_url
-            "image_analysis_result": image_analysis,
-            "llm_text_advice": text_advice,
-            "svg_plan": svg_plan_str
-            # 'created_at' och 'id' hanteras troligen automatiskt av Supabase
-        }
-        response = supabase.table("garden_designs").insert(data_to_insert).execute()
+        data_to_insert = build_garden_design_row(user_input, image_analysis, text_advice, plan, image_supabase_url)
+        response = await _run_blocking(client.table("garden_designs").insert(data_to_insert).execute)
         
         # Kontrollera om data faktiskt returnerades och om det finns ett id
         if response.data and len(response.data) > 0 and response.data[0].get('id'):
@@ -1,45 +1,162 @@
-import svgwrite
 from backend.models import GardenPlanData
+import functools
 import logging
+import os
+from xml.sax.saxutils import escape
 
 logger = logging.getLogger(__name__)
 
+# "fast" skriver SVG-texten direkt (se _render_fast), "svgwrite" bygger ett objekt per element som tidigare.
+SVG_RENDERER = os.getenv("SVG_RENDERER", "fast").lower()
+SVG_PRECISION = int(os.getenv("SVG_PRECISION", "1")) # Antal decimaler för koordinater i den snabba renderaren
+
+_INVALID_DIMENSIONS_SVG = '<svg width="100" height="50" xmlns="http://www.w3.org/2000/svg"><text x="10" y="30" fill="red">Fel: Ogiltiga mått</text></svg>'
+_ATTR_ENTITIES = {'"': "&quot;"}
+
+
+@functools.lru_cache(maxsize=1)
+def _type_checker():
+    # svgwrite importeras först här (och i _render_svgwrite); det tar en stund och behövs inte vid start.
+    from svgwrite.data.typechecker import Tiny12TypeChecker
+    return Tiny12TypeChecker()
+
+
+def preload():
+    _type_checker()
+
+
 def create_2d_garden_svg(plan_data: GardenPlanData) -> str:
     logger.info(f"Genererar SVG för yta: {plan_data.area_width_cm}x{plan_data.area_height_cm} cm")
     try:
-        scale_factor = 1.0 # 1 cm i data = 1 px i SVG
-        svg_width = plan_data.area_width_cm * scale_factor
-        svg_height = plan_data.area_height_cm * scale_factor
-
-        if svg_width <= 0 or svg_height <= 0:
+        if plan_data.area_width_cm <= 0 or plan_data.area_height_cm <= 0:
             logger.warning("Ogiltiga dimensioner för SVG-generering.")
             # Returnera en tom SVG eller en fel-SVG
-            return '<svg width="100" height="50" xmlns="http://www.w3.org/2000/svg"><text x="10" y="30" fill="red">Fel: Ogiltiga mått</text></svg>'
-
-        dwg = svgwrite.Drawing(profile='tiny', size=(f"{svg_width}px", f"{svg_height}px"))
-        dwg.add(dwg.rect(insert=(0, 0), size=(svg_width, svg_height), fill='lightgreen'))
-
-        if plan_data.paths:
-            for path_obj in plan_data.paths:
-                # ... (samma som tidigare) ...
-                scaled_points = [(p[0] * scale_factor, p[1] * scale_factor) for p in path_obj.points]
-                dwg.add(dwg.polygon(points=scaled_points,fill=path_obj.color or "lightgray",stroke='black',stroke_width=1 ))
-
-        if plan_data.plants:
-            for plant in plan_data.plants:
-                # ... (samma som tidigare, med dynamisk fontstorlek) ...
-                center_x = plant.x * scale_factor
-                center_y = plant.y * scale_factor
-                radius = (plant.diameter / 2) * scale_factor
-                color = plant.color_2d or 'green'
-                dwg.add(dwg.circle(center=(center_x, center_y), r=radius, fill=color, stroke='darkgreen', stroke_width=1))
-                text_x = center_x + radius + 5 
-                text_y = center_y + 4          
-                dwg.add(dwg.text( plant.name, insert=(text_x, text_y), fill='black', font_size=f"{max(8, int(radius * 0.3))}px" )) # Säkerställ int för font-size
+            return _INVALID_DIMENSIONS_SVG
 
+        if SVG_RENDERER == "svgwrite":
+            svg = _render_svgwrite(plan_data)
+        else:
+            svg = _render_fast(plan_data)
         logger.info("SVG-plan genererad framgångsrikt.")
-        return dwg.tostring()
+        return svg
     except Exception as e:
         logger.error(f"Fel vid SVG-generering: {e}", exc_info=True)
         # Returnera en fel-SVG istället för att krascha hela requesten
         return '<svg width="200" height="50" xmlns="http://www.w3.org/2000/svg"><text x="10" y="30" fill="red">Internt fel vid ritning av plan.</text></svg>'
+
+
+def _render_svgwrite(plan_data: GardenPlanData) -> str:
+    import svgwrite
+
+    scale_factor = 1.0 # 1 cm i data = 1 px i SVG
+    svg_width = plan_data.area_width_cm * scale_factor
+    svg_height = plan_data.area_height_cm * scale_factor
+
+    dwg = svgwrite.Drawing(profile='tiny', size=(f"{svg_width}px", f"{svg_height}px"))
+    dwg.add(dwg.rect(insert=(0, 0), size=(svg_width, svg_height), fill='lightgreen'))
+
+    if plan_data.paths:
+        for path_obj in plan_data.paths:
+            scaled_points = [(p[0] * scale_factor, p[1] * scale_factor) for p in path_obj.points]
+            dwg.add(dwg.polygon(points=scaled_points,fill=path_obj.color or "lightgray",stroke='black',stroke_width=1 ))
+
+    if plan_data.plants:
+        for plant in plan_data.plants:
+            center_x = plant.x * scale_factor
+            center_y = plant.y * scale_factor
+            radius = (plant.diameter / 2) * scale_factor
+            color = plant.color_2d or 'green'
+            dwg.add(dwg.circle(center=(center_x, center_y), r=radius, fill=color, stroke='darkgreen', stroke_width=1))
+            text_x = center_x + radius + 5
+            text_y = center_y + 4
+            dwg.add(dwg.text( plant.name, insert=(text_x, text_y), fill='black', font_size=f"{max(8, int(radius * 0.3))}px" )) # Säkerställ int för font-size
+
+    return dwg.tostring()
+
+
+@functools.lru_cache(maxsize=1024)
+def _color(value: str, default: str) -> str:
+    # Samma färgkontroll som svgwrite (tiny-profilen). svgwrite avbryter hela ritningen vid en okänd färg
+    # (t.ex. "rosa"); här får bara det elementet standardfärgen.
+    if _type_checker().is_color(value):
+        return escape(value, _ATTR_ENTITIES)
+    logger.debug(f"Okänd SVG-färg '{value}', använder {default}.")
+    return default
+
+
+def _num(value: float) -> str:
+    # Kompakt tal: avrundat till SVG_PRECISION decimaler, utan avslutande nollor ("20.0" -> "20").
+    text = f"{round(value, SVG_PRECISION):.{SVG_PRECISION}f}" if SVG_PRECISION > 0 else str(int(round(value)))
+    if "." in text:
+        text = text.rstrip("0").rstrip(".")
+    return "0" if text == "-0" else text
+
+
+def _render_fast(plan_data: GardenPlanData) -> str:
+    """Samma bild som _render_svgwrite, skriven som text i en buffert utan validering per element.
+
+    Växtstilar (färg + radie) som förekommer mer än en gång läggs en gång i <defs> och placeras med
+    <use>; ritordningen (cirkel, etikett, nästa cirkel ...) är densamma som i svgwrite-versionen.
+    """
+    width = _num(plan_data.area_width_cm)
+    height = _num(plan_data.area_height_cm)
+    plants = plan_data.plants or []
+
+    style_counts = {}
+    for plant in plants:
+        style = (plant.color_2d or "green", plant.diameter)
+        style_counts[style] = style_counts.get(style, 0) + 1
+    symbol_ids = {}
+
+    out = []
+    write = out.append
+    write(
+        '<svg xmlns="http://www.w3.org/2000/svg" xmlns:xlink="http://www.w3.org/1999/xlink" '
+        f'version="1.2" baseProfile="tiny" width="{width}px" height="{height}px">'
+    )
+
+    repeated = [style for style, count in style_counts.items() if count > 1]
+    if repeated:
+        write("<defs>")
+        for index, (color, diameter) in enumerate(repeated):
+            symbol_id = f"p{index:x}"
+            symbol_ids[(color, diameter)] = symbol_id
+            write(
+                f'<circle id="{symbol_id}" r="{_num(diameter / 2)}" fill="{_color(color, "green")}" '
+                'stroke="darkgreen" stroke-width="1"/>'
+            )
+        write("</defs>")
+
+    write(f'<rect width="{width}" height="{height}" fill="lightgreen"/>')
+
+    for path_obj in plan_data.paths or []:
+        points = " ".join(f"{_num(p[0])},{_num(p[1])}" for p in path_obj.points)
+        write(
+            f'<polygon points="{points}" fill="{_color(path_obj.color or "lightgray", "lightgray")}" '
+            'stroke="black" stroke-width="1"/>'
+        )
+
+    if plants:
+        # Etiketterna ärver fill från gruppen; cirklarna har egen fill.
+        write('<g fill="black">')
+        for plant in plants:
+            color = plant.color_2d or "green"
+            radius = plant.diameter / 2
+            cx = _num(plant.x)
+            cy = _num(plant.y)
+            symbol_id = symbol_ids.get((color, plant.diameter))
+            if symbol_id is not None:
+                write(f'<use xlink:href="#{symbol_id}" x="{cx}" y="{cy}"/>')
+            else:
+                write(
+                    f'<circle cx="{cx}" cy="{cy}" r="{_num(radius)}" fill="{_color(color, "green")}" '
+                    'stroke="darkgreen" stroke-width="1"/>'
+                )
+            write(
+                f'<text x="{_num(plant.x + radius + 5)}" y="{_num(plant.y + 4)}" '
+                f'font-size="{max(8, int(radius * 0.3))}px">{escape(plant.name)}</text>'
+            )
+        write("</g>")
+
+    write("</svg>")
+    return "".join(out)
@@ -0,0 +1,126 @@
+import asyncio
+import contextvars
+import logging
+import os
+import time
+from contextlib import contextmanager, nullcontext
+from typing import Dict, Iterable, Optional
+
+from . import metrics
+
+logger = logging.getLogger(__name__)
+
+# Lättviktig tracing: span(stage) mäter ett steg (läsa uppladdning, Storage, Gemini-anrop, JSON,
+# SVG, DB ...), lägger tiden i histogrammet stage_duration_seconds och räknar fel per steg.
+# Stegen i en request samlas också i en Trace (via contextvars, så att tasks och trådar som
+# startas av requesten räknas med) och skickas till klienten som en Server-Timing-header.
+# Med TRACING_ENABLED=false är span() en tom context manager utan tidtagning eller lås.
+TRACING_ENABLED = os.getenv("TRACING_ENABLED", "true").lower() == "true"
+SERVER_TIMING_ENABLED = os.getenv("SERVER_TIMING_ENABLED", "true").lower() == "true"
+
+_stage_seconds = metrics.histogram("stage_duration_seconds", "Tid per steg i rådgivningskedjan")
+_stage_errors_total = metrics.counter("stage_errors_total", "Fel per steg och feltyp")
+_stage_payload_bytes = metrics.histogram("stage_payload_bytes", "Storlek på data in/ut per steg")
+_llm_tokens_total = metrics.counter("llm_tokens_total", "Tokens enligt Gemini usage_metadata per anrop, modell och typ (prompt/cached/output)")
+
+
+class Trace:
+    """Stegen i en request, summerade per steg i den ordning de först avslutades."""
+
+    __slots__ = ("started", "stages")
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.stages: Dict[str, float] = {}
+
+    def add(self, stage: str, duration_s: float):
+        self.stages[stage] = self.stages.get(stage, 0.0) + duration_s
+
+    def server_timing(self) -> str:
+        parts = [f"{stage};dur={duration * 1000:.1f}" for stage, duration in self.stages.items()]
+        parts.append(f"total;dur={(time.perf_counter() - self.started) * 1000:.1f}")
+        return ", ".join(parts)
+
+
+_current_trace: contextvars.ContextVar[Optional[Trace]] = contextvars.ContextVar("trace", default=None)
+
+
+_NOOP_SPAN = nullcontext() # Återanvändbar; ingen generator per anrop när tracing är av
+
+
+@contextmanager
+def _span(stage: str):
+    started = time.perf_counter()
+    try:
+        yield
+    except asyncio.CancelledError:
+        # Avbrutna steg (klienten kopplade ner, hedge som förlorade) räknas inte som fel.
+        raise
+    except Exception as e:
+        _stage_errors_total.inc(stage=stage, error=type(e).__name__)
+        raise
+    finally:
+        duration = time.perf_counter() - started
+        _stage_seconds.observe(duration, stage=stage)
+        trace = _current_trace.get()
+        if trace is not None:
+            trace.add(stage, duration)
+
+
+def span(stage: str):
+    """with tracing.span("design_call"): ... mäter steget. Fungerar i både synkron och asynkron kod."""
+    if not TRACING_ENABLED:
+        return _NOOP_SPAN
+    return _span(stage)
+
+
+def record_bytes(stage: str, size: int):
+    if TRACING_ENABLED:
+        _stage_payload_bytes.observe(size, stage=stage)
+
+
+def record_usage(call: str, model_id: str, response):
+    """Tokens från Gemini-svarets usage_metadata (saknas t.ex. i fejkade svar och avbrutna strömmar)."""
+    if not TRACING_ENABLED:
+        return
+    usage = getattr(response, "usage_metadata", None)
+    if usage is None:
+        return
+    for kind, attribute in (("prompt", "prompt_token_count"), ("cached", "cached_content_token_count"), ("output", "candidates_token_count")):
+        value = getattr(usage, attribute, 0) or 0
+        if value:
+            _llm_tokens_total.inc(value, call=call, model=model_id, kind=kind)
+
+
+class TracingMiddleware:
+    """ASGI-middleware: en Trace per HTTP-request och Server-Timing på svaret.
+
+    Headern skickas när svaret startar. För strömmade svar (SSE) innehåller den därför bara
+    stegen som hunnit bli klara innan första biten skickades.
+    """
+
+    def __init__(self, app, timing_allow_origins: Iterable[str] = ()):
+        self.app = app
+        self.timing_allow_origin = ", ".join(timing_allow_origins).encode("latin-1")
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not TRACING_ENABLED:
+            await self.app(scope, receive, send)
+            return
+        trace = Trace()
+        token = _current_trace.set(trace)
+
+        async def send_with_timing(message):
+            if message["type"] == "http.response.start" and SERVER_TIMING_ENABLED:
+                headers = list(message.get("headers", []))
+                headers.append((b"server-timing", trace.server_timing().encode("latin-1")))
+                if self.timing_allow_origin:
+                    # Behövs för att frontendens Performance API ska få läsa tiderna från ett annat origin.
+                    headers.append((b"timing-allow-origin", self.timing_allow_origin))
+                message = {**message, "headers": headers}
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_timing)
+        finally:
+            _current_trace.reset(token)
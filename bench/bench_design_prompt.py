@@ -0,0 +1,158 @@
+"""Jämför designfrågans versioner: v1 (hel f-sträng per anrop), v2 (statisk mall + kort suffix) och
+v3 (som v2 men med en kandidatlista ur växtkatalogen, där modellen svarar med id:n).
+
+Användning:
+    python -m bench.bench_design_prompt [--runs 20] [--prefill-ms-per-token 0.4] [--output-ms-per-token 10]
+                                        [--cached-ms-per-token 0.05] [--cached-prefix] [--versions v1,v2,v3]
+
+Designanropet körs genom llm_services mot en fejkmodell som svarar med ett inspelat Gemini-svar
+(samma plan, i v3 i kompakt form som fylls i från katalogen). Fejkmodellens latens är en fast del
+plus en kostnad per indatatoken och per utdatatoken, där tokens i ett cachat prefix kostar mindre
+(--cached-prefix låtsas att mallen är registrerad som cachat kontext). Tokens räknas med
+prompts.estimate_tokens. Rapporten visar tokens per anrop, latens och tiden för att bygga frågan
+lokalt (i v3 inklusive tolkning av zon/ljus och kandidatlistan).
+"""
+import argparse
+import asyncio
+import json
+import os
+import statistics
+import sys
+import time
+from types import SimpleNamespace
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from backend import llm_clients, llm_services, plant_catalog, prompts  # noqa: E402
+
+# Inspelat svar från designanropet (förkortat), används oförändrat av fejkmodellen.
+RECORDED_RESPONSE = json.dumps({
+    "text_advice": "Jag föreslår en mysig stugträdgård med perenner i lager, en grusgång mot bänken och "
+                   "bärbuskar längs staketet. Vattna nyplanterat rikligt första sommaren och täck med barkflis.",
+    "garden_plan_data": {
+        "area_width_cm": 600,
+        "area_height_cm": 400,
+        "plants": [
+            {"name": "Stjärnflocka", "latin_name": "Astrantia major", "x": 120, "y": 100, "diameter": 40, "color_2d": "pink", "height_3d": 0.6},
+            {"name": "Jättedaggkåpa", "latin_name": "Alchemilla mollis", "x": 220, "y": 140, "diameter": 50, "color_2d": "limegreen", "height_3d": 0.4},
+            {"name": "Svarta vinbär", "latin_name": "Ribes nigrum", "x": 480, "y": 60, "diameter": 120, "color_2d": "darkgreen", "height_3d": 1.5},
+            {"name": "Kantnepeta", "latin_name": "Nepeta x faassenii", "x": 320, "y": 300, "diameter": 45, "color_2d": "lightblue", "height_3d": 0.4},
+            {"name": "Praktnäva", "latin_name": "Geranium x magnificum", "x": 80, "y": 320, "diameter": 50, "color_2d": "slateblue", "height_3d": 0.6}
+        ],
+        "paths": [{"points": [[0, 350], [600, 350], [600, 380], [0, 380]], "color": "lightgray"}]
+    }
+}, ensure_ascii=False)
+
+# Samma svar med växtkatalogen (v3): bara id och position per växt.
+RECORDED_CATALOG_RESPONSE = json.dumps({
+    "text_advice": json.loads(RECORDED_RESPONSE)["text_advice"],
+    "garden_plan_data": {
+        "area_width_cm": 600,
+        "area_height_cm": 400,
+        "plants": [
+            {"id": "ast", "x": 120, "y": 100},
+            {"id": "alc", "x": 220, "y": 140},
+            {"id": "rib", "x": 480, "y": 60},
+            {"id": "nep", "x": 320, "y": 300},
+            {"id": "ger", "x": 80, "y": 320}
+        ],
+        "paths": [{"points": [[0, 350], [600, 350], [600, 380], [0, 380]], "color": "lightgray"}]
+    }
+}, ensure_ascii=False)
+
+SAMPLE_INPUTS = [
+    ("Gräsmatta med ett äppelträd i mitten, staket mot norr, soligt.", "Växtzon 3, Uppsala", "Ätbart och lättskött, gärna en bänk."),
+    ("Stenlagd uteplats, smal rabatt längs husväggen, halvskugga.", "Växtzon 1, Malmö", "Modernt, mycket grönt och lite blommor."),
+    ("Ingen bildanalys utförd (ingen bild skickad).", "Växtzon 5, Sundsvall", "Pollinatörsvänligt och tåligt."),
+]
+
+
+def _recorded_response() -> str:
+    return RECORDED_CATALOG_RESPONSE if prompts.design_uses_catalog() else RECORDED_RESPONSE
+
+
+class RecordedFakeModel:
+    def __init__(self, model_id, generation_config=None, system_instruction=None, args=None):
+        self.system_instruction = system_instruction
+        self.args = args
+
+    async def generate_content_async(self, contents, stream=False):
+        static_tokens = prompts.estimate_tokens(self.system_instruction or "")
+        dynamic_tokens = prompts.estimate_tokens(contents if isinstance(contents, str) else str(contents))
+        cached_tokens = static_tokens if self.args.cached_prefix else 0
+        uncached_tokens = static_tokens + dynamic_tokens - cached_tokens
+        text = _recorded_response()
+        latency_ms = (
+            self.args.base_ms
+            + uncached_tokens * self.args.prefill_ms_per_token
+            + cached_tokens * self.args.cached_ms_per_token
+            + prompts.estimate_tokens(text) * self.args.output_ms_per_token
+        )
+        await asyncio.sleep(latency_ms / 1000)
+        part = SimpleNamespace(text=text)
+        return SimpleNamespace(
+            candidates=[SimpleNamespace(content=SimpleNamespace(parts=[part]))],
+            usage_metadata=SimpleNamespace(
+                prompt_token_count=static_tokens + dynamic_tokens,
+                cached_content_token_count=cached_tokens
+            )
+        )
+
+
+async def _run_version(version: str, args) -> dict:
+    prompts.DESIGN_PROMPT_TEMPLATE = version
+    llm_clients.GenerativeModel = lambda model_id, **kw: RecordedFakeModel(model_id, args=args, **kw)
+    llm_clients.registry = llm_clients.ClientRegistry()
+    llm_services.llm_clients.registry = llm_clients.registry
+
+    build_times, latencies, input_tokens = [], [], []
+    for i in range(args.runs):
+        analysis, location, preferences = SAMPLE_INPUTS[i % len(SAMPLE_INPUTS)]
+        started = time.perf_counter()
+        prompt = prompts.build_design_prompt(analysis, location, preferences)
+        build_times.append((time.perf_counter() - started) * 1e6)
+        input_tokens.append(prompts.estimate_tokens(prompt) + prompts.estimate_tokens(prompts.design_system_prompt() or ""))
+
+        started = time.perf_counter()
+        result = await llm_services._design_with_model("fake-gemini", prompt, llm_services._design_expander(location))
+        latencies.append((time.perf_counter() - started) * 1000)
+    return {
+        "version": version,
+        "tokens": statistics.mean(input_tokens),
+        "output_tokens": prompts.estimate_tokens(_recorded_response()),
+        "plants": len(result.garden_plan_data.plants),
+        "static": prompts.estimate_tokens(prompts.design_system_prompt() or ""),
+        "build_us": statistics.median(build_times),
+        "p50_ms": statistics.median(latencies),
+        "max_ms": max(latencies),
+    }
+
+
+async def run(args):
+    plant_catalog.catalog.load() # Som vid start (startup.py), så att inläsningen inte räknas in i byggtiden
+    results = [await _run_version(v.strip(), args) for v in args.versions.split(",") if v.strip()]
+    print(f"{'prompt':<7} {'indatatokens':>12} {'varav mall':>10} {'utdatatokens':>12} {'växter':>6} {'bygga (µs)':>11} {'latens p50 (ms)':>16} {'max (ms)':>9}")
+    for r in results:
+        print(f"{r['version']:<7} {r['tokens']:>12.0f} {r['static']:>10} {r['output_tokens']:>12} {r['plants']:>6} "
+              f"{r['build_us']:>11.1f} {r['p50_ms']:>16.1f} {r['max_ms']:>9.1f}")
+    old, new = results[0], results[-1]
+    print(f"\n{old['version']} -> {new['version']}: indatatokens per anrop {old['tokens']:.0f} -> {new['tokens']:.0f}; "
+          f"nya (ej cachade) tokens: {old['tokens']:.0f} -> {new['tokens'] - (new['static'] if args.cached_prefix else 0):.0f}; "
+          f"utdatatokens {old['output_tokens']} -> {new['output_tokens']}")
+    print(f"Latens p50: {old['p50_ms']:.1f} -> {new['p50_ms']:.1f} ms")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--runs", type=int, default=20)
+    parser.add_argument("--base-ms", type=float, default=50.0, help="Fast del av fejkmodellens latens")
+    parser.add_argument("--prefill-ms-per-token", type=float, default=0.4, help="Kostnad per ej cachad indatatoken")
+    parser.add_argument("--cached-ms-per-token", type=float, default=0.05, help="Kostnad per token i cachat prefix")
+    parser.add_argument("--output-ms-per-token", type=float, default=10.0, help="Kostnad per utdatatoken (avkodning)")
+    parser.add_argument("--versions", default="v1,v2,v3", help="Promptversioner att jämföra, den första mot den sista")
+    parser.add_argument("--cached-prefix", action="store_true", help="Räkna mallen som cachat kontext")
+    asyncio.run(run(parser.parse_args()))
+
+
+if __name__ == "__main__":
+    main()
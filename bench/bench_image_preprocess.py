@@ -0,0 +1,115 @@
+"""Mäter bildförbehandlingen (backend/image_processing.py) på en uppsättning foton.
+
+Användning:
+    python -m bench.bench_image_preprocess [katalog-med-foton] [--uplink-mbps 10] [--storage-rtt-ms 40] [--vision-ms-per-mb 150]
+
+Utan katalog genereras syntetiska "mobilfoton" (4032x3024 JPEG med EXIF-rotation).
+Rapporten visar sparade bytes och den uppmätta latensen för bildens väg fram till Storage:
+upload_image_bytes med originalet mot preprocess_image_async plus upload_image_bytes med den
+förbehandlade bilden. Supabase är utbytt mot FakeSupabase (bench/fakes.py) med fast uplink
+(--uplink-mbps) och fast svarstid per anrop (--storage-rtt-ms), så skillnaden är mätt mot den
+bandbredden och inte mot ett riktigt nät. Vunnen modelltid hos Vertex mäts inte; den visas i en
+egen kolumn som en uppskattning (--vision-ms-per-mb) och ingår inte i den uppmätta skillnaden.
+"""
+import argparse
+import asyncio
+import io
+import os
+import statistics
+import sys
+import time
+
+from PIL import Image
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from backend import image_processing, supabase_services  # noqa: E402
+from bench import fakes  # noqa: E402
+
+
+def _synthetic_photos(count: int = 5):
+    photos = []
+    for i in range(count):
+        size = (4032, 3024)
+        noise = Image.effect_noise(size, 40 + i * 10).convert("RGB")
+        gradient = Image.linear_gradient("L").resize(size).convert("RGB")
+        img = Image.blend(noise, gradient, 0.5)
+        exif = Image.Exif()
+        exif[0x0112] = 6 # Orientation: roterad 90°, som från en mobilkamera
+        buffer = io.BytesIO()
+        img.save(buffer, format="JPEG", quality=95, exif=exif)
+        photos.append((f"syntetisk_{i}.jpg", buffer.getvalue(), "image/jpeg"))
+    return photos
+
+
+def _load_photos(directory: str):
+    photos = []
+    for name in sorted(os.listdir(directory)):
+        ext = os.path.splitext(name)[1].lower()
+        mime = {".jpg": "image/jpeg", ".jpeg": "image/jpeg", ".png": "image/png", ".webp": "image/webp"}.get(ext)
+        if mime:
+            with open(os.path.join(directory, name), "rb") as f:
+                photos.append((name, f.read(), mime))
+    return photos
+
+
+async def _measure(name: str, data: bytes, mime: str) -> tuple:
+    # Samma steg som advice_pipeline: förbehandling i trådpoolen och sedan uppladdning via trådpoolen
+    # i supabase_services. Unika filnamn så att uppladdningscachen aldrig träffar.
+    stem = os.path.splitext(name)[0]
+    started = time.perf_counter()
+    await supabase_services.upload_image_bytes(data, mime, f"bench_original_{stem}_{time.time_ns()}")
+    original_ms = (time.perf_counter() - started) * 1000
+
+    started = time.perf_counter()
+    result = await image_processing.preprocess_image_async(data, mime)
+    preprocess_ms = (time.perf_counter() - started) * 1000
+    await supabase_services.upload_image_bytes(result.data, result.mime_type, f"bench_processed_{stem}_{time.time_ns()}")
+    processed_ms = (time.perf_counter() - started) * 1000
+    return result, original_ms, preprocess_ms, processed_ms
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("directory", nargs="?")
+    parser.add_argument("--uplink-mbps", type=float, default=10.0, help="Fast uppladdningshastighet i FakeSupabase")
+    parser.add_argument("--storage-rtt-ms", type=float, default=40.0, help="Fast svarstid per Storage-anrop i FakeSupabase")
+    parser.add_argument("--vision-ms-per-mb", type=float, default=150.0, help="Antagen extra modelltid per MB bild (bara uppskattning)")
+    args = parser.parse_args()
+
+    photos = _load_photos(args.directory) if args.directory else _synthetic_photos()
+    if not photos:
+        print("Inga bilder hittades.")
+        return
+
+    import logging
+    logging.getLogger("backend").setLevel(logging.WARNING)
+    fakes.install(storage=fakes.FakeSupabase(latency=f"fixed:{args.storage_rtt_ms}", bytes_per_ms=args.uplink_mbps * 1_000_000 / 8 / 1000))
+
+    print(f"max_edge={image_processing.IMAGE_MAX_EDGE_PX}px format={image_processing.IMAGE_OUTPUT_FORMAT} quality={image_processing.IMAGE_OUTPUT_QUALITY}")
+    print(f"uplink {args.uplink_mbps:g} Mbit/s, Storage {args.storage_rtt_ms:g} ms per anrop (FakeSupabase)")
+    print(f"{'bild':<24}{'före (kB)':>10}{'efter (kB)':>11}{'sparat':>8}{'förbeh. (ms)':>13}"
+          f"{'upload orig. (ms)':>18}{'förbeh.+upload (ms)':>20}{'Δ mätt (ms)':>12}{'Δ modell, uppsk. (ms)':>22}")
+    measured, estimated, saved_total, original_total = [], [], 0, 0
+    for name, data, mime in photos:
+        result, original_ms, preprocess_ms, processed_ms = asyncio.run(_measure(name, data, mime))
+        saved = result.original_size - len(result.data)
+        delta_ms = processed_ms - original_ms
+        vision_delta_ms = -saved / 1_000_000 * args.vision_ms_per_mb
+        measured.append(delta_ms)
+        estimated.append(vision_delta_ms)
+        saved_total += saved
+        original_total += result.original_size
+        print(f"{name[:23]:<24}{result.original_size / 1000:>10.0f}{len(result.data) / 1000:>11.0f}"
+              f"{saved / result.original_size:>8.0%}{preprocess_ms:>13.0f}{original_ms:>18.0f}{processed_ms:>20.0f}"
+              f"{delta_ms:>12.0f}{vision_delta_ms:>22.0f}")
+
+    print(f"\nTotalt sparat: {saved_total / 1_000_000:.1f} MB av {original_total / 1_000_000:.1f} MB "
+          f"({saved_total / original_total:.0%}). Median Δ mätt (förbehandling + uppladdning): "
+          f"{statistics.median(measured):.0f} ms; uppskattad Δ modelltid: {statistics.median(estimated):.0f} ms "
+          f"(negativt = snabbare).")
+    image_processing.shutdown()
+
+
+if __name__ == "__main__":
+    main()
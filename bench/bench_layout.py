@@ -0,0 +1,73 @@
+"""Mäter layoutlagningen (backend/layout.py) mot tidsbudgeten LAYOUT_TIME_BUDGET_MS.
+
+Användning:
+    python -m bench.bench_layout [--sizes 100,1000,3000,5000] [--oversized 0,5,50] [--repeat 3]
+
+För varje antal växter och antal stora växter (träd på 4–9 m bland perenner på 20–80 cm)
+genereras en slumpad plan på 30 x 20 m med en gång tvärs över. Rapporten visar konflikter före
+och efter, antal varv och den längsta tiden av --repeat körningar; "inom budget" är nej om
+någon körning tog längre än budgeten.
+"""
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import numpy as np  # noqa: E402
+
+from backend import layout  # noqa: E402
+from backend.models import GardenPlanData, PathData, PlantData  # noqa: E402
+
+WIDTH_CM = 3000
+HEIGHT_CM = 2000
+
+
+def _plan(size: int, oversized: int, seed: int) -> GardenPlanData:
+    rng = np.random.default_rng(seed)
+    plants = [
+        PlantData(
+            name=f"Växt {i}",
+            x=int(rng.uniform(0, WIDTH_CM)),
+            y=int(rng.uniform(0, HEIGHT_CM)),
+            diameter=int(rng.uniform(400, 900)) if i < oversized else int(rng.choice([20, 30, 40, 60, 80]))
+        )
+        for i in range(size)
+    ]
+    path = PathData(points=[(0, HEIGHT_CM // 2 - 50), (WIDTH_CM, HEIGHT_CM // 2 - 50), (WIDTH_CM, HEIGHT_CM // 2 + 50), (0, HEIGHT_CM // 2 + 50)])
+    return GardenPlanData(area_width_cm=WIDTH_CM, area_height_cm=HEIGHT_CM, plants=plants, paths=[path])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", default="100,1000,3000,5000")
+    parser.add_argument("--oversized", default="0,5,50", help="Antal stora växter per plan")
+    parser.add_argument("--repeat", type=int, default=3, help="Körningar per storlek (olika slumpfrön)")
+    args = parser.parse_args()
+
+    import logging
+    logging.getLogger("backend.layout").setLevel(logging.WARNING)
+    layout.repair_plan(_plan(100, 1, 0)) # Uppvärmning av NumPy
+
+    print(f"budget {layout.LAYOUT_TIME_BUDGET_MS:.0f} ms")
+    print(f"{'växter':>7} {'stora':>6} {'före':>7} {'efter':>7} {'varv':>5} {'max (ms)':>9} {'inom budget':>12}")
+    for size in (int(s) for s in args.sizes.split(",")):
+        for oversized in (int(s) for s in args.oversized.split(",")):
+            if oversized > size:
+                continue
+            worst_ms = 0.0
+            for seed in range(args.repeat):
+                plan = _plan(size, oversized, seed)
+                started = time.perf_counter()
+                report = layout.repair_plan(plan)
+                worst_ms = max(worst_ms, (time.perf_counter() - started) * 1000)
+            within = worst_ms <= layout.LAYOUT_TIME_BUDGET_MS
+            print(
+                f"{size:>7} {oversized:>6} {report.conflicts_found:>7} {report.conflicts_remaining:>7} "
+                f"{report.iterations:>5} {worst_ms:>9.1f} {'ja' if within else 'NEJ':>12}"
+            )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,107 @@
+"""Kör llm_guard (adaptiv gräns + circuit breaker) mot en lokal fejkmodell med inlagd latens och fel.
+
+Användning:
+    python -m bench.bench_llm_guard [--clients 40] [--capacity 8] [--latency-ms 200] [--phase-s 3]
+
+Fejkmodellen klarar --capacity samtidiga anrop; över det växer latensen och en del anrop får 429.
+Körningen går i tre faser: frisk, avbrott (alla anrop 503) och återhämtning. Varje halvsekund
+skrivs gräns, pågående anrop, breakerläge och utfall ut, så att man ser gränsen sjunka vid
+överbelastning, breakern slå ifrån under avbrottet och provanropet stänga den igen.
+"""
+import argparse
+import asyncio
+import collections
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# Korta tider så att hela förloppet syns på några sekunder (kan skrivas över med miljövariabler).
+os.environ.setdefault("LLM_DESIGN_LATENCY_TARGET_S", "0.5")
+os.environ.setdefault("LLM_LIMIT_MAX_WAIT_S", "1")
+os.environ.setdefault("LLM_BREAKER_OPEN_S", "1")
+os.environ.setdefault("LLM_BREAKER_MIN_CALLS", "10")
+
+from backend import llm_guard  # noqa: E402
+
+MODEL_ID = "fake-gemini"
+
+
+class FakeVertexError(Exception):
+    def __init__(self, code: int):
+        super().__init__(f"{code} från fejkmodellen")
+        self.code = code
+
+
+class FakeModel:
+    def __init__(self, capacity: int, latency_s: float):
+        self.capacity = capacity
+        self.latency_s = latency_s
+        self.outage = False
+        self.active = 0
+
+    async def generate_content_async(self, prompt):
+        self.active += 1
+        try:
+            if self.outage:
+                await asyncio.sleep(self.latency_s / 4)
+                raise FakeVertexError(503)
+            overload = max(0, self.active - self.capacity) / self.capacity
+            if overload and random.random() < min(0.9, overload):
+                raise FakeVertexError(429)
+            await asyncio.sleep(self.latency_s * (1 + overload) * random.uniform(0.8, 1.2))
+            return "ok"
+        finally:
+            self.active -= 1
+
+
+async def _client(model: FakeModel, guard: llm_guard.LLMGuard, outcomes: collections.Counter, stop_at: float):
+    while time.monotonic() < stop_at:
+        try:
+            async with guard.call(MODEL_ID):
+                await model.generate_content_async("hej")
+            outcomes["ok"] += 1
+        except llm_guard.CircuitOpenError:
+            outcomes["circuit_open"] += 1
+            await asyncio.sleep(0.05)
+        except llm_guard.LimiterTimeoutError:
+            outcomes["limit"] += 1
+        except FakeVertexError as e:
+            outcomes[str(e.code)] += 1
+
+
+async def run(args):
+    model = FakeModel(args.capacity, args.latency_ms / 1000)
+    guard = llm_guard.design_guard
+    outcomes = collections.Counter()
+    started = time.monotonic()
+    stop_at = started + 3 * args.phase_s
+    clients = [asyncio.create_task(_client(model, guard, outcomes, stop_at)) for _ in range(args.clients)]
+
+    print(f"{'t(s)':>5} {'fas':<14} {'gräns':>5} {'pågår':>5} {'väntar':>6} {'breaker':<10} utfall")
+    while time.monotonic() < stop_at:
+        elapsed = time.monotonic() - started
+        phase = "frisk" if elapsed < args.phase_s else "avbrott" if elapsed < 2 * args.phase_s else "återhämtning"
+        model.outage = phase == "avbrott"
+        limiter = guard.limiter.status()
+        breaker = llm_guard.get_breaker(MODEL_ID).status()
+        print(f"{elapsed:5.1f} {phase:<14} {limiter['limit']:>5} {limiter['inflight']:>5} {limiter['waiting']:>6} {breaker['state']:<10} {dict(outcomes)}")
+        outcomes.clear()
+        await asyncio.sleep(0.5)
+
+    await asyncio.gather(*clients, return_exceptions=True)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--clients", type=int, default=40, help="Antal samtidiga klienter")
+    parser.add_argument("--capacity", type=int, default=8, help="Samtidiga anrop fejkmodellen klarar")
+    parser.add_argument("--latency-ms", type=float, default=200.0, help="Fejkmodellens latens utan överlast")
+    parser.add_argument("--phase-s", type=float, default=3.0, help="Längd på varje fas")
+    asyncio.run(run(parser.parse_args()))
+
+
+if __name__ == "__main__":
+    main()
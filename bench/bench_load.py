@@ -0,0 +1,468 @@
+"""Lasttest av /get_advice och /get_advice/stream med fejkad Vertex AI och Supabase, utan nätverk.
+
+Användning:
+    python -m bench.bench_load [--rps 4] [--duration 30] [--warmup 5] [--mix advice=3,stream=1]
+        [--corpus katalog] [--unique] [--vision-latency lognormal:1200:0.3]
+        [--design-latency lognormal:6000:0.35] [--error-rate 0.02] [--plants 12]
+        [--storage-latency uniform:20:60] [--tiers fake-gemini-pro,fake-gemini-flash]
+        [--save-baseline fil.json] [--baseline fil.json]
+    python -m bench.bench_load --url http://127.0.0.1:8000 ...   # mot en redan startad server
+
+Appen startas med uvicorn i en egen process där fejkerna i bench/fakes.py är inkopplade, så att
+lastgeneratorn inte delar event-loop med den. Generatorn skickar förfrågningar i jämn takt
+(--poisson för slumpade ankomster) oberoende av svaren; blir fler än --max-in-flight obesvarade
+räknas nya som tappade. De första --warmup sekunderna räknas inte.
+
+Korpusen är en katalog med submissions.jsonl, en rad per formulär:
+    {"location": "Växtzon 3, Uppsala", "preferences": "Ätbart och lättskött", "image": "bild1.jpg"}
+där "image" är en fil i katalogen eller null. Utan --corpus används några inbyggda formulär och
+syntetiska mobilfoton (--photos styr hur många olika). Med --unique får varje förfrågan egna
+önskemål, så att delade designanrop inte döljer kostnaden för nya användare. Bildanalysen cachas
+per bild som i drift; fler olika foton ger fler analyser.
+
+Rapporten visar p50/p95/p99 per endpoint, genomströmning, fel, serverns event-loop-fördröjning
+och minne. --save-baseline sparar resultatet som JSON och --baseline jämför mot en sparad körning;
+bench/baselines/load_default.json är en körning med standardinställningarna och --seed 1 på en
+utvecklingsmaskin; latenserna beror på maskinen, så jämför helst mot en baslinje från samma maskin.
+
+--tiers är modellnivåerna som i GEMINI_MODEL_TIERS, alla fejkade. Med bara en nivå har
+llm_hedge.hedged_call inget att hedga eller falla tillbaka på, så ett injicerat fel (--error-rate)
+blir 503 för förfrågan och för alla som delar samma designanrop via single_flight.
+"""
+import argparse
+import asyncio
+import json
+import math
+import os
+import random
+import socket
+import subprocess
+import sys
+import time
+from collections import Counter, deque
+from typing import Dict, List, Optional, Tuple
+
+import httpx
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+DEFAULT_SUBMISSIONS = [
+    ("Växtzon 3, Uppsala", "Ätbart och lättskött, gärna en bänk.", True),
+    ("Växtzon 1, Malmö", "Modernt, mycket grönt och lite blommor.", True),
+    ("Växtzon 5, Sundsvall", "Pollinatörsvänligt och tåligt.", False),
+    ("Växtzon 2, Göteborg", "Skuggtåligt under stora träd.", True),
+]
+
+Submission = Tuple[str, str, Optional[Tuple[str, bytes, str]]] # (plats, önskemål, (filnamn, bytes, MIME) eller None)
+
+
+def _percentile(ordered: List[float], q: float) -> Optional[float]:
+    # Närmaste rang, så att p99 av få värden blir det största snarare än en interpolation.
+    if not ordered:
+        return None
+    return ordered[min(len(ordered) - 1, max(0, math.ceil(q * len(ordered)) - 1))]
+
+
+def _summary(values: List[float]) -> dict:
+    ordered = sorted(values)
+    return {
+        "count": len(ordered),
+        "p50": _percentile(ordered, 0.50),
+        "p95": _percentile(ordered, 0.95),
+        "p99": _percentile(ordered, 0.99),
+        "max": ordered[-1] if ordered else None,
+    }
+
+
+# ---------------------------------------------------------------- Servern (körs med --serve)
+
+class _LoopMonitor:
+    """Mäter hur sent event-loopen vaknar efter en kort sleep, och processens minne."""
+
+    def __init__(self, vertex, storage, interval_s: float = 0.05):
+        self.vertex = vertex
+        self.storage = storage
+        self.interval_s = interval_s
+        self.lags_ms = deque(maxlen=200000)
+        self._task: Optional[asyncio.Task] = None
+
+    async def _run(self):
+        while True:
+            started = time.perf_counter()
+            await asyncio.sleep(self.interval_s)
+            self.lags_ms.append(max(0.0, (time.perf_counter() - started - self.interval_s) * 1000))
+
+    @staticmethod
+    def _memory_mb() -> Dict[str, float]:
+        memory = {}
+        try:
+            with open("/proc/self/status") as status:
+                for line in status:
+                    if line.startswith(("VmRSS:", "VmHWM:")):
+                        memory["rss_mb" if line.startswith("VmRSS") else "peak_rss_mb"] = int(line.split()[1]) / 1024
+        except OSError:
+            pass
+        return memory
+
+    async def stats(self, reset: bool = False):
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+        if reset:
+            self.lags_ms.clear()
+            try:
+                with open("/proc/self/clear_refs", "w") as clear_refs:
+                    clear_refs.write("5") # Nollställer VmHWM (topp-RSS)
+            except OSError:
+                pass
+        return {
+            "loop_lag_ms": _summary(list(self.lags_ms)),
+            **self._memory_mb(),
+            "vertex_calls": dict(self.vertex.calls),
+            "stored_images": len(self.storage.objects),
+            "stored_designs": len(self.storage.tables.get("garden_designs", [])),
+        }
+
+
+def _serve(args):
+    import uvicorn
+    from bench import fakes
+    from backend import main as app_main
+
+    vertex = fakes.FakeVertex(fakes.FakeVertexProfile(
+        vision_latency=args.vision_latency,
+        design_latency=args.design_latency,
+        error_rate=args.error_rate,
+        plants=args.plants,
+        stream_chunks=args.stream_chunks,
+        seed=args.seed,
+    ))
+    storage = fakes.FakeSupabase(latency=args.storage_latency)
+    fakes.install(vertex, storage, tiers=[t.strip() for t in args.tiers.split(",") if t.strip()])
+    monitor = _LoopMonitor(vertex, storage)
+    app_main.app.add_api_route("/_bench/stats", monitor.stats, methods=["GET"])
+    uvicorn.run(app_main.app, host="127.0.0.1", port=args.port, log_level="warning")
+
+
+def _free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def _start_server(args) -> Tuple[subprocess.Popen, str]:
+    port = _free_port()
+    command = [
+        sys.executable, "-m", "bench.bench_load", "--serve", "--port", str(port),
+        "--vision-latency", args.vision_latency, "--design-latency", args.design_latency,
+        "--error-rate", str(args.error_rate), "--plants", str(args.plants),
+        "--stream-chunks", str(args.stream_chunks), "--storage-latency", args.storage_latency,
+        "--tiers", args.tiers,
+    ]
+    if args.seed is not None:
+        command += ["--seed", str(args.seed)]
+    env = {**os.environ, "PYTHONPATH": ROOT}
+    for name in ("GOOGLE_PROJECT_ID", "GOOGLE_LOCATION", "SUPABASE_URL", "SUPABASE_KEY"):
+        env.pop(name, None) # Inget riktigt konto får användas av misstag
+    with open(args.server_log, "w") as log:
+        process = subprocess.Popen(command, cwd=ROOT, env=env, stdout=log, stderr=log)
+    return process, f"http://127.0.0.1:{port}"
+
+
+# ---------------------------------------------------------------- Korpus och lastgenerator
+
+def _load_corpus(directory: Optional[str], photos: int) -> List[Submission]:
+    if directory is None:
+        from bench.bench_image_preprocess import _synthetic_photos
+
+        if photos <= 0:
+            # Bara formulären utan bild
+            return [(location, preferences, None) for location, preferences, with_image in DEFAULT_SUBMISSIONS if not with_image]
+        photos = _synthetic_photos(photos)
+        # Varje formulär med bild förekommer en gång per foto.
+        return [
+            (location, preferences, photo if with_image else None)
+            for photo in photos
+            for location, preferences, with_image in DEFAULT_SUBMISSIONS
+        ]
+    submissions = []
+    with open(os.path.join(directory, "submissions.jsonl"), encoding="utf-8") as f:
+        for line in f:
+            if not line.strip():
+                continue
+            entry = json.loads(line)
+            image = None
+            if entry.get("image"):
+                name = entry["image"]
+                ext = os.path.splitext(name)[1].lower()
+                mime = {".jpg": "image/jpeg", ".jpeg": "image/jpeg", ".png": "image/png", ".webp": "image/webp"}.get(ext, "application/octet-stream")
+                with open(os.path.join(directory, name), "rb") as image_file:
+                    image = (os.path.basename(name), image_file.read(), mime)
+            submissions.append((entry["location"], entry["preferences"], image))
+    if not submissions:
+        sys.exit(f"Korpusen i {directory} är tom.")
+    return submissions
+
+
+def _parse_mix(spec: str) -> List[Tuple[str, float]]:
+    mix = []
+    for part in spec.split(","):
+        name, _, weight = part.partition("=")
+        if name not in ("advice", "stream"):
+            sys.exit(f"Okänd endpoint i --mix: {name} (advice eller stream)")
+        mix.append((name, float(weight or 1)))
+    return mix
+
+
+class _Load:
+    def __init__(self, args, corpus: List[Submission], client: httpx.AsyncClient):
+        self.args = args
+        self.corpus = corpus
+        self.client = client
+        self.mix = _parse_mix(args.mix)
+        self.rng = random.Random(args.seed)
+        self.sequence = 0
+        self.in_flight = 0
+        self.reset()
+
+    def reset(self):
+        self.latencies: Dict[str, List[float]] = {name: [] for name, _ in self.mix}
+        self.first_text: List[float] = []
+        self.outcomes: Counter = Counter()
+        self.sent = 0
+        self.dropped = 0
+        self.schedule_slip_ms: List[float] = []
+
+    def _form(self) -> Tuple[dict, Optional[dict]]:
+        location, preferences, image = self.corpus[self.sequence % len(self.corpus)]
+        self.sequence += 1
+        if self.args.unique:
+            preferences = f"{preferences} [{self.sequence}]"
+        files = {"imageFile": image} if image is not None else None
+        return {"location": location, "preferences": preferences}, files
+
+    async def _advice(self, data: dict, files: Optional[dict]) -> str:
+        response = await self.client.post("/get_advice", data=data, files=files)
+        return str(response.status_code)
+
+    async def _stream(self, data: dict, files: Optional[dict], started: float) -> str:
+        outcome = "no_done"
+        async with self.client.stream("POST", "/get_advice/stream", data=data, files=files) as response:
+            if response.status_code != 200:
+                return str(response.status_code)
+            first_text_seen = False
+            async for line in response.aiter_lines():
+                if line == "event: text_advice" and not first_text_seen:
+                    first_text_seen = True
+                    self.first_text.append((time.perf_counter() - started) * 1000)
+                elif line == "event: error":
+                    outcome = "sse_error"
+                elif line == "event: done":
+                    outcome = "200"
+        return outcome
+
+    async def _one(self, kind: str):
+        data, files = self._form()
+        self.in_flight += 1
+        started = time.perf_counter()
+        try:
+            if kind == "stream":
+                outcome = await self._stream(data, files, started)
+            else:
+                outcome = await self._advice(data, files)
+        except httpx.TimeoutException:
+            outcome = "timeout"
+        except httpx.TransportError as e:
+            outcome = type(e).__name__
+        finally:
+            self.in_flight -= 1
+        self.outcomes[f"{kind}:{outcome}"] += 1
+        if outcome == "200":
+            self.latencies[kind].append((time.perf_counter() - started) * 1000)
+
+    async def run(self, seconds: float) -> float:
+        """Skickar i --rps under seconds sekunder och väntar in svaren. Returnerar tiden till sista svaret."""
+        names = [name for name, _ in self.mix]
+        weights = [weight for _, weight in self.mix]
+        tasks = set()
+        started = time.perf_counter()
+        next_at = started
+        while next_at - started < seconds:
+            delay = next_at - time.perf_counter()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            self.schedule_slip_ms.append(max(0.0, (time.perf_counter() - next_at) * 1000))
+            if self.in_flight >= self.args.max_in_flight:
+                self.dropped += 1
+            else:
+                self.sent += 1
+                task = asyncio.create_task(self._one(self.rng.choices(names, weights)[0]))
+                tasks.add(task)
+                task.add_done_callback(tasks.discard)
+            gap = self.rng.expovariate(self.args.rps) if self.args.poisson else 1 / self.args.rps
+            next_at += gap
+        if tasks:
+            await asyncio.wait(tasks)
+        return time.perf_counter() - started
+
+
+async def _wait_ready(client: httpx.AsyncClient, timeout_s: float, process: Optional[subprocess.Popen]):
+    deadline = time.perf_counter() + timeout_s
+    while time.perf_counter() < deadline:
+        if process is not None and process.poll() is not None:
+            raise RuntimeError("Servern avslutades under start, se --server-log.")
+        try:
+            if (await client.get("/health/ready")).status_code == 200:
+                return
+        except httpx.TransportError:
+            pass
+        await asyncio.sleep(0.1)
+    raise RuntimeError(f"Servern blev inte redo inom {timeout_s:.0f}s.")
+
+
+async def _server_stats(client: httpx.AsyncClient, reset: bool = False) -> Optional[dict]:
+    try:
+        response = await client.get("/_bench/stats", params={"reset": "true"} if reset else None)
+        return response.json() if response.status_code == 200 else None
+    except httpx.TransportError:
+        return None
+
+
+async def _measure(args, base_url: str, corpus: List[Submission], process: Optional[subprocess.Popen]) -> dict:
+    limits = httpx.Limits(max_connections=args.max_in_flight + 4, max_keepalive_connections=args.max_in_flight + 4)
+    async with httpx.AsyncClient(base_url=base_url, timeout=args.timeout, limits=limits) as client:
+        await _wait_ready(client, 60, process)
+        load = _Load(args, corpus, client)
+        if args.warmup > 0:
+            await load.run(args.warmup)
+        load.reset()
+        await _server_stats(client, reset=True)
+        total_s = await load.run(args.duration)
+        server = await _server_stats(client)
+
+    succeeded = sum(len(v) for v in load.latencies.values())
+    return {
+        "config": {
+            k: getattr(args, k) for k in (
+                "rps", "duration", "mix", "unique", "photos", "corpus", "poisson", "max_in_flight", "vision_latency",
+                "design_latency", "error_rate", "plants", "storage_latency", "tiers", "seed"
+            )
+        },
+        "sent": load.sent,
+        "dropped": load.dropped,
+        "succeeded": succeeded,
+        "outcomes": dict(load.outcomes),
+        "throughput_rps": succeeded / total_s if total_s else 0.0,
+        "latency_ms": {kind: _summary(values) for kind, values in load.latencies.items()},
+        "stream_first_text_ms": _summary(load.first_text),
+        "generator_slip_ms": _summary(load.schedule_slip_ms),
+        "server": server,
+    }
+
+
+# ---------------------------------------------------------------- Rapport
+
+def _ms(value: Optional[float]) -> str:
+    return f"{value:9.1f}" if value is not None else f"{'-':>9}"
+
+
+def _print_report(result: dict):
+    print(f"Skickade {result['sent']}, lyckade {result['succeeded']}, tappade {result['dropped']} "
+          f"(genomströmning {result['throughput_rps']:.2f} lyckade/s)")
+    print("Utfall: " + ", ".join(f"{k}={v}" for k, v in sorted(result["outcomes"].items())))
+    print(f"\n{'latens (ms)':<24} {'antal':>6} {'p50':>9} {'p95':>9} {'p99':>9} {'max':>9}")
+    rows = [("/get_advice" if kind == "advice" else "/get_advice/stream", s) for kind, s in result["latency_ms"].items()]
+    if result["stream_first_text_ms"]["count"]:
+        rows.append(("stream, första text", result["stream_first_text_ms"]))
+    rows.append(("generatorns eftersläp", result["generator_slip_ms"]))
+    server = result.get("server")
+    if server:
+        rows.append(("serverns loop-lag", server["loop_lag_ms"]))
+    for label, s in rows:
+        print(f"{label:<24} {s['count']:>6} {_ms(s['p50'])} {_ms(s['p95'])} {_ms(s['p99'])} {_ms(s['max'])}")
+    if server:
+        print(f"\nServer: RSS {server.get('rss_mb', 0):.0f} MB (topp {server.get('peak_rss_mb', 0):.0f} MB), "
+              f"Vertex-anrop {server['vertex_calls']}, bilder i Storage {server['stored_images']}, "
+              f"sparade designer {server['stored_designs']}")
+
+
+def _flatten(result: dict) -> Dict[str, float]:
+    metrics = {"throughput_rps": result["throughput_rps"]}
+    for kind, s in result["latency_ms"].items():
+        for q in ("p50", "p95", "p99"):
+            if s[q] is not None:
+                metrics[f"{kind}_{q}_ms"] = s[q]
+    if result.get("server"):
+        metrics["loop_lag_p99_ms"] = result["server"]["loop_lag_ms"]["p99"] or 0.0
+        metrics["peak_rss_mb"] = result["server"].get("peak_rss_mb", 0.0)
+    return metrics
+
+
+def _compare(result: dict, baseline_path: str):
+    with open(baseline_path, encoding="utf-8") as f:
+        baseline = json.load(f)
+    if baseline.get("config") != result["config"]:
+        print(f"\nObs: baslinjen kördes med andra inställningar: {baseline.get('config')}")
+    old, new = _flatten(baseline), _flatten(result)
+    print(f"\n{'mot baslinje':<24} {'före':>10} {'nu':>10} {'ändring':>9}")
+    for name in sorted(old.keys() & new.keys()):
+        change = (new[name] - old[name]) / old[name] if old[name] else 0.0
+        print(f"{name:<24} {old[name]:>10.1f} {new[name]:>10.1f} {change:>+9.1%}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rps", type=float, default=4.0)
+    parser.add_argument("--duration", type=float, default=30.0, help="Mätfasens längd (s)")
+    parser.add_argument("--warmup", type=float, default=5.0, help="Uppvärmning som inte räknas (s)")
+    parser.add_argument("--mix", default="advice=3,stream=1", help="Vikter per endpoint (advice, stream)")
+    parser.add_argument("--poisson", action="store_true", help="Slumpade (Poisson-)ankomster i stället för jämn takt")
+    parser.add_argument("--max-in-flight", type=int, default=256)
+    parser.add_argument("--timeout", type=float, default=180.0, help="Klientens tidsgräns per förfrågan (s)")
+    parser.add_argument("--corpus", help="Katalog med submissions.jsonl och bilder")
+    parser.add_argument("--photos", type=int, default=3, help="Antal olika syntetiska foton utan --corpus (0: bara formulär utan bild)")
+    parser.add_argument("--unique", action="store_true", help="Egna önskemål per förfrågan (inga delade designanrop)")
+    parser.add_argument("--url", help="Kör mot en redan startad server i stället för att starta en med fejker")
+    parser.add_argument("--server-log", default=os.devnull, help="Serverns loggutskrifter")
+    parser.add_argument("--save-baseline", help="Spara resultatet som JSON")
+    parser.add_argument("--baseline", help="Jämför med ett sparat resultat")
+    parser.add_argument("--seed", type=int)
+    # Fejkerna (bench/fakes.py)
+    parser.add_argument("--vision-latency", default="lognormal:1200:0.3")
+    parser.add_argument("--design-latency", default="lognormal:6000:0.35")
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--plants", type=int, default=12)
+    parser.add_argument("--stream-chunks", type=int, default=20)
+    parser.add_argument("--storage-latency", default="uniform:20:60")
+    parser.add_argument("--tiers", default="fake-gemini-pro,fake-gemini-flash", help="Modellnivåer, som GEMINI_MODEL_TIERS")
+    parser.add_argument("--serve", action="store_true", help=argparse.SUPPRESS)
+    parser.add_argument("--port", type=int, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.serve:
+        _serve(args)
+        return
+
+    corpus = _load_corpus(args.corpus, args.photos)
+    process = None
+    base_url = args.url
+    if base_url is None:
+        process, base_url = _start_server(args)
+    try:
+        result = asyncio.run(_measure(args, base_url, corpus, process))
+    finally:
+        if process is not None:
+            process.terminate()
+            process.wait(timeout=30)
+
+    _print_report(result)
+    if args.baseline:
+        _compare(result, args.baseline)
+    if args.save_baseline:
+        with open(args.save_baseline, "w", encoding="utf-8") as f:
+            json.dump(result, f, ensure_ascii=False, indent=2)
+        print(f"\nResultatet sparat i {args.save_baseline}.")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,72 @@
+"""Jämför lagringen av planen i garden_designs: hela SVG-texten mot plan_data (backend/plan_storage.py).
+
+Användning:
+    python -m bench.bench_plan_storage [--sizes 7,50,1000,10000] [--repeat 3]
+
+För varje antal växter genereras en plan som i bench_svg_render. Rapporten visar bytes per rad
+för svg_plan och för plan-kolumnerna med kodningarna json och zlib, tiden att koda och läsa
+tillbaka planen, och tiden att rita SVG:n första gången mot en träff i LRU:n. Varje storlek
+kontrolleras också åt båda hållen: plan_data läses tillbaka till samma plan, och den sparade
+SVG:n tolkas (som i backfill-verktyget) till samma plan utom latinskt namn och höjd.
+"""
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from backend import plan_storage, svg_generator  # noqa: E402
+from bench.bench_svg_render import _plan  # noqa: E402
+
+
+def _row_bytes(columns: dict) -> int:
+    return sum(len(str(v).encode("utf-8")) for v in columns.values())
+
+
+def _best(func, repeat: int) -> float:
+    best = float("inf")
+    for _ in range(repeat):
+        started = time.perf_counter()
+        func()
+        best = min(best, time.perf_counter() - started)
+    return best * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", default="7,50,1000,10000")
+    parser.add_argument("--repeat", type=int, default=3, help="Bästa tid av så här många körningar")
+    args = parser.parse_args()
+
+    import logging
+    logging.getLogger("backend.svg_generator").setLevel(logging.WARNING)
+
+    print(f"{'växter':>7} {'svg (B/rad)':>12} {'json (B/rad)':>13} {'zlib (B/rad)':>13} {'koda (ms)':>10} {'läsa (ms)':>10} {'rita (ms)':>10} {'LRU (ms)':>9} {'tur och retur':>14}")
+    for size in (int(s) for s in args.sizes.split(",")):
+        plan = _plan(size)
+        # Namnen i _plan saknar latinskt namn och höjd, så tolkningen av SVG:n kan ge exakt samma plan.
+        plan_storage.svg_cache.clear()
+        svg = svg_generator.create_2d_garden_svg(plan)
+        as_json = plan_storage.encode_plan(plan, plan_storage.ENCODING_JSON)
+        as_zlib = plan_storage.encode_plan(plan, plan_storage.ENCODING_ZLIB)
+
+        encode_ms = _best(lambda: plan_storage.encode_plan(plan), args.repeat)
+        decode_ms = _best(lambda: plan_storage.decode_plan(as_zlib), args.repeat)
+        render_ms = _best(lambda: (plan_storage.svg_cache.clear(), plan_storage.render_svg(plan)), args.repeat)
+        plan_storage.render_svg(plan)
+        cached_ms = _best(lambda: plan_storage.render_svg(plan, as_zlib["plan_hash"]), args.repeat)
+
+        round_trip = (
+            plan_storage.decode_plan(as_json) == plan
+            and plan_storage.decode_plan(as_zlib) == plan
+            and plan_storage.parse_svg_plan(svg) == plan
+        )
+        print(
+            f"{size:>7} {len(svg.encode('utf-8')):>12} {_row_bytes(as_json):>13} {_row_bytes(as_zlib):>13} "
+            f"{encode_ms:>10.2f} {decode_ms:>10.2f} {render_ms:>10.2f} {cached_ms:>9.3f} {'ja' if round_trip else 'NEJ':>14}"
+        )
+
+
+if __name__ == "__main__":
+    main()
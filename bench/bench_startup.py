@@ -0,0 +1,135 @@
+"""Mäter appens kallstart: importtid för backend.main och tid tills servern svarar.
+
+Användning:
+    python -m bench.bench_startup [--runs 3] [--top 12] [--no-server]
+
+Importtiden mäts med "python -X importtime" i en ny process per körning och redovisas totalt
+och per toppnivåpaket (egen tid summerad). Servertiden mäts genom att starta uvicorn på en ledig
+port och fråga / (första 200) och /health/ready (redo) tills de svarar, räknat från att
+processen startades. Vertex-variablerna sätts till påhittade värden så att SDK:t laddas i
+bakgrunden som i drift; inga anrop till Google eller Supabase görs innan /health/ready.
+"""
+import argparse
+import os
+import socket
+import statistics
+import subprocess
+import sys
+import time
+from collections import defaultdict
+from typing import Dict, List, Optional, Tuple
+
+import httpx
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+ENV = {
+    **os.environ,
+    "GOOGLE_PROJECT_ID": os.getenv("GOOGLE_PROJECT_ID", "bench-project"),
+    "GOOGLE_LOCATION": os.getenv("GOOGLE_LOCATION", "europe-north1"),
+    "LLM_WARMUP_ENABLED": "false", # Uppvärmningen skulle försöka nå Vertex utan inloggning
+    "PYTHONPATH": ROOT,
+}
+
+
+def _import_times() -> Tuple[float, Dict[str, float]]:
+    """(total tid i sekunder, egen tid per toppnivåpaket) för en ny process som importerar backend.main."""
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", "import backend.main"],
+        cwd=ROOT, env=ENV, capture_output=True, text=True, check=True
+    )
+    per_package: Dict[str, float] = defaultdict(float)
+    total_us = 0
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "|" not in line:
+            continue
+        fields = line[len("import time:"):].split("|")
+        try:
+            self_us, cumulative_us = int(fields[0]), int(fields[1])
+        except ValueError:
+            continue # Rubrikraden
+        name = fields[2].strip()
+        per_package[name.split(".")[0]] += self_us / 1e6
+        if name == "backend.main":
+            total_us = cumulative_us
+    return total_us / 1e6, per_package
+
+
+def _free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def _wait_for(client: httpx.Client, url: str, status: int, started: float, timeout_s: float) -> Optional[float]:
+    while time.perf_counter() - started < timeout_s:
+        try:
+            if client.get(url).status_code == status:
+                return time.perf_counter() - started
+        except httpx.TransportError:
+            pass
+        time.sleep(0.01)
+    return None
+
+
+def _server_times(timeout_s: float) -> Tuple[Optional[float], Optional[float]]:
+    """(tid till första 200 på /, tid till 200 på /health/ready) för en nystartad uvicorn."""
+    port = _free_port()
+    started = time.perf_counter()
+    process = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "backend.main:app", "--host", "127.0.0.1", "--port", str(port), "--log-level", "warning"],
+        cwd=ROOT, env=ENV, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+    )
+    try:
+        with httpx.Client(base_url=f"http://127.0.0.1:{port}", timeout=1.0) as client:
+            first_200 = _wait_for(client, "/", 200, started, timeout_s)
+            ready = _wait_for(client, "/health/ready", 200, started, timeout_s)
+        return first_200, ready
+    finally:
+        process.terminate()
+        process.wait(timeout=10)
+
+
+def _median(values: List[Optional[float]]) -> str:
+    measured = [v for v in values if v is not None]
+    if not measured:
+        return "timeout"
+    return f"{statistics.median(measured) * 1000:8.0f} ms"
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--runs", type=int, default=3)
+    parser.add_argument("--top", type=int, default=12, help="Antal paket i importtabellen")
+    parser.add_argument("--no-server", action="store_true", help="Mät bara importtiden")
+    parser.add_argument("--timeout", type=float, default=60.0, help="Max väntan per serverstart (s)")
+    args = parser.parse_args()
+
+    totals: List[float] = []
+    packages: Dict[str, List[float]] = defaultdict(list)
+    for _ in range(args.runs):
+        total, per_package = _import_times()
+        totals.append(total)
+        for name, seconds in per_package.items():
+            packages[name].append(seconds)
+
+    print(f"import backend.main (median av {args.runs}): {_median(totals)}")
+    print(f"{'paket':<28} {'egen tid':>11}")
+    ranked = sorted(packages.items(), key=lambda item: statistics.median(item[1]), reverse=True)
+    for name, seconds in ranked[:args.top]:
+        print(f"{name:<28} {_median(seconds):>11}")
+
+    if args.no_server:
+        return
+    first_200s, readies = [], []
+    for _ in range(args.runs):
+        first_200, ready = _server_times(args.timeout)
+        first_200s.append(first_200)
+        readies.append(ready)
+    print()
+    print(f"uvicorn-start till första 200 på /   (median av {args.runs}): {_median(first_200s)}")
+    print(f"uvicorn-start till 200 på /health/ready (median av {args.runs}): {_median(readies)}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,122 @@
+"""Jämför SVG-renderarna i backend/svg_generator.py (svgwrite och den snabba textrenderaren).
+
+Användning:
+    python -m bench.bench_svg_render [--sizes 10,1000,100000] [--repeat 3] [--svgwrite-max 100000]
+
+För varje antal växter genereras en plan med ett begränsat antal växtstilar (som i stora parkplaner)
+och båda renderarna körs. Rapporten visar tid, storlek och gzip-storlek. För varje storlek kontrolleras
+också att utdata är visuellt likvärdiga: båda tolkas till samma lista av ritade former i ritordning
+(med <use> upplöst mot <defs>).
+"""
+import argparse
+import gzip
+import math
+import os
+import random
+import sys
+import time
+import xml.etree.ElementTree as ET
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from backend import svg_generator  # noqa: E402
+from backend.models import GardenPlanData  # noqa: E402
+
+SVG_NS = "{http://www.w3.org/2000/svg}"
+XLINK_HREF = "{http://www.w3.org/1999/xlink}href"
+COLORS = ["pink", "limegreen", "darkgreen", "lightblue", "purple", "gold", "white", "#8fbc8f"]
+NAMES = ["Stjärnflocka", "Jättedaggkåpa", "Svarta vinbär", "Kantnepeta", "Höstanemon", "Lavendel & timjan", "Rönn"]
+
+
+def _plan(count: int, seed: int = 1) -> GardenPlanData:
+    rng = random.Random(seed)
+    side = min(32000, max(500, int(math.sqrt(count) * 120))) # SVG Tiny tillåter inga tal över 32767
+    plants = [
+        {
+            "name": rng.choice(NAMES),
+            "x": rng.randrange(side),
+            "y": rng.randrange(side),
+            "diameter": rng.choice([30, 40, 50, 60, 80, 120, 300]),
+            "color_2d": rng.choice(COLORS),
+        }
+        for _ in range(count)
+    ]
+    paths = [{"points": [[0, y], [side, y], [side, y + 30], [0, y + 30]], "color": "lightgray"} for y in range(0, side, max(200, side // 20))]
+    return GardenPlanData(area_width_cm=side, area_height_cm=side, plants=plants, paths=paths)
+
+
+def _render(renderer: str, plan: GardenPlanData) -> str:
+    svg_generator.SVG_RENDERER = renderer
+    return svg_generator.create_2d_garden_svg(plan)
+
+
+def _shapes(svg: str):
+    """Ritade former i ordning, med ärvda och refererade attribut upplösta och tal normaliserade."""
+    root = ET.fromstring(svg)
+    defs = {el.get("id"): el for el in root.iter() if el.get("id")}
+
+    def num(value):
+        return round(float(str(value).replace("px", "")), 3)
+
+    def walk(element, inherited):
+        for child in element:
+            tag = child.tag.replace(SVG_NS, "")
+            attrs = {**inherited, **child.attrib}
+            if tag == "defs":
+                continue
+            if tag == "g":
+                yield from walk(child, {k: v for k, v in child.attrib.items()})
+            elif tag == "use":
+                ref = defs[(child.get(XLINK_HREF) or child.get("href")).lstrip("#")]
+                yield ("circle", num(child.get("x", 0)), num(child.get("y", 0)), num(ref.get("r")), ref.get("fill"), ref.get("stroke"))
+            elif tag == "circle":
+                yield ("circle", num(attrs["cx"]), num(attrs["cy"]), num(attrs["r"]), attrs.get("fill"), attrs.get("stroke"))
+            elif tag == "text":
+                yield ("text", num(attrs["x"]), num(attrs["y"]), num(attrs["font-size"]), attrs.get("fill"), child.text)
+            elif tag == "polygon":
+                yield ("polygon", tuple(num(v) for p in attrs["points"].split() for v in p.split(",")), attrs.get("fill"), attrs.get("stroke"))
+            elif tag == "rect":
+                yield ("rect", num(attrs["width"]), num(attrs["height"]), attrs.get("fill"))
+
+    return list(walk(root, {}))
+
+
+def _time(renderer: str, plan: GardenPlanData, repeat: int):
+    best = float("inf")
+    svg = ""
+    for _ in range(repeat):
+        started = time.perf_counter()
+        svg = _render(renderer, plan)
+        best = min(best, time.perf_counter() - started)
+    return best, svg
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", default="10,1000,100000")
+    parser.add_argument("--repeat", type=int, default=3, help="Bästa tid av så här många körningar")
+    parser.add_argument("--svgwrite-max", type=int, default=100000, help="Hoppa över svgwrite över så här många växter")
+    args = parser.parse_args()
+
+    import logging
+    logging.getLogger("backend.svg_generator").setLevel(logging.WARNING)
+
+    print(f"{'växter':>7} {'renderare':<9} {'tid (ms)':>10} {'storlek (kB)':>13} {'gzip (kB)':>10} {'likvärdig':>10}")
+    for size in (int(s) for s in args.sizes.split(",")):
+        plan = _plan(size)
+        fast_s, fast_svg = _time("fast", plan, args.repeat)
+        rows = [("fast", fast_s, fast_svg)]
+        equivalent = "-"
+        if size <= args.svgwrite_max:
+            slow_s, slow_svg = _time("svgwrite", plan, args.repeat)
+            rows.insert(0, ("svgwrite", slow_s, slow_svg))
+            equivalent = "ja" if _shapes(slow_svg) == _shapes(fast_svg) else "NEJ"
+        for name, seconds, svg in rows:
+            data = svg.encode("utf-8")
+            print(f"{size:>7} {name:<9} {seconds * 1000:>10.1f} {len(data) / 1024:>13.1f} {len(gzip.compress(data)) / 1024:>10.1f} {equivalent if name == 'fast' else '':>10}")
+        if len(rows) == 2:
+            print(f"{'':>7} {'':<9} {rows[0][1] / rows[1][1]:>9.1f}x {len(rows[1][2]) / len(rows[0][2]):>12.0%} av svgwrite-storleken")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,56 @@
+"""Mäter kostnaden för tracing.span (backend/tracing.py) med och utan TRACING_ENABLED.
+
+Användning:
+    python -m bench.bench_tracing [--spans 200000]
+
+Rapporten visar tid per span för en tom kropp: avstängd tracing, påslagen utan request (ingen
+Trace) och påslagen inuti en request, samt kostnaden för att bygga Server-Timing-headern.
+"""
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from backend import tracing  # noqa: E402
+
+STAGES = ("read_upload", "storage_upload", "vision_call", "design_call", "json_parse", "svg_render", "db_save")
+
+
+def _per_span_ns(count: int) -> float:
+    started = time.perf_counter()
+    for i in range(count):
+        with tracing.span(STAGES[i % len(STAGES)]):
+            pass
+    return (time.perf_counter() - started) / count * 1e9
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--spans", type=int, default=200000)
+    args = parser.parse_args()
+
+    tracing.TRACING_ENABLED = False
+    disabled = _per_span_ns(args.spans)
+    tracing.TRACING_ENABLED = True
+    no_trace = _per_span_ns(args.spans)
+    token = tracing._current_trace.set(tracing.Trace())
+    try:
+        in_request = _per_span_ns(args.spans)
+        started = time.perf_counter()
+        for _ in range(10000):
+            tracing._current_trace.get().server_timing()
+        header_us = (time.perf_counter() - started) / 10000 * 1e6
+    finally:
+        tracing._current_trace.reset(token)
+
+    print(f"{'läge':<28} {'ns per span':>12}")
+    print(f"{'avstängd':<28} {disabled:>12.0f}")
+    print(f"{'påslagen, utan request':<28} {no_trace:>12.0f}")
+    print(f"{'påslagen, i request':<28} {in_request:>12.0f}")
+    print(f"Server-Timing-header ({len(STAGES)} steg): {header_us:.1f} µs")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,333 @@
+"""Lokala ersättare för Vertex AI och Supabase, för bänkar och lasttester utan nätverk.
+
+Användning (innan appen startar):
+    from bench import fakes
+    vertex = fakes.FakeVertex(fakes.FakeVertexProfile(design_latency="lognormal:3000:0.4"))
+    storage = fakes.FakeSupabase(latency="uniform:20:60")
+    fakes.install(vertex, storage)
+
+FakeVertex ersätter GenerativeModel i backend/llm_clients.py: bildanalys och design svarar efter
+en slumpad latens (se parse_latency), designsvaret är en giltig plan med ett valbart antal växter,
+strömning delar upp svaret i bitar och fel kan läggas in med en viss andel. FakeSupabase ersätter
+Supabase-klienten med ett Storage-bucket och en garden_designs-tabell i minnet.
+"""
+import asyncio
+import json
+import math
+import random
+import re
+import threading
+import time
+from dataclasses import dataclass, field
+from datetime import datetime, timedelta, timezone
+from types import SimpleNamespace
+from typing import Callable, Dict, List, Optional
+
+
+def parse_latency(spec: str) -> Callable[[], float]:
+    """Latensfördelning i ms som en funktion som ger sekunder.
+
+    fixed:MS, uniform:MIN:MAX, normal:MEDEL:SD eller lognormal:MEDIAN:SIGMA (tunga svansar som hos
+    riktiga modellanrop). Ett ensamt tal betyder fixed.
+    """
+    kind, _, rest = spec.partition(":")
+    if not rest:
+        kind, rest = "fixed", spec
+    values = [float(v) for v in rest.split(":")]
+    if kind == "fixed":
+        return lambda: values[0] / 1000
+    if kind == "uniform":
+        return lambda: random.uniform(values[0], values[1]) / 1000
+    if kind == "normal":
+        return lambda: max(0.0, random.gauss(values[0], values[1])) / 1000
+    if kind == "lognormal":
+        mu = math.log(values[0])
+        return lambda: random.lognormvariate(mu, values[1]) / 1000
+    raise ValueError(f"Okänd latensfördelning: {spec}")
+
+
+PLANT_NAMES = (
+    ("Stjärnflocka", "Astrantia major", "pink"),
+    ("Jättedaggkåpa", "Alchemilla mollis", "limegreen"),
+    ("Svarta vinbär", "Ribes nigrum", "darkgreen"),
+    ("Kantnepeta", "Nepeta x faassenii", "lightblue"),
+    ("Höstanemon", "Anemone hupehensis", "rosa"), # Okänd SVG-färg, som modellen ibland svarar med
+    ("Lavendel", "Lavandula angustifolia", "purple"),
+)
+
+
+def _catalog_ids(prompt: str) -> List[str]:
+    # Id:n ur växtlistan som prompts.build_design_prompt lägger till med katalogen, en rad per
+    # kategori: "perenn: ast Stjärnflocka 0.6 m Ø40 rosa; alc Jättedaggkåpa ..."
+    _, found, listing = prompt.partition("Växtlista")
+    ids: List[str] = []
+    for line in listing.splitlines()[1:] if found else ():
+        _, _, entries = line.partition(": ")
+        ids.extend(entry.split(" ", 1)[0] for entry in entries.split("; ") if entry)
+    return ids
+
+
+def design_json(plants: int, rng: random.Random, catalog_ids: Optional[List[str]] = None) -> dict:
+    """Ett designsvar som LLMDesignOutput med plants växter utspridda (och ibland överlappande).
+
+    Med catalog_ids blir svaret det kompakta katalogsvaret (id och position per växt).
+    """
+    width, height = 600 + plants * 4, 400 + plants * 3
+
+    def plant() -> dict:
+        position = {"x": rng.randint(20, width - 20), "y": rng.randint(20, height - 80)}
+        if catalog_ids:
+            return {"id": rng.choice(catalog_ids), **position}
+        name, latin_name, color = rng.choice(PLANT_NAMES)
+        return {"name": name, "latin_name": latin_name, "color_2d": color, "height_3d": 0.6, **position, "diameter": rng.randint(30, 120)}
+
+    return {
+        "text_advice": "Jag föreslår en mysig stugträdgård med perenner i lager, en grusgång mot bänken och "
+                       "bärbuskar längs staketet. Vattna nyplanterat rikligt första sommaren och täck med barkflis.",
+        "garden_plan_data": {
+            "area_width_cm": width,
+            "area_height_cm": height,
+            "plants": [plant() for _ in range(plants)],
+            "paths": [{"points": [[0, height - 50], [width, height - 50], [width, height - 20], [0, height - 20]], "color": "lightgray"}],
+        },
+    }
+
+
+class FakeVertexError(Exception):
+    # Har .code som google.api_core-felen, så att llm_guard räknar 429/503 som överbelastning.
+    def __init__(self, code: int):
+        super().__init__(f"{code} från fejkmodellen")
+        self.code = code
+
+
+@dataclass
+class FakeVertexProfile:
+    vision_latency: str = "lognormal:1200:0.3"
+    design_latency: str = "lognormal:6000:0.35"
+    error_rate: float = 0.0 # Andel anrop som misslyckas
+    error_codes: List[int] = field(default_factory=lambda: [503, 429])
+    plants: int = 12 # Växter per designsvar
+    stream_chunks: int = 20 # Bitar per strömmat svar; latensen fördelas jämnt över dem
+    seed: Optional[int] = None
+
+
+def _response(text: str, prompt_tokens: int = 0, output_tokens: int = 0):
+    return SimpleNamespace(
+        candidates=[SimpleNamespace(content=SimpleNamespace(parts=[SimpleNamespace(text=text)]))],
+        usage_metadata=SimpleNamespace(
+            prompt_token_count=prompt_tokens, cached_content_token_count=0, candidates_token_count=output_tokens
+        ),
+    )
+
+
+class FakeVertex:
+    """Fabrik för fejkade modellhandtag, med räknare för anrop och fel."""
+
+    def __init__(self, profile: FakeVertexProfile):
+        self.profile = profile
+        self.rng = random.Random(profile.seed)
+        self._vision_latency = parse_latency(profile.vision_latency)
+        self._design_latency = parse_latency(profile.design_latency)
+        self.calls: Dict[str, int] = {"vision": 0, "design": 0, "errors": 0}
+
+    def model(self, model_id, generation_config=None, system_instruction=None):
+        return FakeGenerativeModel(self, model_id, generation_config, system_instruction)
+
+    def _maybe_fail(self):
+        if self.profile.error_rate and self.rng.random() < self.profile.error_rate:
+            self.calls["errors"] += 1
+            raise FakeVertexError(self.rng.choice(self.profile.error_codes))
+
+
+class FakeGenerativeModel:
+    def __init__(self, vertex: FakeVertex, model_id, generation_config=None, system_instruction=None):
+        self.vertex = vertex
+        self.model_id = model_id
+        self.generation_config = generation_config or {}
+        self.system_instruction = system_instruction
+
+    def _is_variants(self) -> bool:
+        schema = self.generation_config.get("response_schema") or {}
+        return "variants" in (schema.get("properties") or {})
+
+    def _design_text(self, prompt: str) -> str:
+        # Med växtlistan i frågan väljer fejkmodellen id:n ur den, som en riktig modell skulle göra.
+        catalog_ids = _catalog_ids(prompt)
+        if self._is_variants():
+            match = re.search(r"Gör (\d+) olika förslag", prompt)
+            count = int(match.group(1)) if match else 1
+            data = {"variants": [design_json(self.vertex.profile.plants, self.vertex.rng, catalog_ids) for _ in range(count)]}
+        else:
+            data = design_json(self.vertex.profile.plants, self.vertex.rng, catalog_ids)
+        return json.dumps(data, ensure_ascii=False)
+
+    async def generate_content_async(self, contents, stream=False):
+        vertex = self.vertex
+        if isinstance(contents, list):
+            # Bildanalys: [bilddel, fråga]
+            vertex.calls["vision"] += 1
+            await asyncio.sleep(vertex._vision_latency())
+            vertex._maybe_fail()
+            return _response("Gräsmatta med en smal rabatt längs staketet, ett äppelträd i mitten. Mestadels soligt.", 1300, 60)
+
+        vertex.calls["design"] += 1
+        latency = vertex._design_latency()
+        text = self._design_text(contents)
+        prompt_tokens, output_tokens = len(contents) // 4, len(text) // 4
+        if not stream:
+            await asyncio.sleep(latency)
+            vertex._maybe_fail()
+            return _response(text, prompt_tokens, output_tokens)
+
+        # Första biten kommer efter en tredjedel av latensen, resten fördelas över bitarna.
+        await asyncio.sleep(latency / 3)
+        vertex._maybe_fail()
+        chunks = max(1, vertex.profile.stream_chunks)
+        size = math.ceil(len(text) / chunks)
+
+        async def chunk_stream():
+            for i in range(0, len(text), size):
+                if i:
+                    await asyncio.sleep(latency * 2 / 3 / chunks)
+                last = i + size >= len(text)
+                yield _response(text[i:i + size], prompt_tokens if last else 0, output_tokens if last else 0)
+
+        return chunk_stream()
+
+    async def count_tokens_async(self, contents):
+        return SimpleNamespace(total_tokens=len(str(contents)) // 4)
+
+
+class _Bucket:
+    def __init__(self, storage: "FakeSupabase", name: str):
+        self.storage = storage
+        self.name = name
+
+    def exists(self, path: str) -> bool:
+        self.storage._sleep()
+        return (self.name, path) in self.storage.objects
+
+    def upload(self, path: str, file: bytes, file_options: Optional[dict] = None):
+        self.storage._sleep(len(file))
+        with self.storage.lock:
+            self.storage.objects[(self.name, path)] = bytes(file)
+        return SimpleNamespace(path=path)
+
+    def get_public_url(self, path: str) -> str:
+        return f"http://fake-storage.local/{self.name}/{path}"
+
+
+_KEYSET = re.compile(r'created_at\.lt\."(?P<c>[^"]+)",and\(created_at\.eq\."(?P=c)",id\.lt\.(?P<id>\d+)\)')
+
+
+class _Query:
+    # Det urval av postgrest-byggaren som supabase_services använder.
+
+    def __init__(self, storage: "FakeSupabase", table: str):
+        self.storage = storage
+        self.table = table
+        self._columns: Optional[List[str]] = None
+        self._insert: Optional[List[dict]] = None
+        self._filters: List[Callable[[dict], bool]] = []
+        self._order: List[tuple] = []
+        self._limit: Optional[int] = None
+        self._negate = False
+
+    def select(self, columns: str):
+        self._columns = [c.strip() for c in columns.split(",")]
+        return self
+
+    def insert(self, rows):
+        self._insert = rows if isinstance(rows, list) else [rows]
+        return self
+
+    def _filter(self, test: Callable[[dict], bool]):
+        negate, self._negate = self._negate, False
+        self._filters.append((lambda row: not test(row)) if negate else test)
+        return self
+
+    @property
+    def not_(self):
+        self._negate = True
+        return self
+
+    def eq(self, column, value):
+        return self._filter(lambda row: row.get(column) == value)
+
+    def gt(self, column, value):
+        return self._filter(lambda row: row.get(column) is not None and row[column] > value)
+
+    def is_(self, column, value):
+        return self._filter(lambda row: row.get(column) is None if value == "null" else row.get(column) == value)
+
+    def or_(self, expression: str):
+        match = _KEYSET.fullmatch(expression)
+        if match is None:
+            raise NotImplementedError(f"FakeSupabase förstår inte or-filtret: {expression}")
+        created_at, row_id = match.group("c"), int(match.group("id"))
+        return self._filter(lambda row: row["created_at"] < created_at or (row["created_at"] == created_at and row["id"] < row_id))
+
+    def order(self, column, desc=False):
+        self._order.append((column, desc))
+        return self
+
+    def limit(self, count: int):
+        self._limit = count
+        return self
+
+    def execute(self):
+        storage = self.storage
+        if self._insert is not None:
+            storage._sleep(sum(len(json.dumps(r, default=str)) for r in self._insert))
+        with storage.lock:
+            rows = storage.tables.setdefault(self.table, [])
+            if self._insert is not None:
+                inserted = []
+                for row in self._insert:
+                    storage.next_id += 1
+                    created_at = (storage.epoch + timedelta(microseconds=storage.next_id)).isoformat()
+                    inserted.append({**row, "id": storage.next_id, "created_at": created_at})
+                rows.extend(inserted)
+                return SimpleNamespace(data=[dict(r) for r in inserted])
+            selected = [r for r in rows if all(f(r) for f in self._filters)]
+        storage._sleep()
+        for column, desc in reversed(self._order):
+            selected.sort(key=lambda r: r.get(column), reverse=desc)
+        if self._limit is not None:
+            selected = selected[:self._limit]
+        if self._columns and self._columns != ["*"]:
+            selected = [{c: r.get(c) for c in self._columns} for r in selected]
+        return SimpleNamespace(data=[dict(r) for r in selected])
+
+
+class FakeSupabase:
+    """Supabase-klient i minnet. Anropen är blockerande (som den riktiga) och körs i supabase_services trådpool."""
+
+    def __init__(self, latency: str = "uniform:20:60", bytes_per_ms: float = 0.0):
+        self._latency = parse_latency(latency)
+        self.bytes_per_ms = bytes_per_ms # Extra tid per byte, t.ex. för en långsam uplink; 0 = ingen
+        self.lock = threading.Lock()
+        self.objects: Dict[tuple, bytes] = {}
+        self.tables: Dict[str, List[dict]] = {}
+        self.next_id = 0
+        self.epoch = datetime.now(timezone.utc)
+        self.storage = SimpleNamespace(from_=lambda name: _Bucket(self, name))
+
+    def _sleep(self, size: int = 0):
+        time.sleep(self._latency() + (size / self.bytes_per_ms / 1000 if self.bytes_per_ms else 0))
+
+    def table(self, name: str) -> _Query:
+        return _Query(self, name)
+
+
+def install(vertex: Optional[FakeVertex] = None, storage: Optional[FakeSupabase] = None, tiers: Optional[List[str]] = None):
+    """Kopplar in fejkerna i backend-modulerna. Anropas innan appens lifespan startar."""
+    from backend import llm_clients, llm_services, supabase_services
+
+    if vertex is not None:
+        tiers = tiers or ["fake-gemini"]
+        llm_clients.GenerativeModel = vertex.model
+        llm_services.GEMINI_MODEL_TIERS = list(tiers)
+        llm_services.CHOSEN_GEMINI_MODEL = tiers[0]
+    if storage is not None:
+        supabase_services.supabase = storage
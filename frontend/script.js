@@ -8,6 +8,7 @@ document.addEventListener('DOMContentLoaded', () => {
     const timerSpan = document.getElementById('timer');
     const errorResultDiv = document.getElementById('errorResult');
     const backendApiUrl = 'https://DIN-EXTERNT-HOSTADE-BACKEND-URL.com/get_advice'; // <-- VIKTIGT: ÄNDRA DENNA!
+    const streamApiUrl = backendApiUrl + '/stream'; // Server-Sent Events, samma formulär
 
     // ... (imageUpload event listener som tidigare) ...
 
@@ -26,17 +27,13 @@ document.addEventListener('DOMContentLoaded', () => {
         const formData = new FormData(gardenForm);
 
         try {
-            const response = await fetch(backendApiUrl, { // Använd konfigurerad URL
+            // Strömmande variant: visa bildanalys och råd allteftersom servern skickar dem (Server-Sent Events).
+            const response = await fetch(streamApiUrl, { // Använd konfigurerad URL
                 method: 'POST',
                 body: formData,
             });
 
-            // ... (timer-rensning och loadingDiv-döljning) ...
-            clearInterval(timerInterval);
-            loadingDiv.style.display = 'none';
-
-
-            if (!response.ok) {
+            if (!response.ok || !response.body) {
                 let errorDetail = `Servern svarade med status ${response.status}.`;
                 try {
                     const errorData = await response.json();
@@ -47,8 +44,32 @@ document.addEventListener('DOMContentLoaded', () => {
                 throw new Error(errorDetail);
             }
 
-            const data = await response.json();
-            displayResults(data); // Funktion för att visa resultat
+            let adviceText = '';
+            let imageAnalysisText = null;
+            await readEventStream(response, (eventName, data) => {
+                if (eventName === 'image_analysis') {
+                    imageAnalysisText = data.image_analysis_text;
+                    displayImageAnalysis(imageAnalysisText);
+                    resultsContainer.style.display = 'block';
+                } else if (eventName === 'text_advice') {
+                    // Första texten är här: dölj spinnern och låt råden växa fram
+                    clearInterval(timerInterval);
+                    loadingDiv.style.display = 'none';
+                    adviceText += data.delta;
+                    gardenAdviceResultDiv.textContent = adviceText;
+                    resultsContainer.style.display = 'block';
+                } else if (eventName === 'garden_plan') {
+                    clearInterval(timerInterval);
+                    loadingDiv.style.display = 'none';
+                    // Slutlig, validerad text och plan; bildanalysen kom i en tidigare händelse.
+                    displayResults({ ...data, image_analysis_text: imageAnalysisText });
+                } else if (eventName === 'error') {
+                    throw new Error(data.detail || `Servern svarade med status ${data.status}.`);
+                }
+            });
+
+            clearInterval(timerInterval);
+            loadingDiv.style.display = 'none';
 
         } catch (error) {
             clearInterval(timerInterval);
@@ -59,13 +80,41 @@ document.addEventListener('DOMContentLoaded', () => {
         }
     });
 
-    function displayResults(data) {
-        if (data.image_analysis_text && data.image_analysis_text !== "Ingen bildanalys utförd (ingen bild skickad).") {
-            imageAnalysisResultDiv.textContent = data.image_analysis_text;
+    // Läser en text/event-stream från fetch-svaret och anropar onEvent(namn, data) för varje händelse.
+    async function readEventStream(response, onEvent) {
+        const reader = response.body.getReader();
+        const decoder = new TextDecoder();
+        let buffer = '';
+        while (true) {
+            const { value, done } = await reader.read();
+            if (done) break;
+            buffer += decoder.decode(value, { stream: true });
+            let separatorIndex;
+            while ((separatorIndex = buffer.indexOf('\n\n')) !== -1) {
+                const rawEvent = buffer.slice(0, separatorIndex);
+                buffer = buffer.slice(separatorIndex + 2);
+                let eventName = 'message';
+                let dataLines = [];
+                for (const line of rawEvent.split('\n')) {
+                    if (line.startsWith('event:')) eventName = line.slice(6).trim();
+                    else if (line.startsWith('data:')) dataLines.push(line.slice(5).trim());
+                }
+                if (dataLines.length) onEvent(eventName, JSON.parse(dataLines.join('\n')));
+            }
+        }
+    }
+
+    function displayImageAnalysis(text) {
+        if (text && text !== "Ingen bildanalys utförd (ingen bild skickad).") {
+            imageAnalysisResultDiv.textContent = text;
             imageAnalysisSection.style.display = 'block';
         } else {
             imageAnalysisSection.style.display = 'none';
         }
+    }
+
+    function displayResults(data) {
+        displayImageAnalysis(data.image_analysis_text);
         gardenAdviceResultDiv.textContent = data.text_advice;
         svgPlanContainer.innerHTML = data.svg_plan;
         resultsContainer.style.display = 'block';
@@ -0,0 +1,18 @@
+import os
+import sys
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from backend import supabase_services # noqa: E402
+from bench import fakes # noqa: E402
+
+
+@pytest.fixture
+def fake_supabase(monkeypatch):
+    """FakeSupabase (tabell och Storage i minnet) utan latens, inkopplad som Supabase-klient."""
+    storage = fakes.FakeSupabase(latency="0")
+    monkeypatch.setattr(supabase_services, "supabase", storage)
+    return storage
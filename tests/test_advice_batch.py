@@ -0,0 +1,52 @@
+import json
+
+from fastapi.testclient import TestClient
+
+from backend import advice_batch, advice_pipeline
+from backend.main import app
+from backend.models import BatchAdviceResponse
+
+
+def _files(count: int) -> list:
+    return [("imageFiles", (f"bild{i}.png", f"bild {i}".encode(), "image/png")) for i in range(count)]
+
+
+def _items(*image_indices) -> str:
+    return json.dumps([{"location": "Lund", "preferences": "Perenner", "image_index": i} for i in image_indices])
+
+
+def test_batch_rejects_more_images_than_items(monkeypatch):
+    read = []
+
+    async def read_image_file(request_id, image_file):
+        read.append(image_file.filename)
+        return None, None, ""
+
+    monkeypatch.setattr(advice_pipeline, "read_image_file", read_image_file)
+
+    response = TestClient(app).post("/get_advice/batch", data={"items": _items(0)}, files=_files(3))
+
+    assert response.status_code == 400
+    assert read == []
+
+
+def test_batch_reads_only_referenced_images(monkeypatch):
+    read = []
+    batches = []
+
+    async def read_image_file(request_id, image_file):
+        read.append(image_file.filename)
+        return b"bytes", "image/png", ""
+
+    async def run_batch(request_id, items, images):
+        batches.append(images)
+        return BatchAdviceResponse(results=[], succeeded=0, failed=0, unique_images=len(images), total_latency_ms=0.0)
+
+    monkeypatch.setattr(advice_pipeline, "read_image_file", read_image_file)
+    monkeypatch.setattr(advice_batch, "run_batch", run_batch)
+
+    response = TestClient(app).post("/get_advice/batch", data={"items": _items(2, None, 2)}, files=_files(3))
+
+    assert response.status_code == 200
+    assert read == ["bild2.png"]
+    assert list(batches[0]) == [2]
@@ -0,0 +1,43 @@
+import asyncio
+
+import pytest
+
+from backend import cache
+
+
+def test_backend_interface_is_abstract():
+    class Incomplete(cache.CacheBackend):
+        async def get(self, key):
+            return None
+
+    with pytest.raises(TypeError):
+        Incomplete()
+
+
+@pytest.mark.parametrize("kind", ["memory", "sqlite"])
+def test_namespaces_evict_independently(kind, monkeypatch, tmp_path):
+    monkeypatch.setattr(cache, "CACHE_BACKEND", kind)
+    monkeypatch.setattr(cache, "CACHE_SQLITE_PATH", str(tmp_path / "cache.sqlite3"))
+    monkeypatch.setattr(cache, "_backends", {})
+    monkeypatch.setenv("CACHE_MAX_ENTRIES_TEST_DESIGNS", "3")
+    analyses = cache.get_cache("test_analyses")
+    designs = cache.get_cache("test_designs")
+
+    async def scenario():
+        await analyses.set("bild", "analys")
+        for i in range(10):
+            await designs.set(f"sida{i}", i)
+        return (
+            await analyses.get("bild"),
+            [await designs.get(f"sida{i}") for i in range(10)],
+        )
+
+    try:
+        analysis, pages = asyncio.run(scenario())
+    finally:
+        for backend in cache._backends.values():
+            backend.close()
+
+    assert analysis == "analys"
+    assert pages == [None] * 7 + [7, 8, 9]
+    assert cache.get_cache("test_designs").backend is designs.backend
@@ -0,0 +1,91 @@
+import asyncio
+import json
+
+from backend import db_writer
+
+
+def _write_journal(path, rows):
+    with open(path, "w", encoding="utf-8") as journal:
+        for row in rows:
+            journal.write(json.dumps(row) + "\n")
+
+
+def _read_journal(path):
+    with open(path, encoding="utf-8") as journal:
+        return [json.loads(line) for line in journal if line.strip()]
+
+
+def _writer(tmp_path, insert_batch):
+    return db_writer.WriteBehindQueue("test", insert_batch, str(tmp_path / "journal.jsonl"), flush_interval_s=0.01, max_retries=0)
+
+
+def test_replay_groups_rows_by_columns_and_removes_journal(tmp_path):
+    inserts = []
+
+    async def insert_batch(rows):
+        inserts.append(rows)
+
+    writer = _writer(tmp_path, insert_batch)
+    _write_journal(writer.journal_path, [{"a": 1}, {"a": 2, "b": 1}, {"a": 3}])
+
+    async def scenario():
+        await writer.start()
+        await writer._replay_task
+        await writer.stop()
+
+    asyncio.run(scenario())
+    assert sorted(inserts, key=len) == [[{"a": 2, "b": 1}], [{"a": 1}, {"a": 3}]]
+    assert not (tmp_path / "journal.jsonl").exists()
+    assert not (tmp_path / "journal.jsonl.replaying").exists()
+
+
+def test_failed_replay_keeps_rows_in_journal(tmp_path):
+    async def insert_batch(rows):
+        raise RuntimeError("databasen svarar inte")
+
+    writer = _writer(tmp_path, insert_batch)
+    rows = [{"a": 1}, {"a": 2}]
+    _write_journal(writer.journal_path, rows)
+
+    async def scenario():
+        await writer.start()
+        await writer._replay_task
+        await writer.stop()
+
+    asyncio.run(scenario())
+    assert _read_journal(writer.journal_path) == rows
+    assert not (tmp_path / "journal.jsonl.replaying").exists()
+
+
+def test_interrupted_replay_is_picked_up_on_next_start(tmp_path):
+    inserts = []
+
+    async def insert_batch(rows):
+        inserts.append(rows)
+
+    writer = _writer(tmp_path, insert_batch)
+    _write_journal(writer.replaying_path, [{"a": 1}])
+    _write_journal(writer.journal_path, [{"a": 2}])
+
+    async def scenario():
+        await writer.start()
+        await writer._replay_task
+        await writer.stop()
+
+    asyncio.run(scenario())
+    assert inserts == [[{"a": 1}, {"a": 2}]]
+    assert not (tmp_path / "journal.jsonl.replaying").exists()
+
+
+def test_enqueue_without_worker_journals_before_stop_returns(tmp_path):
+    async def insert_batch(rows):
+        pass
+
+    writer = _writer(tmp_path, insert_batch)
+
+    async def scenario():
+        writer.enqueue({"a": 1})
+        await writer.stop()
+
+    asyncio.run(scenario())
+    assert _read_journal(writer.journal_path) == [{"a": 1}]
@@ -0,0 +1,120 @@
+import base64
+
+import pytest
+from fastapi.testclient import TestClient
+
+from backend import cache, design_history, plan_storage, supabase_services
+from backend.main import app
+from backend.models import GardenPlanData, PlantData
+
+
+@pytest.fixture
+def client(fake_supabase, monkeypatch):
+    monkeypatch.setattr(design_history, "DESIGNS_PUBLIC", True)
+    monkeypatch.setattr(design_history, "DESIGNS_API_TOKEN", None)
+    monkeypatch.setattr(design_history, "_cache", cache.Cache("designs", cache.MemoryCacheBackend()))
+    return TestClient(app)
+
+
+def _plan(width: int = 300) -> GardenPlanData:
+    return GardenPlanData(
+        area_width_cm=width,
+        area_height_cm=200,
+        plants=[PlantData(name="Lavendel", latin_name="Lavandula angustifolia", x=50, y=60, diameter=40, color_2d="purple")]
+    )
+
+
+def _insert(storage, count: int) -> list:
+    rows = [
+        supabase_services.build_garden_design_row(
+            {"location": f"Plats {i}", "preferences": "Perenner"}, "Analys", "Råd", _plan(300 + i)
+        )
+        for i in range(count)
+    ]
+    return storage.table("garden_designs").insert(rows).execute().data
+
+
+def test_list_pages_newest_first_with_next_cursor(client, fake_supabase):
+    inserted = _insert(fake_supabase, 5)
+    expected = [r["id"] for r in reversed(inserted)]
+
+    seen = []
+    cursor = None
+    for _ in range(3):
+        params = {"limit": 2, **({"cursor": cursor} if cursor else {})}
+        response = client.get("/designs", params=params)
+        assert response.status_code == 200
+        page = response.json()
+        seen.extend(d["id"] for d in page["designs"])
+        cursor = page["next_cursor"]
+        if cursor is None:
+            break
+
+    assert seen == expected
+    assert cursor is None
+    # Listan innehåller bara sammanfattningen, ingen plan eller SVG.
+    assert set(page["designs"][0]) == {"id", "created_at", "location", "preferences", "image_url"}
+
+
+def test_list_cursor_on_equal_created_at_uses_id(client, fake_supabase):
+    inserted = _insert(fake_supabase, 3)
+    for row in fake_supabase.tables["garden_designs"]:
+        row["created_at"] = inserted[0]["created_at"]
+
+    first = client.get("/designs", params={"limit": 1}).json()
+    rest = client.get("/designs", params={"limit": 5, "cursor": first["next_cursor"]}).json()
+
+    assert [d["id"] for d in first["designs"] + rest["designs"]] == [r["id"] for r in reversed(inserted)]
+    assert rest["next_cursor"] is None
+
+
+def test_list_etag_and_304(client, fake_supabase):
+    _insert(fake_supabase, 2)
+
+    first = client.get("/designs")
+    etag = first.headers["ETag"]
+    assert first.status_code == 200
+    assert first.headers["Cache-Control"] == "private, no-cache"
+
+    cached = client.get("/designs", headers={"If-None-Match": etag})
+    assert cached.status_code == 304
+    assert cached.content == b""
+    assert cached.headers["ETag"] == etag
+
+    assert client.get("/designs", headers={"If-None-Match": f'W/{etag}'}).status_code == 304
+    assert client.get("/designs", headers={"If-None-Match": '"annan"'}).status_code == 200
+
+
+@pytest.mark.parametrize("cursor", [
+    "inte-base64!",
+    base64.urlsafe_b64encode(b'["2024-01-01T00:00:00+00:00","1"]').decode().rstrip("="),
+    base64.urlsafe_b64encode(b'["x\\",id.gt.0,created_at.lt.\\"z",1]').decode().rstrip("="),
+])
+def test_list_invalid_cursor_is_400(client, fake_supabase, cursor):
+    response = client.get("/designs", params={"cursor": cursor})
+    assert response.status_code == 400
+
+
+def test_detail_renders_svg_from_plan_data(client, fake_supabase, monkeypatch):
+    monkeypatch.setattr(plan_storage, "PLAN_STORE_SVG", False)
+    row = _insert(fake_supabase, 1)[0]
+    assert "svg_plan" not in row
+
+    response = client.get(f"/designs/{row['id']}")
+    assert response.status_code == 200
+    detail = response.json()
+    assert detail["garden_plan_data"] == _plan(300).model_dump()
+    assert detail["svg_plan"] == plan_storage.render_svg(_plan(300))
+    assert detail["text_advice"] == "Råd"
+
+    assert client.get(f"/designs/{row['id']}", headers={"If-None-Match": response.headers["ETag"]}).status_code == 304
+    assert client.get(f"/designs/{row['id'] + 1}").status_code == 404
+
+
+def test_designs_closed_by_default(client, monkeypatch):
+    monkeypatch.setattr(design_history, "DESIGNS_PUBLIC", False)
+    assert client.get("/designs").status_code == 404
+
+    monkeypatch.setattr(design_history, "DESIGNS_API_TOKEN", "hemlig")
+    assert client.get("/designs").status_code == 401
+    assert client.get("/designs", headers={"Authorization": "Bearer hemlig"}).status_code == 200
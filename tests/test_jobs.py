@@ -0,0 +1,159 @@
+import asyncio
+
+import httpx
+import pytest
+from fastapi.testclient import TestClient
+
+from backend import advice_pipeline, jobs
+from backend.main import app
+from backend.models import AdviceResponse
+
+
+@pytest.mark.parametrize("priority", ["-1", "10", "1000000000"])
+def test_job_priority_out_of_range_is_422(priority):
+    response = TestClient(app).post("/jobs", data={"location": "Uppsala", "preferences": "Perenner", "priority": priority})
+    assert response.status_code == 422
+
+
+def test_submit_clamps_priority():
+    async def scenario():
+        manager = jobs.JobManager(workers=1)
+        await manager.start()
+        try:
+            high = manager.submit("Uppsala", "Perenner", None, None, "", priority=10**9)
+            low = manager.submit("Uppsala", "Perenner", None, None, "", priority=-5)
+        finally:
+            await manager.stop()
+        return high, low
+
+    high, low = asyncio.run(scenario())
+    assert (high.priority, low.priority) == (jobs.JOB_MAX_PRIORITY, jobs.JOB_MIN_PRIORITY)
+
+
+class _StubRun:
+    """Rådgivningskedjan utan bild och LLM; design() väntar tills testet öppnar grinden."""
+
+    gate: asyncio.Event
+
+    def __init__(self, request_id, location, preferences):
+        self.location = location
+        self.image_analysis_result = ""
+        self.stage_timings_ms = {}
+
+    async def start_image(self, contents, mime_type):
+        pass
+
+    async def image_analysis(self):
+        pass
+
+    async def design(self):
+        await self.gate.wait()
+        return f"Design för {self.location}"
+
+    async def finish(self, llm_output):
+        return AdviceResponse(text_advice=llm_output, svg_plan="<svg/>")
+
+    def cancel_pending(self):
+        pass
+
+
+class _Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def time(self):
+        return self.now
+
+
+@pytest.fixture
+def stub_jobs(monkeypatch):
+    # Liten kö (en worker, en väntande plats) och styrbar klocka för jobbens tidsstämplar och TTL.
+    clock = _Clock()
+    manager = jobs.JobManager(workers=1, queue_max=1, result_ttl_s=60)
+    monkeypatch.setattr(jobs, "job_manager", manager)
+    monkeypatch.setattr(jobs, "time", clock)
+    monkeypatch.setattr(advice_pipeline, "AdviceRun", _StubRun)
+    return manager, clock
+
+
+async def _post_job(client, location="Uppsala"):
+    return await client.post("/jobs", data={"location": location, "preferences": "Perenner"})
+
+
+async def _wait_for_status(client, job_id, status):
+    for _ in range(100):
+        response = await client.get(f"/jobs/{job_id}")
+        if response.json()["status"] == status:
+            return response
+        await asyncio.sleep(0)
+    raise AssertionError(f"Jobbet {job_id} blev aldrig {status}: {response.json()}")
+
+
+def _run_with_jobs(manager, scenario):
+    async def wrapper():
+        _StubRun.gate = asyncio.Event()
+        await manager.start()
+        try:
+            async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://test") as client:
+                return await scenario(client)
+        finally:
+            _StubRun.gate.set()
+            await manager.stop()
+
+    return asyncio.run(wrapper())
+
+
+def test_full_queue_is_429_with_retry_after(stub_jobs):
+    manager, _ = stub_jobs
+
+    async def scenario(client):
+        running = await _post_job(client, "Först")
+        await _wait_for_status(client, running.json()["job_id"], "running")
+        queued = await _post_job(client, "Väntar")
+        rejected = await _post_job(client, "Får inte plats")
+        return running, queued, rejected
+
+    running, queued, rejected = _run_with_jobs(manager, scenario)
+    assert (running.status_code, queued.status_code) == (202, 202)
+    assert rejected.status_code == 429
+    assert int(rejected.headers["Retry-After"]) >= 1
+
+
+def test_job_status_goes_from_queued_to_succeeded(stub_jobs):
+    manager, clock = stub_jobs
+
+    async def scenario(client):
+        created = await _post_job(client)
+        job_id = created.json()["job_id"]
+        running = await _wait_for_status(client, job_id, "running")
+        clock.now += 5
+        _StubRun.gate.set()
+        succeeded = await _wait_for_status(client, job_id, "succeeded")
+        return created, running, succeeded
+
+    created, running, succeeded = _run_with_jobs(manager, scenario)
+    assert created.status_code == 202
+    assert created.json()["status"] == "queued"
+    assert running.json()["result"] is None
+    body = succeeded.json()
+    assert body["result"]["text_advice"] == "Design för Uppsala"
+    assert body["finished_at"] - body["started_at"] == 5
+    assert "queue_wait" in body["stage_timings_ms"]
+
+
+def test_finished_job_expires_after_ttl(stub_jobs):
+    manager, clock = stub_jobs
+
+    async def scenario(client):
+        _StubRun.gate.set()
+        job_id = (await _post_job(client)).json()["job_id"]
+        await _wait_for_status(client, job_id, "succeeded")
+        clock.now += manager.result_ttl_s - 1
+        before_ttl = await client.get(f"/jobs/{job_id}")
+        clock.now += 2
+        after_ttl = await client.get(f"/jobs/{job_id}")
+        return before_ttl, after_ttl
+
+    before_ttl, after_ttl = _run_with_jobs(manager, scenario)
+    assert before_ttl.status_code == 200
+    assert after_ttl.status_code == 404
@@ -0,0 +1,94 @@
+import numpy as np
+
+from backend import layout
+from backend.models import GardenPlanData, PlantData
+
+
+def _brute_force_pairs(x, y, r, tolerance):
+    i, j = np.triu_indices(len(x), k=1)
+    hit = r[i] + r[j] - np.hypot(x[j] - x[i], y[j] - y[i]) > tolerance
+    return {(int(a), int(b)) for a, b in zip(i[hit], j[hit])}
+
+
+def test_overlaps_match_brute_force_with_oversized_plants():
+    rng = np.random.default_rng(1)
+    n = 400
+    x = rng.uniform(0, 1500, n)
+    y = rng.uniform(0, 1000, n)
+    r = rng.choice([10.0, 15.0, 20.0, 30.0], n)
+    r[:6] = rng.uniform(150, 400, 6) # Träd långt över rutstorleken
+    cell = layout._grid_cell(r)
+    assert (2 * r > cell).sum() >= 6
+
+    for tolerance in (layout.LAYOUT_TOLERANCE_CM, -layout.LAYOUT_TOLERANCE_CM):
+        i, j = layout._circle_overlaps(x, y, r, cell, tolerance)[:2]
+        found = {(int(min(a, b)), int(max(a, b))) for a, b in zip(i, j)}
+        assert len(found) == len(i)
+        assert found == _brute_force_pairs(x, y, r, tolerance)
+
+
+def test_repair_separates_plants_next_to_a_tree():
+    plants = [PlantData(name="Ek", x=300, y=300, diameter=400)]
+    plants += [PlantData(name=f"Perenn {k}", x=300 + 30 * k, y=300, diameter=40) for k in range(10)]
+    plan = GardenPlanData(area_width_cm=1000, area_height_cm=600, plants=plants)
+
+    report = layout.repair_plan(plan)
+
+    assert report.conflicts_found > 0
+    assert report.conflicts_remaining == 0
+
+
+class _StepClock:
+    """perf_counter som går fram en millisekund per avläsning, så att budgeten tar slut efter ett bestämt antal varv."""
+
+    def __init__(self):
+        self.now = 0.0
+
+    def perf_counter(self):
+        self.now += 0.001
+        return self.now
+
+
+def _crowded_plan():
+    rng = np.random.default_rng(2)
+    plants = [
+        PlantData(name=f"Perenn {k}", x=int(rng.integers(0, 800)), y=int(rng.integers(0, 500)), diameter=int(rng.choice([40, 60, 80])))
+        for k in range(80)
+    ]
+    return GardenPlanData(area_width_cm=800, area_height_cm=500, plants=plants)
+
+
+def _conflicts(plan):
+    x = np.array([p.x for p in plan.plants], dtype=np.float64)
+    y = np.array([p.y for p in plan.plants], dtype=np.float64)
+    r = np.array([p.diameter / 2 for p in plan.plants], dtype=np.float64)
+    return layout._count_conflicts(x, y, r, [], plan.area_width_cm, plan.area_height_cm, layout._grid_cell(r))
+
+
+def test_repair_does_nothing_without_budget(monkeypatch):
+    monkeypatch.setattr(layout, "LAYOUT_TIME_BUDGET_MS", 0)
+    plan = _crowded_plan()
+    before = [(p.x, p.y) for p in plan.plants]
+
+    report = layout.repair_plan(plan)
+
+    assert report.iterations == 0
+    assert report.plants_moved == 0
+    assert report.conflicts_remaining == report.conflicts_found > 0
+    assert [(p.x, p.y) for p in plan.plants] == before
+
+
+def test_repair_stops_when_budget_is_used_up_without_adding_conflicts(monkeypatch):
+    monkeypatch.setattr(layout, "LAYOUT_TIME_BUDGET_MS", 10**6)
+    unlimited = layout.repair_plan(_crowded_plan())
+    assert unlimited.conflicts_remaining == 0
+
+    monkeypatch.setattr(layout, "time", _StepClock())
+    monkeypatch.setattr(layout, "LAYOUT_TIME_BUDGET_MS", 30)
+    plan = _crowded_plan()
+
+    report = layout.repair_plan(plan)
+
+    assert 0 < report.iterations < unlimited.iterations
+    assert report.conflicts_remaining <= report.conflicts_found
+    assert _conflicts(plan) <= report.conflicts_found
@@ -0,0 +1,147 @@
+import asyncio
+
+import pytest
+
+from backend import llm_guard
+from bench import fakes
+
+LATENCY_TARGET_S = 10.0
+
+
+class _Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+class _FakeModel:
+    """Ett Gemini-anrop som tar latency_s på klockan och kastar error om det är satt."""
+
+    def __init__(self, clock: _Clock):
+        self.clock = clock
+        self.latency_s = 1.0
+        self.error = None
+        self.gate = None
+        self.calls = 0
+
+    async def generate(self):
+        self.calls += 1
+        if self.gate is not None:
+            await self.gate.wait()
+        self.clock.now += self.latency_s
+        if self.error is not None:
+            raise self.error
+
+
+@pytest.fixture
+def guarded(monkeypatch):
+    clock = _Clock()
+    model = _FakeModel(clock)
+    guard = llm_guard.LLMGuard("test", LATENCY_TARGET_S, clock=clock)
+    guard.limiter = llm_guard.AdaptiveLimiter("test", LATENCY_TARGET_S, initial=4, max_wait_s=0.01, clock=clock)
+    breaker = llm_guard.CircuitBreaker("test-model", min_calls=5, failure_ratio=0.5, open_s=30, clock=clock)
+    monkeypatch.setitem(llm_guard._breakers, "test-model", breaker)
+
+    async def call():
+        async with guard.call("test-model"):
+            await model.generate()
+
+    return guard, breaker, model, clock, call
+
+
+async def _call_ignoring(call, error_type):
+    try:
+        await call()
+    except error_type:
+        pass
+
+
+def test_limit_grows_while_used_and_fast(guarded):
+    guard, _, model, _, call = guarded
+
+    async def scenario():
+        model.gate = asyncio.Event()
+        calls = [asyncio.create_task(call()) for _ in range(guard.limiter.limit)]
+        await asyncio.sleep(0)
+        model.gate.set()
+        await asyncio.gather(*calls)
+
+    asyncio.run(scenario())
+    assert guard.limiter.status()["limit_exact"] > 4
+
+
+def test_limit_shrinks_once_per_burst_of_overload_errors(guarded):
+    guard, _, model, clock, call = guarded
+    model.error = fakes.FakeVertexError(429)
+
+    async def scenario():
+        await _call_ignoring(call, fakes.FakeVertexError)
+        after_first = guard.limiter.status()["limit_exact"]
+        model.error = fakes.FakeVertexError(503)
+        await _call_ignoring(call, fakes.FakeVertexError)
+        after_burst = guard.limiter.status()["limit_exact"]
+        clock.now += LATENCY_TARGET_S
+        await _call_ignoring(call, fakes.FakeVertexError)
+        return after_first, after_burst, guard.limiter.status()["limit_exact"]
+
+    after_first, after_burst, after_next = asyncio.run(scenario())
+    assert after_first == pytest.approx(4 * llm_guard.LLM_LIMIT_BACKOFF)
+    assert after_burst == after_first
+    assert after_next == pytest.approx(4 * llm_guard.LLM_LIMIT_BACKOFF ** 2)
+
+
+def test_slow_call_shrinks_limit(guarded):
+    guard, _, model, _, call = guarded
+    model.latency_s = LATENCY_TARGET_S + 1
+
+    asyncio.run(call())
+    assert guard.limiter.status()["limit_exact"] == pytest.approx(4 * llm_guard.LLM_LIMIT_BACKOFF)
+
+
+def test_breaker_opens_rejects_fast_and_half_opens_after_cooldown(guarded):
+    _, breaker, model, clock, call = guarded
+    model.error = fakes.FakeVertexError(503)
+
+    async def scenario():
+        for _ in range(breaker.min_calls):
+            await _call_ignoring(call, fakes.FakeVertexError)
+        opened = breaker.state
+        calls_before = model.calls
+        with pytest.raises(llm_guard.CircuitOpenError) as rejected:
+            await call()
+        reached_model = model.calls != calls_before
+
+        clock.now += breaker.open_s
+        model.error = None
+        model.gate = asyncio.Event()
+        probe = asyncio.create_task(call())
+        await asyncio.sleep(0)
+        half_open = breaker.state
+        with pytest.raises(llm_guard.CircuitOpenError):
+            await call() # Bara ett provanrop åt gången
+        model.gate.set()
+        await probe
+        return opened, rejected.value.retry_after_s, reached_model, half_open
+
+    opened, retry_after_s, reached_model, half_open = asyncio.run(scenario())
+    assert opened == llm_guard.OPEN
+    assert retry_after_s == breaker.open_s
+    assert not reached_model
+    assert half_open == llm_guard.HALF_OPEN
+    assert breaker.state == llm_guard.CLOSED
+
+
+def test_failed_probe_opens_breaker_again(guarded):
+    _, breaker, model, clock, call = guarded
+    model.error = fakes.FakeVertexError(503)
+
+    async def scenario():
+        for _ in range(breaker.min_calls):
+            await _call_ignoring(call, fakes.FakeVertexError)
+        clock.now += breaker.open_s
+        await _call_ignoring(call, fakes.FakeVertexError)
+
+    asyncio.run(scenario())
+    assert breaker.state == llm_guard.OPEN
@@ -0,0 +1,62 @@
+import asyncio
+
+import pytest
+
+from backend import llm_clients, llm_services
+from bench import fakes
+
+
+class _DictCache:
+    def __init__(self):
+        self.entries = {}
+
+    async def get(self, key):
+        return self.entries.get(key)
+
+    async def set(self, key, value):
+        self.entries[key] = value
+
+
+class _TierModel:
+    def __init__(self, model_id, failing):
+        self.model_id = model_id
+        self.failing = failing
+
+    async def generate_content_async(self, contents):
+        if self.model_id in self.failing:
+            raise fakes.FakeVertexError(503)
+        return fakes._response(f"analys från {self.model_id}")
+
+
+@pytest.fixture
+def analysis(monkeypatch):
+    # Egna modell-id:n så att breakers och hedge-statistik inte delas med andra tester.
+    monkeypatch.setattr(llm_services, "CHOSEN_GEMINI_MODEL", "test-analys-pro")
+    monkeypatch.setattr(llm_services, "GEMINI_MODEL_TIERS", ["test-analys-pro", "test-analys-flash"])
+    monkeypatch.setattr(llm_clients, "_vertex_loaded", True)
+    analysis_cache = _DictCache()
+    monkeypatch.setattr(llm_services, "_image_analysis_cache", analysis_cache)
+    failing = set()
+    monkeypatch.setattr(
+        llm_clients.registry, "model", lambda model_id, config_name, generation_config=None, system_instruction=None: _TierModel(model_id, failing)
+    )
+    return analysis_cache, failing
+
+
+def _analyze(image_hash):
+    return asyncio.run(llm_services.analyze_image_with_google_llm(None, "image/jpeg", b"bild", image_hash))
+
+
+def test_primary_analysis_is_cached(analysis):
+    analysis_cache, _ = analysis
+
+    assert _analyze("hash-pro") == "analys från test-analys-pro"
+    assert analysis_cache.entries == {llm_services.image_analysis_cache_key("hash-pro"): "analys från test-analys-pro"}
+
+
+def test_fallback_analysis_is_not_cached_as_primary(analysis):
+    analysis_cache, failing = analysis
+    failing.add("test-analys-pro")
+
+    assert _analyze("hash-flash") == "analys från test-analys-flash"
+    assert analysis_cache.entries == {}
@@ -0,0 +1,34 @@
+import pytest
+
+from backend import db_writer, jobs, llm_services, plant_catalog, prompts, startup, supabase_services
+
+
+@pytest.fixture
+def ready_parts(monkeypatch):
+    # Allt utom växtkatalogen klart eller avstängt, utan att lifespan behöver köras.
+    monkeypatch.setattr(startup, "STARTUP_PRELOAD_ENABLED", False)
+    monkeypatch.setattr(llm_services, "CHOSEN_GEMINI_MODEL", None)
+    monkeypatch.setattr(supabase_services, "SUPABASE_URL", None)
+    monkeypatch.setattr(type(db_writer.garden_designs_writer), "running", property(lambda self: True))
+    monkeypatch.setattr(type(jobs.job_manager), "running", property(lambda self: True))
+    monkeypatch.setattr(prompts, "DESIGN_PROMPT_TEMPLATE", prompts.DESIGN_PROMPT_VERSION)
+
+
+def test_failed_plant_catalog_is_degraded_but_ready(ready_parts, monkeypatch, tmp_path):
+    catalog = plant_catalog.PlantCatalog(str(tmp_path / "saknas.csv"))
+    monkeypatch.setattr(plant_catalog, "catalog", catalog)
+    assert not catalog.available()
+
+    status = startup.Startup().status()
+
+    assert status["checks"]["plant_catalog"] == startup.DEGRADED
+    assert status["ready"] is True
+    assert prompts.design_prompt_version() == prompts.FREE_FORM_DESIGN_PROMPT_VERSION
+
+
+def test_failed_vertex_is_not_ready(ready_parts, monkeypatch):
+    monkeypatch.setattr(startup.Startup, "_vertex_state", lambda self: startup.FAILED)
+
+    status = startup.Startup().status()
+
+    assert status["ready"] is False
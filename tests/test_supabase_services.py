@@ -0,0 +1,54 @@
+import asyncio
+import time
+
+import httpx
+
+from backend import supabase_services
+from backend.main import app
+from bench import fakes
+
+UPLOAD_S = 0.5
+
+
+def test_root_answers_while_upload_is_slow(fake_supabase, monkeypatch):
+    def slow_upload(self, path, file, file_options=None):
+        time.sleep(UPLOAD_S) # Blockerande, som storage3
+        return None
+
+    monkeypatch.setattr(fakes._Bucket, "upload", slow_upload)
+
+    async def scenario():
+        upload = asyncio.create_task(supabase_services.upload_image_bytes(b"bild", "image/png", "langsam-uppladdning"))
+        await asyncio.sleep(0.05) # Låt uppladdningen hamna i trådpoolen
+
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+            started = time.perf_counter()
+            response = await client.get("/")
+            root_s = time.perf_counter() - started
+
+        upload_done_before_root = upload.done()
+        url, mime_type = await upload
+        return response, root_s, upload_done_before_root, url, mime_type
+
+    response, root_s, upload_done_before_root, url, mime_type = asyncio.run(scenario())
+
+    assert response.status_code == 200
+    assert not upload_done_before_root
+    assert root_s < UPLOAD_S / 5
+    assert url.endswith("/uploads/langsam-uppladdning.png")
+    assert mime_type == "image/png"
+
+
+def test_calls_work_after_a_restarted_lifespan(fake_supabase):
+    # Ny trådpool och semafor efter shutdown(), bundna till den nya lifespanens event-loop.
+    async def run_lifespan(row):
+        async with app.router.lifespan_context(app):
+            await supabase_services.insert_garden_designs([row])
+            return await supabase_services.select_garden_designs("id", limit=10)
+
+    first = asyncio.run(run_lifespan({"location": "Uppsala"}))
+    second = asyncio.run(run_lifespan({"location": "Lund"}))
+
+    assert len(first) == 1
+    assert len(second) == 2
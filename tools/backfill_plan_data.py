@@ -0,0 +1,122 @@
+"""Fyller i plan_data för gamla garden_designs-rader genom att tolka den sparade SVG:n, och visar storleken per rad.
+
+Användning:
+    python -m tools.backfill_plan_data [--dry-run] [--clear-svg] [--batch-size 200] [--encoding zlib|json]
+    python -m tools.backfill_plan_data --journal garden_designs_journal.jsonl
+
+Kolumnerna måste finnas innan verktyget körs (Supabase SQL-editor):
+
+    alter table garden_designs
+        add column if not exists plan_data text,
+        add column if not exists plan_encoding text,
+        add column if not exists plan_schema_version smallint,
+        add column if not exists plan_hash text;
+    alter table garden_designs alter column svg_plan drop not null;
+
+Rader utan plan_data hämtas i id-ordning, SVG:n tolkas med plan_storage.parse_svg_plan och raden
+uppdateras med plan-kolumnerna. Med --clear-svg töms svg_plan samtidigt. Rader vars SVG inte går
+att tolka (t.ex. fel-SVG:er) lämnas orörda och räknas som överhoppade. Latinskt namn och höjd
+finns inte i SVG:n och blir tomma.
+
+Med --journal läses rader från en lokal JSONL-fil (t.ex. write-behind-journalen) och bara
+storleksrapporten skrivs ut; inget skrivs till databasen.
+"""
+import argparse
+import json
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from backend import plan_storage  # noqa: E402
+
+
+class SizeReport:
+    def __init__(self):
+        self.rows = 0
+        self.skipped = 0
+        self.svg_bytes = 0
+        self.plan_bytes = 0
+
+    def add(self, svg: str, columns: dict):
+        self.rows += 1
+        self.svg_bytes += len(svg.encode("utf-8"))
+        # plan_data plus de små metadatakolumnerna, så att jämförelsen gäller hela planen i raden.
+        self.plan_bytes += sum(len(str(v).encode("utf-8")) for v in columns.values())
+
+    def show(self, encoding: str):
+        print(f"Rader: {self.rows} tolkade, {self.skipped} överhoppade")
+        if not self.rows:
+            return
+        before = self.svg_bytes / self.rows
+        after = self.plan_bytes / self.rows
+        print(f"Bytes per rad, {'svg_plan:':<26}{before:>10.0f}")
+        print(f"Bytes per rad, {f'plan-kolumner ({encoding}):':<26}{after:>10.0f}")
+        print(f"Minskning: {1 - after / before:.0%} ({(self.svg_bytes - self.plan_bytes) / 1024:.1f} kB totalt)")
+
+
+def _convert(row: dict, encoding: str, report: SizeReport):
+    svg = row.get("svg_plan") or ""
+    plan = plan_storage.parse_svg_plan(svg)
+    if plan is None:
+        report.skipped += 1
+        return None
+    columns = plan_storage.encode_plan(plan, encoding)
+    report.add(svg, columns)
+    return columns
+
+
+def _from_journal(path: str, encoding: str, report: SizeReport):
+    with open(path, "r", encoding="utf-8") as journal:
+        for line in journal:
+            if line.strip():
+                _convert(json.loads(line), encoding, report)
+
+
+def _from_supabase(args, report: SizeReport):
+    from backend import supabase_services
+
+    client = supabase_services.get_client()
+    if client is None:
+        sys.exit("Supabase-klienten är inte konfigurerad (SUPABASE_URL/SUPABASE_KEY).")
+    table = client.table("garden_designs")
+    last_id = None
+    while True:
+        query = table.select("id, svg_plan").is_("plan_data", "null").not_.is_("svg_plan", "null").order("id").limit(args.batch_size)
+        if last_id is not None:
+            query = query.gt("id", last_id)
+        rows = query.execute().data or []
+        if not rows:
+            break
+        for row in rows:
+            columns = _convert(row, args.encoding, report)
+            if columns is None or args.dry_run:
+                continue
+            if args.clear_svg:
+                columns["svg_plan"] = None
+            table.update(columns).eq("id", row["id"]).execute()
+        last_id = rows[-1]["id"]
+        print(f"... {report.rows + report.skipped} rader behandlade (senaste id {last_id})")
+        if len(rows) < args.batch_size:
+            break
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--dry-run", action="store_true", help="Tolka och rapportera utan att uppdatera")
+    parser.add_argument("--clear-svg", action="store_true", help="Töm svg_plan i uppdaterade rader")
+    parser.add_argument("--batch-size", type=int, default=200)
+    parser.add_argument("--encoding", default=plan_storage.PLAN_STORAGE_ENCODING, choices=[plan_storage.ENCODING_ZLIB, plan_storage.ENCODING_JSON])
+    parser.add_argument("--journal", help="Läs rader från en JSONL-fil istället för Supabase (bara rapport)")
+    args = parser.parse_args()
+
+    report = SizeReport()
+    if args.journal:
+        _from_journal(args.journal, args.encoding, report)
+    else:
+        _from_supabase(args, report)
+    report.show(args.encoding)
+
+
+if __name__ == "__main__":
+    main()
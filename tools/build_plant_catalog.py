@@ -0,0 +1,33 @@
+"""Bygger växtkatalogen som en SQLite-fil med index, för PLANT_CATALOG_PATH i drift.
+
+Användning:
+    python -m tools.build_plant_catalog [--csv backend/data/plant_catalog.csv] [--out plant_catalog.sqlite]
+
+Standard är att appen läser CSV-filen till en databas i minnet vid start (några millisekunder).
+En färdigbyggd fil öppnas i stället skrivskyddad och minnesmappad, så att flera uvicorn-workers
+delar samma sidor i stället för en egen kopia var. Filen skrivs över om den finns.
+"""
+import argparse
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from backend import plant_catalog  # noqa: E402
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--csv", default=os.path.join(os.path.dirname(plant_catalog.__file__), "data", "plant_catalog.csv"))
+    parser.add_argument("--out", default="plant_catalog.sqlite")
+    args = parser.parse_args()
+
+    if os.path.exists(args.out):
+        os.remove(args.out)
+    count = plant_catalog.build_database(args.csv, args.out)
+    print(f"{count} växter från {args.csv} -> {args.out} ({os.path.getsize(args.out) / 1024:.0f} kB)")
+    print(f"Sätt PLANT_CATALOG_PATH={os.path.abspath(args.out)} för att använda filen.")
+
+
+if __name__ == "__main__":
+    main()